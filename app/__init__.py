@@ -6,18 +6,58 @@ from config import Config
 db = SQLAlchemy()
 login = LoginManager()
 login.login_view = 'auth.login'
+# The JSON API answers 401 instead of redirecting to the login page
+login.blueprint_login_views['api'] = None
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    from . import database
+    if 'SQLALCHEMY_ENGINE_OPTIONS' not in app.config:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database.engine_options(app.config)
     db.init_app(app)
+    database.init_app(app, db)
+
+    from .services.metrics import instrumentation
+    instrumentation.init_app(app, db)
     login.init_app(app)
 
-    from .routes import auth, main, portfolio
+    from .services.quote_cache import quote_cache
+    quote_cache.init_app(app)
+
+    from .services import market_data
+    market_data.init_app(app)
+
+    from .services.symbols import symbol_index
+    symbol_index.init_app(app)
+
+    from .services.history import price_history
+    price_history.init_app(app)
+
+    from .services.fx import fx_rates
+    fx_rates.init_app(app)
+
+    from .services.write_behind import write_buffer
+    write_buffer.init_app(app)
+
+    from .services.render_cache import render_cache
+    render_cache.init_app(app)
+
+    from .routes import auth, main, portfolio, api
     app.register_blueprint(auth.bp)
     app.register_blueprint(main.bp)
     app.register_blueprint(portfolio.bp)
+    app.register_blueprint(api.bp)
+
+    from . import cli
+    cli.init_app(app)
+
+    from .services.refresher import refresher
+    refresher.init_app(app)
+
+    from .services.price_stream import price_hub
+    price_hub.init_app(app)
 
     return app
 
@@ -25,4 +65,5 @@ from . import models
 
 @login.user_loader
 def load_user(id):
-    return models.User.query.get(int(id))
+    # Session.get checks the identity map first, so later lookups of the user are free
+    return db.session.get(models.User, int(id))
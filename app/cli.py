@@ -0,0 +1,75 @@
+import click
+from flask.cli import with_appcontext
+from app import db
+from app.migrations import upgrade
+from app.models import Portfolio
+from app.services.importer import import_holdings, ImportFormatError
+from app.services.market_data import fetch_symbol_universe
+from app.services.refresher import refresher
+from app.services.symbols import symbol_index
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Create missing tables and columns."""
+    upgrade()
+    click.echo('Database is up to date.')
+
+@click.command('refresh-prices')
+@click.option('--once', is_flag=True, help='Refresh due symbols once and exit.')
+@with_appcontext
+def refresh_prices_command(once):
+    """Refresh holding prices in the foreground."""
+    if once:
+        click.echo(f'Refreshed {refresher.refresh_once()} symbols.')
+        return
+    # Run in the foreground instead of the in-app thread
+    refresher.stop()
+    click.echo(f'Refreshing prices every {refresher.interval}s (Ctrl+C to stop)...')
+    try:
+        refresher.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+@click.command('update-history')
+@with_appcontext
+def update_history_command():
+    """Download missing daily closes for every held symbol."""
+    written = refresher.update_history()
+    click.echo(f'Appended {sum(written.values())} rows for {len(written)} symbols.')
+
+@click.command('update-symbols')
+@click.option('--api-key', envvar='TWELVE_DATA_API_KEY', help='Twelve Data API key.')
+@with_appcontext
+def update_symbols_command(api_key):
+    """Download the symbol universe used for validation and autocomplete."""
+    rows = fetch_symbol_universe(api_key)
+    symbol_index.write(rows)
+    click.echo(f'Wrote {len(rows)} symbols to {symbol_index.path}.')
+
+@click.command('import-holdings')
+@click.argument('portfolio_id', type=int)
+@click.argument('file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--replace', is_flag=True, help='Replace the units of existing holdings instead of adding to them.')
+@with_appcontext
+def import_holdings_command(portfolio_id, file, replace):
+    """Import holdings into a portfolio from a CSV file or broker export."""
+    portfolio = db.session.get(Portfolio, portfolio_id)
+    if portfolio is None:
+        raise click.ClickException(f'Portfolio {portfolio_id} not found.')
+    try:
+        report = import_holdings(portfolio, file, api_key=portfolio.owner.api_key,
+                                 mode='replace' if replace else 'add')
+    except ImportFormatError as e:
+        raise click.ClickException(str(e))
+    for line, message in report['errors']:
+        click.echo(f'line {line}: {message}', err=True)
+    click.echo(f"Read {report['rows']} rows: {report['imported']} added, "
+               f"{report['updated']} updated, {report['error_count']} errors.")
+
+def init_app(app):
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(refresh_prices_command)
+    app.cli.add_command(update_symbols_command)
+    app.cli.add_command(update_history_command)
+    app.cli.add_command(import_holdings_command)
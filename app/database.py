@@ -0,0 +1,43 @@
+from sqlalchemy import event
+
+def is_memory_sqlite(uri):
+    return uri in ('sqlite://', 'sqlite:///:memory:') or uri.startswith('sqlite:///:memory:?')
+
+def engine_options(config):
+    """
+    Builds SQLALCHEMY_ENGINE_OPTIONS from the DB_* settings in Config.
+    In-memory SQLite runs on a single static connection, so it gets no pool settings.
+    """
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    options = {'pool_pre_ping': config.get('DB_POOL_PRE_PING', True)}
+    if not is_memory_sqlite(uri):
+        options.update(
+            pool_size=config.get('DB_POOL_SIZE', 5),
+            max_overflow=config.get('DB_MAX_OVERFLOW', 10),
+            pool_recycle=config.get('DB_POOL_RECYCLE', 1800),
+            pool_timeout=config.get('DB_POOL_TIMEOUT', 30),
+        )
+    if uri.startswith('sqlite'):
+        # busy_timeout below does the waiting; the driver timeout only matters before it is set
+        options['connect_args'] = {'timeout': config.get('SQLITE_BUSY_TIMEOUT', 5000) / 1000}
+    return options
+
+def init_app(app, db):
+    """Applies the SQLite pragmas from Config to every new connection."""
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+
+    journal_mode = app.config.get('SQLITE_JOURNAL_MODE', 'WAL')
+    synchronous = app.config.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    busy_timeout = int(app.config.get('SQLITE_BUSY_TIMEOUT', 5000))
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL lets readers keep reading while a writer commits
+        cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+        cursor.execute(f'PRAGMA synchronous={synchronous}')
+        cursor.execute(f'PRAGMA busy_timeout={busy_timeout}')
+        cursor.close()
@@ -0,0 +1,85 @@
+from datetime import date, datetime
+from sqlalchemy import inspect, text
+from . import db
+from .services.fx import infer_currency
+
+# Columns added after the first release. db.create_all() only creates missing
+# tables, so existing databases get these through ALTER TABLE.
+ADDED_COLUMNS = [
+    ('portfolio', 'last_viewed', 'DATETIME'),
+    ('portfolio', 'holdings_version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('portfolio', 'base_currency', 'VARCHAR(3)'),
+    ('quote', 'currency', 'VARCHAR(3)'),
+    ('portfolio', 'transaction_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('holding', 'cost_basis', 'FLOAT'),
+    ('holding', 'realized_gain', 'FLOAT'),
+]
+
+def upgrade():
+    """
+    Brings an existing database up to the current models.
+    Safe to run on every start: each step checks what is already there.
+    """
+    db.create_all()
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            existing = {c['name'] for c in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+        migrate_holding_prices(conn, inspector)
+        backfill_quote_currencies(conn)
+        open_ledgers(conn)
+        # Indexes declared on the models after their tables already existed
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+def migrate_holding_prices(conn, inspector):
+    """
+    Copies prices from the old per-holding columns into the quote table.
+    For each symbol the most recently stored price wins. Symbols that already
+    have a quote are left alone, and the old columns are kept, so nothing is lost
+    and running this twice is harmless.
+    """
+    columns = {c['name'] for c in inspector.get_columns('holding')}
+    if 'last_price' not in columns:
+        return
+    # Databases from before the background refresher have no per-holding update time
+    updated_at = 'last_price_updated_at' if 'last_price_updated_at' in columns else 'NULL'
+    rows = conn.execute(text(
+        f'SELECT symbol, last_price, last_price_timestamp, {updated_at} FROM holding '
+        'WHERE last_price IS NOT NULL '
+        'AND symbol NOT IN (SELECT symbol FROM quote) '
+        f'ORDER BY {updated_at} IS NULL, {updated_at} DESC, id DESC'
+    )).fetchall()
+    latest = {}
+    for symbol, price, timestamp, updated in rows:
+        latest.setdefault(symbol, {'symbol': symbol, 'price': price, 'timestamp': timestamp, 'updated_at': updated})
+    if latest:
+        conn.execute(text(
+            'INSERT INTO quote (symbol, price, timestamp, updated_at) '
+            'VALUES (:symbol, :price, :timestamp, :updated_at)'
+        ), list(latest.values()))
+
+def backfill_quote_currencies(conn):
+    """Gives stored quotes from before currencies the currency their symbol implies."""
+    symbols = [s for s, in conn.execute(text('SELECT symbol FROM quote WHERE currency IS NULL'))]
+    if symbols:
+        conn.execute(text('UPDATE quote SET currency = :currency WHERE symbol = :symbol'),
+                     [{'symbol': s, 'currency': infer_currency(s)} for s in symbols])
+
+def open_ledgers(conn):
+    """
+    Records the units of holdings from before the ledger as opening balances.
+    Their cost basis is not known; their realized gains start at zero. Holdings
+    that already have a ledger are left alone, including gains it left unknown.
+    """
+    unopened = ('NOT EXISTS (SELECT 1 FROM ledger_transaction t '
+                'WHERE t.portfolio_id = holding.portfolio_id AND t.symbol = holding.symbol)')
+    # Before the insert below, which makes these holdings opened
+    conn.execute(text(f'UPDATE holding SET realized_gain = 0 WHERE realized_gain IS NULL AND {unopened}'))
+    conn.execute(text(
+        'INSERT INTO ledger_transaction (portfolio_id, symbol, kind, units, date, created_at) '
+        f"SELECT portfolio_id, symbol, 'open', units, :today, :now FROM holding WHERE {unopened}"
+    ), {'today': date.today(), 'now': datetime.utcnow()})
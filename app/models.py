@@ -1,13 +1,19 @@
+from datetime import datetime
 from . import db
 from flask_login import UserMixin
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from werkzeug.security import generate_password_hash, check_password_hash
 
+def _implied_currency(symbol):
+    from app.services.fx import infer_currency # fx imports the models
+    return infer_currency(symbol)
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
     password_hash = db.Column(db.String(128))
     api_key = db.Column(db.String(128)) # Twelve Data API Key
-    portfolios = db.relationship('Portfolio', backref='owner', lazy='dynamic')
+    portfolios = db.relationship('Portfolio', backref='owner', order_by='Portfolio.id')
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password, method='pbkdf2:sha256')
@@ -19,14 +25,118 @@ class Portfolio(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), nullable=False)
     type = db.Column(db.String(64)) # e.g., RRSP, TFSA
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    holdings = db.relationship('Holding', backref='portfolio', lazy='dynamic', cascade="all, delete-orphan")
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    last_viewed = db.Column(db.DateTime) # drives refresh priority, see services/refresher.py
+    # Bumped whenever holdings change; part of the API's ETags, see routes/api.py
+    holdings_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Currency the portfolio is valued in; None sums holdings unconverted, as before currencies
+    base_currency = db.Column(db.String(3))
+    # Ledger transactions recorded so far; every LEDGER_SNAPSHOT_INTERVAL of them a snapshot is taken
+    transaction_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    holdings = db.relationship('Holding', backref='portfolio', order_by='Holding.id', cascade="all, delete-orphan")
+    transactions = db.relationship('Transaction', cascade="all, delete-orphan")
+    snapshots = db.relationship('PositionSnapshot', cascade="all, delete-orphan")
+
+    def bump_version(self):
+        """Marks the holdings as changed. The caller commits."""
+        self.holdings_version = (self.holdings_version or 0) + 1
 
 class Holding(db.Model):
+    __table_args__ = (
+        # Serves lookups by portfolio (leftmost column) and per-portfolio symbol lookups
+        db.Index('ix_holding_portfolio_symbol', 'portfolio_id', 'symbol'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    symbol = db.Column(db.String(10), nullable=False)
+    symbol = db.Column(db.String(10), nullable=False, index=True) # joins to quote, refresher GROUP BY
     units = db.Column(db.Float, nullable=False)
     target_percentage = db.Column(db.Float, default=0.0)
-    last_price = db.Column(db.Float)
-    last_price_timestamp = db.Column(db.String(64))
     portfolio_id = db.Column(db.Integer, db.ForeignKey('portfolio.id'), nullable=False)
+    # The current position as the ledger left it, see services/ledger.py; None means unknown
+    cost_basis = db.Column(db.Float) # total book cost of the units held, average cost method
+    realized_gain = db.Column(db.Float)
+    # Prices are shared by every holding of a symbol; loaded in the same statement
+    quote = db.relationship('Quote', primaryjoin='foreign(Holding.symbol) == Quote.symbol',
+                            viewonly=True, lazy='joined')
+
+class Transaction(db.Model):
+    """A ledger entry: a buy or sell, or an opening balance of unknown cost."""
+    __tablename__ = 'ledger_transaction' # TRANSACTION is an SQL keyword
+    __table_args__ = (
+        # Ledger order within a portfolio; replays and as-of queries range over it
+        db.Index('ix_ledger_transaction_portfolio_date', 'portfolio_id', 'date', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    portfolio_id = db.Column(db.Integer, db.ForeignKey('portfolio.id'), nullable=False)
+    symbol = db.Column(db.String(10), nullable=False)
+    kind = db.Column(db.String(8), nullable=False) # 'buy', 'sell' or 'open'
+    units = db.Column(db.Float, nullable=False) # always positive; the kind gives the direction
+    price = db.Column(db.Float) # per unit, in the listing currency; None if not known
+    date = db.Column(db.Date, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PositionSnapshot(db.Model):
+    """A portfolio's positions after one of its transactions, see services/ledger.py."""
+    __table_args__ = (
+        db.Index('ix_position_snapshot_portfolio_date', 'portfolio_id', 'date', 'transaction_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    portfolio_id = db.Column(db.Integer, db.ForeignKey('portfolio.id'), nullable=False)
+    transaction_id = db.Column(db.Integer, nullable=False) # the last transaction included
+    date = db.Column(db.Date, nullable=False) # that transaction's date
+    symbol = db.Column(db.String(10), nullable=False)
+    units = db.Column(db.Float, nullable=False)
+    cost_basis = db.Column(db.Float)
+    realized_gain = db.Column(db.Float)
+
+class Quote(db.Model):
+    symbol = db.Column(db.String(10), primary_key=True)
+    price = db.Column(db.Float)
+    timestamp = db.Column(db.String(64)) # provider's quote time, as reported
+    # Listing currency, by default the one the symbol implies; FX pairs ('USD/CAD') are quoted in the second
+    currency = db.Column(db.String(3), default=lambda context: _implied_currency(context.get_current_parameters()['symbol']))
+    updated_at = db.Column(db.DateTime) # when the quote was last stored
+
+    UPSERT_CHUNK = 500 # rows per statement, well under SQLite's bound-parameter limit
+
+    @classmethod
+    def upsert_many(cls, prices, updated_at=None, only_changed=False, session=None):
+        """
+        Stores {symbol: {'price', 'timestamp'[, 'currency', 'updated_at']}} with one
+        INSERT ... ON CONFLICT statement (per chunk) instead of one UPDATE per
+        holding. Quotes without a currency get the one their symbol implies.
+        With only_changed, stored quotes with the same price, timestamp and
+        currency are left alone (SQLite and PostgreSQL). The caller commits.
+        """
+        session = session or db.session
+        updated_at = updated_at or datetime.utcnow()
+        rows = [{'symbol': symbol, 'price': q['price'], 'timestamp': q['timestamp'],
+                 'currency': q.get('currency') or _implied_currency(symbol),
+                 'updated_at': q.get('updated_at') or updated_at}
+                for symbol, q in prices.items()]
+        dialect = session.get_bind().dialect.name
+        for start in range(0, len(rows), cls.UPSERT_CHUNK):
+            chunk = rows[start:start + cls.UPSERT_CHUNK]
+            if dialect in ('sqlite', 'postgresql'):
+                insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+                stmt = insert(cls).values(chunk)
+                where = None
+                if only_changed:
+                    where = cls.price.is_distinct_from(stmt.excluded.price) | \
+                        cls.timestamp.is_distinct_from(stmt.excluded.timestamp) | \
+                        cls.currency.is_distinct_from(stmt.excluded.currency)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[cls.symbol],
+                    set_={c: stmt.excluded[c] for c in ('price', 'timestamp', 'currency', 'updated_at')},
+                    where=where)
+            elif dialect in ('mysql', 'mariadb'):
+                stmt = mysql.insert(cls).values(chunk)
+                stmt = stmt.on_duplicate_key_update(
+                    {c: stmt.inserted[c] for c in ('price', 'timestamp', 'currency', 'updated_at')})
+            else:
+                for row in chunk:
+                    session.merge(cls(**row))
+                continue
+            session.execute(stmt)
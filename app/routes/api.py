@@ -0,0 +1,129 @@
+import hashlib
+from flask import Blueprint, Response, jsonify, request, abort
+from flask_login import login_required, current_user
+from app import db
+from app.models import Portfolio
+from app.routes.portfolio import touch_portfolio
+from app.services.fx import fx_rates
+from app.services.valuation import value_holdings, portfolio_summaries, portfolio_version
+
+bp = Blueprint('api', __name__, url_prefix='/api')
+
+def make_etag(*parts):
+    """Hashes the inputs a response depends on, plus the requested fields."""
+    key = repr((current_user.id, request.args.get('fields', ''), parts))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def not_modified(etag):
+    """Returns a 304 response if the client already has this version, else None."""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return None
+
+def parse_fields():
+    """
+    Parses ?fields=id,total_value,holdings.symbol into {'id': None,
+    'total_value': None, 'holdings': {'symbol'}}, or None for every field.
+    """
+    value = request.args.get('fields', '').strip()
+    if not value:
+        return None
+    fields = {}
+    for name in value.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        top, _, sub = name.partition('.')
+        if sub:
+            if fields.get(top, set()) is not None:
+                fields.setdefault(top, set()).add(sub)
+        else:
+            fields[top] = None
+    return fields
+
+def select_fields(data, fields):
+    if fields is None:
+        return data
+    selected = {}
+    for name, sub in fields.items():
+        if name not in data:
+            continue
+        value = data[name]
+        if sub is not None and isinstance(value, list):
+            value = [{k: item[k] for k in sub if k in item} for item in value]
+        selected[name] = value
+    return selected
+
+def respond(data, etag):
+    response = jsonify(data)
+    response.set_etag(etag)
+    # Clients may keep the body but must revalidate before using it
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def isoformat(value):
+    return value.isoformat() if value else None
+
+@bp.route('/portfolios')
+@login_required
+def portfolios():
+    summaries = portfolio_summaries(current_user.id)
+    etag = make_etag([(s['portfolio'].id, s['portfolio'].holdings_version, s['quotes_updated_at'])
+                      for s in summaries], fx_rates.version)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    fields = parse_fields()
+    items = [select_fields({
+        'id': s['portfolio'].id,
+        'name': s['portfolio'].name,
+        'type': s['portfolio'].type,
+        'base_currency': s['portfolio'].base_currency,
+        'holdings_count': s['holdings_count'],
+        'total_value': s['total_value'],
+        'quotes_updated_at': isoformat(s['quotes_updated_at']),
+    }, fields) for s in summaries]
+    return respond({'portfolios': items}, etag)
+
+@bp.route('/portfolios/<int:id>/valuation')
+@login_required
+def valuation(id):
+    # Checked before loading any holdings, so an unchanged portfolio costs one aggregate query
+    version = portfolio_version(id, current_user.id)
+    if version is None:
+        abort(404)
+    # Exchange rates are quotes too, but not on the portfolio's own symbols
+    etag = make_etag(id, *version, fx_rates.version)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    portfolio = db.session.get(Portfolio, id)
+    touch_portfolio(portfolio)
+    holdings, rows, total_value = value_holdings(id, portfolio.base_currency)
+    data = {
+        'id': portfolio.id,
+        'name': portfolio.name,
+        'type': portfolio.type,
+        'base_currency': portfolio.base_currency,
+        'total_value': total_value,
+        'quotes_updated_at': isoformat(version[1]),
+        'holdings': [{
+            'symbol': row['symbol'],
+            'units': row['units'],
+            'price': row['price'],
+            'currency': row['currency'],
+            'fx_rate': row['fx_rate'],
+            'value': row['value'],
+            'cost_basis': row['cost_basis'],
+            'realized_gain': row['realized_gain'],
+            'weight': row['value'] / total_value if total_value else 0.0,
+            'target_percentage': row['target_percentage'],
+            'updated_at': isoformat(row['updated_at']),
+        } for row in rows],
+    }
+    return respond(select_fields(data, parse_fields()), etag)
@@ -1,8 +1,14 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, render_template, jsonify
 from flask_login import login_required, current_user
+from app.services.quote_cache import quote_cache
 
 bp = Blueprint('main', __name__)
 
 @bp.route('/')
 def index():
     return render_template('index.html')
+
+@bp.route('/quote-cache/stats')
+@login_required
+def quote_cache_stats():
+    return jsonify(quote_cache.get_stats())
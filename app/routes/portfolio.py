@@ -1,16 +1,82 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, abort
+import io
+import json
+from datetime import date, datetime, timedelta
+from flask import Blueprint, Response, current_app, render_template, redirect, url_for, flash, request, abort, jsonify, \
+    stream_with_context
 from flask_login import login_required, current_user
 from app import db
-from app.models import Portfolio, Holding
-from app.services.market_data import check_symbol, get_prices
+from app.models import Portfolio, Holding, Transaction
+from app.services import ledger
+from app.services.market_data import check_symbol
+from app.services.importer import import_holdings as import_csv, ImportFormatError
+from app.services.refresher import refresher
+from app.services.price_stream import price_hub
+from app.services.write_behind import write_buffer
+from app.services.fx import fx_rates, infer_currency, pairs_for
+from app.services.render_cache import render_cache
+from app.services.symbols import symbol_index
+from app.services.rebalancer import rebalance as rebalance_portfolio, household_rebalance
+from app.services.valuation import value_holdings, value_household, portfolio_summaries, portfolio_performance, \
+    portfolio_version
 
 bp = Blueprint('portfolio', __name__, url_prefix='/portfolio')
 
+# How often a portfolio view is recorded for refresh priority
+VIEW_TOUCH_INTERVAL = timedelta(minutes=5)
+
+# Most recent transactions listed on the transactions page
+TRANSACTIONS_SHOWN = 100
+
+@bp.app_template_filter('age')
+def age_filter(updated_at):
+    """Renders how long ago a price was refreshed, e.g. '3 min ago'."""
+    if updated_at is None:
+        return 'never'
+    seconds = int((datetime.utcnow() - updated_at).total_seconds())
+    if seconds < 60:
+        return 'just now'
+    if seconds < 3600:
+        return f'{seconds // 60} min ago'
+    if seconds < 86400:
+        return f'{seconds // 3600} h ago'
+    return f'{seconds // 86400} d ago'
+
+def touch_portfolio(portfolio):
+    """
+    Marks a portfolio as recently viewed so the refresher prioritises its symbols.
+    Queued on the write-behind buffer, so the view itself does not write.
+    """
+    now = datetime.utcnow()
+    last_viewed = write_buffer.pending_view(portfolio.id) or portfolio.last_viewed
+    if last_viewed is None or now - last_viewed > VIEW_TOUCH_INTERVAL:
+        write_buffer.touch(portfolio.id, now)
+
+def parse_price(value):
+    """A price per unit from a form field; None if left blank."""
+    value = (value or '').strip()
+    return float(value) if value else None
+
+def targets_exceed_total(percentages):
+    """Flashes an error and returns True if target percentages add up to more than 100%."""
+    total = sum(percentages)
+    if total > 100 + 1e-6:
+        flash(f'Target allocations add up to {total:g}%; they can be at most 100%.')
+        return True
+    return False
+
+def fx_version(portfolio):
+    """The FX rates a portfolio's valuation depends on, for cache keys; None if it is not converted."""
+    return fx_rates.version if portfolio.base_currency else None
+
 @bp.route('/')
 @login_required
 def index():
-    portfolios = current_user.portfolios.all()
-    return render_template('portfolio/index.html', portfolios=portfolios)
+    # One aggregate statement gives both the values and what they depend on; only rendering is saved
+    portfolios = portfolio_summaries(current_user.id)
+    key = tuple((s['portfolio'].id, s['portfolio'].holdings_version, s['portfolio'].base_currency,
+                 s['quotes_updated_at'], s['total_value']) for s in portfolios)
+    return render_cache.render('portfolio.index', key, lambda: render_template(
+        'portfolio/index.html', portfolios=portfolios))
 
 @bp.route('/create', methods=['GET', 'POST'])
 @login_required
@@ -18,12 +84,16 @@ def create():
     if request.method == 'POST':
         name = request.form['name']
         type = request.form['type']
-        portfolio = Portfolio(name=name, type=type, owner=current_user)
+        base_currency = request.form.get('base_currency') or None
+        if base_currency not in current_app.config['CURRENCIES']:
+            base_currency = None
+        portfolio = Portfolio(name=name, type=type, base_currency=base_currency, owner=current_user)
         db.session.add(portfolio)
         db.session.commit()
         flash('Portfolio created successfully!')
         return redirect(url_for('portfolio.index'))
-    return render_template('portfolio/create.html')
+    return render_template('portfolio/create.html', currencies=current_app.config['CURRENCIES'],
+                           default_currency=current_app.config['DEFAULT_BASE_CURRENCY'])
 
 @bp.route('/<int:id>')
 @login_required
@@ -32,42 +102,100 @@ def view(id):
     if portfolio.owner != current_user:
         abort(403)
     
-    holdings = portfolio.holdings.all()
-    symbols = [h.symbol for h in holdings]
-    prices = get_prices(symbols)
-    
-    # Calculate total value and distribution
-    total_value = 0
-    holdings_data = []
-    
-    for h in holdings:
-        price_data = prices.get(h.symbol)
-        
-        if price_data:
-            # API returned data, update cache
-            price = price_data['price']
-            timestamp = price_data['timestamp']
-            h.last_price = price
-            h.last_price_timestamp = timestamp
-        else:
-            # API failed, use cache
-            price = h.last_price if h.last_price is not None else 0
-            timestamp = h.last_price_timestamp if h.last_price_timestamp else "N/A"
-            
-        value = price * h.units
-        total_value += value
-        holdings_data.append({
-            'id': h.id,
-            'symbol': h.symbol,
-            'units': h.units,
-            'price': price,
-            'timestamp': timestamp,
-            'value': value
-        })
-        
-    db.session.commit() # Save updated prices to DB
-        
-    return render_template('portfolio/view.html', portfolio=portfolio, holdings=holdings_data, total_value=total_value)
+    touch_portfolio(portfolio)
+
+    # Calculate total value and distribution from stored prices;
+    # the background refresher keeps them current. Valued once, and only if a fragment is not cached.
+    valued = []
+    def holdings():
+        if not valued:
+            valued.extend(value_holdings(portfolio.id, portfolio.base_currency))
+        return valued
+
+    # The table changes with holdings and prices, the analytics with holdings and the daily history
+    _, quotes_updated_at = portfolio_version(portfolio.id, current_user.id)
+    version = (portfolio.id, portfolio.holdings_version, portfolio.base_currency, fx_version(portfolio))
+    holdings_html = render_cache.render('portfolio.view.holdings', version + (quotes_updated_at,), lambda: render_template(
+        'portfolio/_holdings.html', portfolio=portfolio, holdings=holdings()[1], total_value=holdings()[2],
+        currencies=current_app.config['CURRENCIES']), page=False)
+    # Read from the local history files, no network
+    analytics_html = render_cache.render('portfolio.view.analytics', version + (date.today(),), lambda: render_template(
+        'portfolio/_analytics.html', analytics=portfolio_performance(holdings()[1])), page=False)
+
+    return render_template('portfolio/view.html', portfolio=portfolio, holdings_html=holdings_html,
+                           analytics_html=analytics_html)
+
+@bp.route('/<int:id>/refresh', methods=['POST'])
+@login_required
+def refresh(id):
+    portfolio = Portfolio.query.get_or_404(id)
+    if portfolio.owner != current_user:
+        abort(403)
+
+    symbols = [h.symbol for h in portfolio.holdings]
+    # Exchange rates for the base currency go out in the same batch as the prices
+    currencies = [h.quote.currency if h.quote and h.quote.currency else infer_currency(h.symbol)
+                  for h in portfolio.holdings]
+    refresher.refresh_symbols(symbols + pairs_for(currencies, portfolio.base_currency),
+                              api_key=current_user.api_key)
+    # Written now rather than on the next tick, so the page shows the new prices
+    write_buffer.flush()
+    return redirect(url_for('portfolio.view', id=id))
+
+@bp.route('/<int:id>/currency', methods=['POST'])
+@login_required
+def set_currency(id):
+    portfolio = Portfolio.query.get_or_404(id)
+    if portfolio.owner != current_user:
+        abort(403)
+
+    base_currency = request.form.get('base_currency') or None
+    if base_currency is not None and base_currency not in current_app.config['CURRENCIES']:
+        flash(f'Unsupported currency: {base_currency}.')
+        return redirect(url_for('portfolio.view', id=id))
+    portfolio.base_currency = base_currency
+    # Cached valuations were in the old currency
+    portfolio.bump_version()
+    db.session.commit()
+    # Fetch any exchange rates the new currency needs now rather than on the next tick
+    return refresh(id)
+
+@bp.route('/<int:id>/stream')
+@login_required
+def stream(id):
+    """Server-Sent Events: pushes new prices for the portfolio's symbols."""
+    portfolio = Portfolio.query.get_or_404(id)
+    if portfolio.owner != current_user:
+        abort(403)
+    symbols = [s for s, in db.session.query(Holding.symbol).filter_by(portfolio_id=id).distinct()]
+    sub = price_hub.subscribe(symbols, api_key=current_user.api_key)
+    if sub is None:
+        # Hub is full; EventSource retries after the given delay
+        return Response('retry: 30000\n\n', status=503, mimetype='text/event-stream')
+    # Do not hold a database connection for the life of the stream
+    db.session.close()
+
+    def events():
+        try:
+            yield f'retry: {int(price_hub.interval * 1000)}\n\n'
+            while not sub.closed:
+                updates = sub.get(timeout=price_hub.heartbeat)
+                if not updates:
+                    yield ': keepalive\n\n'
+                    continue
+                quotes = {s: {'price': q['price'], 'timestamp': q.get('timestamp')} for s, q in updates.items()}
+                yield f'event: prices\ndata: {json.dumps(quotes)}\n\n'
+        finally:
+            price_hub.unsubscribe(sub)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/symbols')
+@login_required
+def symbols():
+    """Autocomplete: symbols starting with ?q=, from the local symbol universe."""
+    return jsonify(symbol_index.search(request.args.get('q', ''), limit=10))
 
 @bp.route('/<int:id>/add_stock', methods=['GET', 'POST'])
 @login_required
@@ -79,19 +207,52 @@ def add_stock(id):
     if request.method == 'POST':
         symbol = request.form['symbol'].upper()
         units = float(request.form['units'])
+        price = parse_price(request.form.get('price'))
         
         if not check_symbol(symbol):
             flash(f'Invalid symbol: {symbol}. Please check if it exists on Twelve Data.')
             return redirect(url_for('portfolio.add_stock', id=id))
+        if units < 0:
+            flash('Units cannot be negative.')
+            return redirect(url_for('portfolio.add_stock', id=id))
             
-        holding = Holding(symbol=symbol, units=units, portfolio=portfolio)
-        db.session.add(holding)
-        db.session.commit()
+        # Recorded as a buy; adds to the holding if the symbol is already there. A holding
+        # with 0 units makes the symbol tradeable in the account for household rebalancing
+        held = any(h.symbol == symbol for h in portfolio.holdings)
+        if units or not held:
+            ledger.record(portfolio, symbol, 'buy', units, price)
+            db.session.commit()
+        # Price the new symbol now rather than waiting for the next refresh tick
+        refresher.refresh_symbols([symbol], api_key=current_user.api_key)
         flash(f'Added {symbol} to portfolio.')
         return redirect(url_for('portfolio.view', id=id))
         
     return render_template('portfolio/add_stock.html', portfolio=portfolio)
 
+@bp.route('/<int:id>/import', methods=['GET', 'POST'])
+@login_required
+def import_holdings(id):
+    portfolio = Portfolio.query.get_or_404(id)
+    if portfolio.owner != current_user:
+        abort(403)
+
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Please choose a CSV file to import.')
+            return redirect(url_for('portfolio.import_holdings', id=id))
+        mode = 'replace' if request.form.get('mode') == 'replace' else 'add'
+        # Read the upload line by line; Werkzeug spools large files to disk
+        lines = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        try:
+            report = import_csv(portfolio, lines, api_key=current_user.api_key, mode=mode)
+        except (ImportFormatError, UnicodeDecodeError) as e:
+            flash(f'Could not import {upload.filename}: {e}')
+            return redirect(url_for('portfolio.import_holdings', id=id))
+        return render_template('portfolio/import_result.html', portfolio=portfolio, report=report)
+
+    return render_template('portfolio/import.html', portfolio=portfolio)
+
 @bp.route('/edit_stock/<int:id>', methods=['GET', 'POST'])
 @login_required
 def edit_stock(id):
@@ -101,13 +262,77 @@ def edit_stock(id):
         
     if request.method == 'POST':
         units = float(request.form['units'])
-        holding.units = units
-        db.session.commit()
+        if units < 0:
+            # Selling more than is held would leave the position negative
+            flash(f'Cannot sell more than the {holding.units:g} {holding.symbol} held.')
+            return redirect(url_for('portfolio.edit_stock', id=id))
+        # The change goes into the ledger as a buy or sell of the difference
+        change = units - holding.units
+        if change:
+            ledger.record(holding.portfolio, holding.symbol, 'buy' if change > 0 else 'sell', abs(change),
+                          parse_price(request.form.get('price')))
+            db.session.commit()
         flash(f'Updated {holding.symbol} units.')
         return redirect(url_for('portfolio.view', id=holding.portfolio.id))
         
     return render_template('portfolio/edit_stock.html', holding=holding)
 
+@bp.route('/<int:id>/transactions', methods=['GET', 'POST'])
+@login_required
+def transactions(id):
+    portfolio = Portfolio.query.get_or_404(id)
+    if portfolio.owner != current_user:
+        abort(403)
+
+    if request.method == 'POST':
+        symbol = request.form['symbol'].strip().upper()
+        kind = request.form.get('kind')
+        try:
+            units = float(request.form['units'])
+            price = parse_price(request.form.get('price'))
+            when = date.fromisoformat(request.form['date']) if request.form.get('date') else date.today()
+        except ValueError:
+            flash('Please enter a valid number of units, price and date.')
+            return redirect(url_for('portfolio.transactions', id=id))
+        holding = next((h for h in portfolio.holdings if h.symbol == symbol), None)
+        held = holding is not None
+        available = 0.0
+        if held and kind == 'sell':
+            # A backdated sell must also leave every later position non-negative
+            available = holding.units if when >= date.today() else ledger.sellable_units(id, symbol, when)
+        if kind not in ('buy', 'sell') or units <= 0 or when > date.today():
+            flash('Please enter a buy or sell of a positive number of units, not in the future.')
+        elif kind == 'sell' and not held:
+            flash(f'{symbol} is not held in this portfolio.')
+        elif kind == 'sell' and units > available + ledger.EPSILON:
+            flash(f'Cannot sell {units:g} {symbol}: only {available:g} can be sold as of {when.isoformat()}.')
+        elif not held and not check_symbol(symbol):
+            flash(f'Invalid symbol: {symbol}. Please check if it exists on Twelve Data.')
+        else:
+            ledger.record(portfolio, symbol, kind, units, price, when)
+            db.session.commit()
+            if not held:
+                refresher.refresh_symbols([symbol], api_key=current_user.api_key)
+            flash(f'Recorded {kind} of {units:g} {symbol}.')
+        return redirect(url_for('portfolio.transactions', id=id))
+
+    # Current positions are the holdings themselves; past ones are rebuilt from the nearest snapshot
+    try:
+        as_of = date.fromisoformat(request.args['as_of']) if request.args.get('as_of') else None
+    except ValueError:
+        abort(400)
+    if as_of is None:
+        positions = [{'symbol': h.symbol, 'units': h.units, 'cost_basis': h.cost_basis,
+                      'realized_gain': h.realized_gain} for h in portfolio.holdings]
+    else:
+        positions = [dict(p, symbol=s) for s, p in sorted(ledger.positions_as_of(id, as_of).items())]
+    history = Transaction.query.filter_by(portfolio_id=id)
+    if as_of is not None:
+        history = history.filter(Transaction.date <= as_of)
+    history = history.order_by(Transaction.date.desc(), Transaction.id.desc()).limit(TRANSACTIONS_SHOWN).all()
+    return render_template('portfolio/transactions.html', portfolio=portfolio, positions=positions,
+                           transactions=history, as_of=as_of, today=date.today())
+
 @bp.route('/delete_stock/<int:id>')
 @login_required
 def delete_stock(id):
@@ -116,7 +341,8 @@ def delete_stock(id):
         abort(403)
     
     portfolio_id = holding.portfolio.id
-    db.session.delete(holding)
+    # Recorded as a sale of unknown price; sales with a price are recorded from the transactions page
+    ledger.remove(holding)
     db.session.commit()
     flash('Stock removed from portfolio.')
     return redirect(url_for('portfolio.view', id=portfolio_id))
@@ -139,88 +365,120 @@ def rebalance(id):
     if portfolio.owner != current_user:
         abort(403)
         
-    holdings = portfolio.holdings.all()
-    symbols = [h.symbol for h in holdings]
-    prices = get_prices(symbols)
-    
-    # Prepare data for the form
-    holdings_data = []
-    total_value = 0
-    for h in holdings:
-        price_data = prices.get(h.symbol)
-        
-        if price_data:
-            # API returned data, update cache
-            price = price_data['price']
-            h.last_price = price
-            # We could update timestamp too but rebalance view doesn't show it usually, 
-            # but good to keep consistent.
-            h.last_price_timestamp = price_data['timestamp']
-        else:
-            # API failed, use cache
-            price = h.last_price if h.last_price is not None else 0
-            
-        value = price * h.units
-        total_value += value
-        holdings_data.append({
-            'symbol': h.symbol,
-            'units': h.units,
-            'price': price,
-            'value': value,
-            'target_percentage': h.target_percentage
-        })
-        
-    db.session.commit() # Save updated prices
+    if request.method == 'GET':
+        # The form only changes with holdings (and their targets) and prices
+        _, quotes_updated_at = portfolio_version(portfolio.id, current_user.id)
+        key = (portfolio.id, portfolio.holdings_version, portfolio.base_currency, fx_version(portfolio),
+               quotes_updated_at)
+        return render_cache.render('portfolio.rebalance', key, lambda: render_rebalance_form(portfolio))
+
+    # Prepare data for the form from stored prices
+    holdings, holdings_data, total_value = value_holdings(portfolio.id, portfolio.base_currency)
         
     if request.method == 'POST':
         cash = float(request.form.get('cash', 0))
         
         # Parse target ratios (percentages)
+        percentages = {h.symbol: float(request.form.get(f'ratio_{h.symbol}', 0)) for h in holdings}
+        if targets_exceed_total(percentages.values()):
+            return redirect(url_for('portfolio.rebalance', id=id))
+
         targets = {}
-        total_ratio = 0
         for h in holdings:
-            percentage = float(request.form.get(f'ratio_{h.symbol}', 0))
-            
             # Save the target percentage to the database
-            h.target_percentage = percentage
-            
-            ratio = percentage / 100.0
-            targets[h.symbol] = ratio
-            total_ratio += ratio
+            h.target_percentage = percentages[h.symbol]
+            targets[h.symbol] = percentages[h.symbol] / 100.0
             
+        portfolio.bump_version()
         db.session.commit()
             
-        # Validate total ratio (should be close to 1.0)
-        # We can just proceed; if it doesn't sum to 100%, the user might have intended to leave cash or made a mistake.
-        # But the math works regardless (it will just target that % of the total portfolio).
+        # Targets under 100% are fine: the rest is left as cash
 
         new_total_value = total_value + cash
         
-        # Calculate actions
+        # Calculate actions, both exact (fractional) and in whole units within the available cash
+        fractional, whole, cash_left, target_values = rebalance_portfolio(
+            [h.units for h in holdings],
+            [row['base_price'] for row in holdings_data],
+            [targets.get(h.symbol, 0) for h in holdings],
+            cash
+        )
         actions = []
-        for h in holdings:
-            target_ratio = targets.get(h.symbol, 0)
-            target_value = new_total_value * target_ratio
-            # Use cached price if API failed (which we handled above, but we need to access it here)
-            # Since we updated the DB objects above, we can use h.last_price
-            price = h.last_price if h.last_price is not None else 0
-            
-            current_value = h.units * price
-            diff = target_value - current_value
-            
-            if price > 0:
-                units_to_change = diff / price
-                action_type = 'Buy' if units_to_change > 0 else 'Sell'
+        for i, (h, row) in enumerate(zip(holdings, holdings_data)):
+            if row['price'] > 0:
+                action_type = 'Buy' if fractional[i] > 0 else 'Sell'
                 actions.append({
                     'symbol': h.symbol,
-                    'price': price,
+                    'price': row['price'],
+                    'currency': row['currency'],
                     'current_units': h.units,
-                    'target_value': target_value,
-                    'units_to_change': abs(round(units_to_change, 2)),
-                    'action': action_type
+                    'target_value': target_values[i],
+                    'units_to_change': abs(round(fractional[i], 2)),
+                    'action': action_type,
+                    'whole_units': int(abs(whole[i])),
+                    'whole_action': 'Buy' if whole[i] > 0 else 'Sell' if whole[i] < 0 else 'Hold'
                 })
                 
-        return render_template('portfolio/rebalance_result.html', portfolio=portfolio, actions=actions, cash=cash, total_value=new_total_value)
+        return render_template('portfolio/rebalance_result.html', portfolio=portfolio, actions=actions, cash=cash, cash_left=cash_left, total_value=new_total_value)
 
+def render_rebalance_form(portfolio):
+    """The rebalance form, from stored prices."""
+    holdings, holdings_data, total_value = value_holdings(portfolio.id, portfolio.base_currency)
     return render_template('portfolio/rebalance.html', portfolio=portfolio, holdings=holdings_data, total_value=total_value)
 
+@bp.route('/household', methods=['GET', 'POST'])
+@login_required
+def household():
+    """Rebalances all of the user's portfolios toward one allocation."""
+    # One currency for the household: the portfolios' own if they agree
+    bases = {p.base_currency for p in current_user.portfolios}
+    base_currency = bases.pop() if len(bases) == 1 else current_app.config['DEFAULT_BASE_CURRENCY']
+    data = value_household(current_user.id, base_currency)
+    portfolios, symbols = data['portfolios'], data['symbols']
+
+    if request.method == 'POST':
+        cash = [float(request.form.get(f'cash_{p.id}') or 0) for p in portfolios]
+        percentages = [float(request.form.get(f'ratio_{symbol}') or 0) for symbol in symbols]
+        if targets_exceed_total(percentages):
+            return redirect(url_for('portfolio.household'))
+        targets = [p / 100.0 for p in percentages]
+        eligible = [[f'eligible_{p.id}_{symbol}' in request.form for symbol in symbols] for p in portfolios]
+
+        fractional, whole, cash_left, target_values = household_rebalance(
+            data['units'], data['prices'], eligible, targets, cash)
+        prices = data['prices']
+        accounts = []
+        for a, p in enumerate(portfolios):
+            actions = []
+            for s, symbol in enumerate(symbols):
+                if abs(fractional[a, s]) < 1e-9 and whole[a, s] == 0:
+                    continue
+                actions.append({
+                    'symbol': symbol,
+                    'price': prices[s],
+                    'current_units': data['units'][a, s],
+                    'units_to_change': abs(round(fractional[a, s], 2)),
+                    'action': 'Buy' if fractional[a, s] > 0 else 'Sell',
+                    'whole_units': int(abs(whole[a, s])),
+                    'whole_action': 'Buy' if whole[a, s] > 0 else 'Sell' if whole[a, s] < 0 else 'Hold'
+                })
+            accounts.append({'portfolio': p, 'actions': actions, 'cash': cash[a], 'cash_left': float(cash_left[a])})
+        allocation = [{
+            'symbol': symbol,
+            'current_value': float(data['units'][:, s].sum() * prices[s]),
+            'target_value': float(target_values[s]),
+            'new_value': float((data['units'][:, s] + whole[:, s]).sum() * prices[s]),
+        } for s, symbol in enumerate(symbols)]
+        return render_template('portfolio/household_result.html', accounts=accounts, allocation=allocation,
+                               base_currency=base_currency, trades=int((whole != 0).sum()),
+                               total_value=float(data['values'].sum() + sum(cash)))
+
+    rows = [{
+        'symbol': symbol,
+        'value': float(data['units'][:, s].sum() * data['prices'][s]),
+        'target_percentage': float(data['targets'][s] * 100),
+        'held': data['held'][:, s].tolist(),
+    } for s, symbol in enumerate(symbols)]
+    return render_template('portfolio/household.html', portfolios=portfolios, holdings=rows,
+                           values=data['values'].tolist(), total_value=float(data['values'].sum()),
+                           base_currency=base_currency)
@@ -0,0 +1,150 @@
+import threading
+import time
+import numpy as np
+from app import db
+from sqlalchemy import func
+from app.models import User, Portfolio, Holding, Quote
+
+DEFAULT_CURRENCY = 'USD' # listings without an exchange suffix
+# Listing currency by Yahoo-style exchange suffix, e.g. VFV.TO
+SUFFIX_CURRENCIES = {
+    'TO': 'CAD', 'V': 'CAD', 'NE': 'CAD', 'CN': 'CAD',
+    'L': 'GBP', 'PA': 'EUR', 'DE': 'EUR', 'AS': 'EUR', 'AX': 'AUD', 'T': 'JPY', 'HK': 'HKD',
+}
+
+def is_pair(symbol):
+    """FX rates are stored as quotes on pair symbols such as 'USD/CAD'."""
+    return '/' in symbol
+
+def pair_symbol(base, quote):
+    return f'{base}/{quote}'
+
+def pairs_for(currencies, base):
+    """Pair symbols converting each of currencies into base, for a portfolio's own refresh."""
+    if not base:
+        return []
+    return sorted({pair_symbol(c, base) for c in currencies if c and c != base})
+
+def infer_currency(symbol):
+    """The currency a symbol is quoted in, from its exchange suffix; a pair is quoted in its second currency."""
+    if is_pair(symbol):
+        return symbol.split('/', 1)[1]
+    if '.' in symbol:
+        return SUFFIX_CURRENCIES.get(symbol.rsplit('.', 1)[1].upper(), DEFAULT_CURRENCY)
+    return DEFAULT_CURRENCY
+
+
+class FxRates:
+    """
+    Exchange rates between the currencies in use, as a matrix: rates[i, j]
+    converts an amount in currency i into currency j.
+
+    Rates are quotes on pair symbols ('USD/CAD') in the quote table, fetched by
+    the refresher in the same batch as prices. The matrix is rebuilt from them
+    at most every FX_CACHE_TTL seconds, or after this process stores new ones,
+    so valuing a page costs no upstream call and usually no query. Pairs
+    without a quote of their own use the inverse or a cross rate. Unknown
+    rates are NaN.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 60
+        self._lock = threading.Lock()
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def _reset(self):
+        self._index = {}
+        self._matrix = np.ones((0, 0))
+        self._version = None
+        self._loaded_at = None
+
+    def init_app(self, app):
+        self.ttl = app.config.get('FX_CACHE_TTL', self.ttl)
+        with self._lock:
+            self._reset()
+        app.extensions['fx_rates'] = self
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def _load(self):
+        rows = db.session.query(Quote.symbol, Quote.price, Quote.updated_at) \
+            .filter(Quote.symbol.like('%/%'), Quote.price > 0).all()
+        currencies = sorted({c for symbol, _, _ in rows for c in symbol.split('/', 1)})
+        index = {c: i for i, c in enumerate(currencies)}
+        matrix = np.full((len(currencies), len(currencies)), np.nan)
+        np.fill_diagonal(matrix, 1.0)
+        for symbol, price, _ in rows:
+            base, quote = symbol.split('/', 1)
+            matrix[index[base], index[quote]] = price
+            if np.isnan(matrix[index[quote], index[base]]):
+                matrix[index[quote], index[base]] = 1 / price
+        # Cross rates through each currency in turn, filling only what is still unknown
+        for k in range(len(currencies)):
+            matrix = np.where(np.isnan(matrix), matrix[:, k:k + 1] * matrix[k:k + 1, :], matrix)
+        versions = [updated for _, _, updated in rows if updated is not None]
+        return index, matrix, max(versions) if versions else None
+
+    def _current(self):
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._index, self._matrix, self._version
+        index, matrix, version = self._load()
+        with self._lock:
+            self._index, self._matrix, self._version = index, matrix, version
+            self._loaded_at = time.monotonic()
+        return index, matrix, version
+
+    @property
+    def version(self):
+        """When the newest rate in the matrix was stored; part of the API's ETags."""
+        return self._current()[2]
+
+    def rates(self, currencies, to):
+        """Rates converting each of currencies into `to`, as an array; NaN where unknown."""
+        index, matrix, _ = self._current()
+        currencies = list(currencies)
+        rates = np.full(len(currencies), np.nan)
+        if not currencies:
+            return rates
+        j = index.get(to)
+        rows = np.array([index.get(c, -1) for c in currencies])
+        known = rows >= 0
+        if j is not None:
+            rates[known] = matrix[rows[known], j]
+        rates[np.array([c == to for c in currencies])] = 1.0
+        return rates
+
+    def convert(self, amounts, currencies, to):
+        """
+        Converts amounts (one per currency) into `to` in one vectorized step.
+        Returns (converted, rates); amounts with no known rate are left
+        unconverted and their rate is NaN.
+        """
+        rates = self.rates(currencies, to)
+        amounts = np.asarray(amounts, dtype=float)
+        return amounts * np.where(np.isnan(rates), 1.0, rates), rates
+
+    def pairs_needed(self):
+        """
+        {pair symbol: API key} for every listing currency held in a portfolio
+        with a different base currency. The key is that of any such portfolio's owner.
+        """
+        rows = db.session.query(Holding.symbol, Quote.currency, Portfolio.base_currency, func.max(User.api_key)) \
+            .join(Portfolio, Holding.portfolio_id == Portfolio.id) \
+            .join(User, Portfolio.user_id == User.id) \
+            .outerjoin(Quote, Quote.symbol == Holding.symbol) \
+            .filter(Portfolio.base_currency.isnot(None)) \
+            .group_by(Holding.symbol, Quote.currency, Portfolio.base_currency).all()
+        pairs = {}
+        for symbol, currency, base, api_key in rows:
+            currency = currency or infer_currency(symbol)
+            if currency != base:
+                pair = pair_symbol(currency, base)
+                pairs[pair] = pairs.get(pair) or api_key or None
+        return pairs
+
+fx_rates = FxRates()
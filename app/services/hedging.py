@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Provider calls block (requests, yfinance), so they run on this pool. Calls
+# still running at the deadline are abandoned rather than joined, which is
+# why this is not the event loop's default executor.
+MAX_WORKERS = 16
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='provider')
+
+def is_valid(quote):
+    """A usable quote has a finite, positive price."""
+    price = quote.get('price') if isinstance(quote, dict) else None
+    return isinstance(price, (int, float)) and math.isfinite(price) and price > 0
+
+async def fetch(symbols, providers, hedge_after=None, deadline=None):
+    """
+    Fetches quotes from an ordered list of (name, fetch) providers, where
+    fetch(symbols) blocks and returns {symbol: {'price', 'timestamp'}}.
+
+    The first provider gets every symbol. The next one is started on the
+    symbols still missing when either the previous provider has not answered
+    within `hedge_after` seconds (a hedged request) or it answered without
+    them. All started providers keep running; for each symbol the first valid
+    quote to arrive wins. Whatever has arrived by `deadline` seconds is returned.
+    """
+    loop = asyncio.get_running_loop()
+    symbols = list(dict.fromkeys(symbols))
+    wanted = set(symbols)
+    results = {}
+    if not symbols or not providers:
+        return results
+
+    now = loop.time()
+    end = now + deadline if deadline else None
+    queue = list(providers)
+    running = {}
+    hedge_at = None
+
+    def missing():
+        return [s for s in symbols if s not in results]
+
+    def launch(reason=None):
+        nonlocal hedge_at
+        name, fn = queue.pop(0)
+        if reason:
+            metrics.PROVIDER_FALLBACKS.inc(provider=name, reason=reason)
+        running[loop.run_in_executor(executor, timed, name, fn, missing())] = name
+        hedge_at = loop.time() + hedge_after if hedge_after is not None else None
+
+    launch()
+    while running and len(results) < len(symbols):
+        now = loop.time()
+        wake = [t for t in (end, hedge_at if queue else None) if t is not None]
+        timeout = max(min(wake) - now, 0) if wake else None
+        done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+        for task in done:
+            name = running.pop(task)
+            try:
+                quotes = task.result() or {}
+            except Exception as e:
+                logger.warning("Provider %s failed: %s", name, e)
+                quotes = {}
+            for symbol, quote in quotes.items():
+                if symbol in wanted and symbol not in results and is_valid(quote):
+                    results[symbol] = quote
+
+        if end is not None and loop.time() >= end:
+            break
+        if queue and len(results) < len(symbols):
+            hedge_due = hedge_at is not None and loop.time() >= hedge_at
+            if hedge_due or not running:
+                launch('hedge' if running else 'missing')
+
+    for task in running:
+        task.cancel()
+    return results
+
+def timed(name, fn, symbols):
+    # Runs on the executor: feeds the provider's latency histogram only
+    with metrics.track_upstream(name):
+        return fn(symbols)
+
+def fetch_sync(symbols, providers, hedge_after=None, deadline=None):
+    """Runs fetch() to completion from synchronous code (routes, refresher, CLI)."""
+    with metrics.track_upstream():
+        return asyncio.run(fetch(symbols, providers, hedge_after=hedge_after, deadline=deadline))
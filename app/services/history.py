@@ -0,0 +1,221 @@
+import os
+import re
+import threading
+import time
+from datetime import date, timedelta
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # Windows: appends are only serialised within one process
+    fcntl = None
+
+# One fixed-size record per trading day, appended in date order
+RECORD = np.dtype([('date', '<M8[D]'), ('close', '<f8')])
+
+
+class PriceHistory:
+    """
+    Daily closing prices, one append-only binary file per symbol.
+
+    Files are arrays of RECORD and are read through np.memmap, so loading a
+    multi-year series is a page-cache read rather than a parse. Updates only
+    fetch the dates after the last stored one (the last day is rewritten in
+    place, since it may have been stored before the close), and a symbol is
+    checked for new dates at most every PRICE_HISTORY_UPDATE_INTERVAL seconds.
+    A symbol with no file is backfilled PRICE_HISTORY_YEARS years.
+    """
+
+    def __init__(self, app=None):
+        self.path = None
+        self.years = 5
+        self.update_interval = 21600
+        self._lock = threading.Lock()
+        self._checked = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        path = app.config.get('PRICE_HISTORY_PATH')
+        if path and not os.path.isabs(path):
+            path = os.path.join(app.instance_path, path)
+        self.path = path
+        self.years = app.config.get('PRICE_HISTORY_YEARS', self.years)
+        self.update_interval = app.config.get('PRICE_HISTORY_UPDATE_INTERVAL', self.update_interval)
+        with self._lock:
+            self._checked = {}
+        app.extensions['price_history'] = self
+
+    def _file(self, symbol):
+        return os.path.join(self.path, re.sub(r'[^A-Z0-9._-]', '_', symbol.upper()) + '.bin')
+
+    def load(self, symbol):
+        """Returns the stored RECORD array for a symbol, memory-mapped and read-only."""
+        path = self._file(symbol) if self.path else None
+        if not path or not os.path.exists(path):
+            return np.empty(0, dtype=RECORD)
+        # Ignore a partially written trailing record
+        count = os.path.getsize(path) // RECORD.itemsize
+        if count == 0:
+            return np.empty(0, dtype=RECORD)
+        return np.memmap(path, dtype=RECORD, mode='r', shape=(count,))
+
+    def last_date(self, symbol):
+        rows = self.load(symbol)
+        return rows['date'][-1] if len(rows) else None
+
+    def append(self, symbol, dates, closes):
+        """
+        Appends (dates, closes) rows that are newer than what is stored.
+        A row for the last stored date replaces it. Returns the number of rows written.
+        """
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        closes = np.asarray(closes, dtype=float)
+        order = np.argsort(dates, kind='stable')
+        dates, closes = dates[order], closes[order]
+        keep = np.isfinite(closes)
+        dates, closes = dates[keep], closes[keep]
+
+        os.makedirs(self.path, exist_ok=True)
+        # Not opened for appending, which would send every write to the end of the file
+        fd = os.open(self._file(symbol), os.O_RDWR | os.O_CREAT, 0o644)
+        with self._lock, os.fdopen(fd, 'r+b') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            end = f.seek(0, os.SEEK_END)
+            size = end - end % RECORD.itemsize
+            last = None
+            if size:
+                f.seek(size - RECORD.itemsize)
+                last = np.frombuffer(f.read(RECORD.itemsize), dtype=RECORD)['date'][0]
+            if last is not None:
+                keep = dates >= last
+                dates, closes = dates[keep], closes[keep]
+                if len(dates) and dates[0] == last:
+                    size -= RECORD.itemsize
+            # Drop duplicate dates within the batch, keeping the last row
+            if len(dates) > 1:
+                unique = np.append(dates[1:] != dates[:-1], True)
+                dates, closes = dates[unique], closes[unique]
+            if not len(dates):
+                return 0
+            rows = np.empty(len(dates), dtype=RECORD)
+            rows['date'], rows['close'] = dates, closes
+            # Overwritten in place: shrinking the file could fault readers that have it mapped
+            f.seek(size)
+            f.write(rows.tobytes())
+            if f.tell() < end:
+                # Only a partial record from an interrupted write is left past the last row
+                f.truncate()
+        return len(rows)
+
+    def due(self, symbols, today=None):
+        """Returns {symbol: start date} for symbols that may have new dates."""
+        today = today or date.today()
+        now = time.monotonic()
+        due = {}
+        with self._lock:
+            for symbol in dict.fromkeys(symbols):
+                checked = self._checked.get(symbol)
+                if checked is not None and now - checked < self.update_interval:
+                    continue
+                due[symbol] = None
+        for symbol in due:
+            last = self.last_date(symbol)
+            if last is None:
+                due[symbol] = today - timedelta(days=365 * self.years)
+            else:
+                due[symbol] = last.astype(object)
+        return {s: start for s, start in due.items() if start <= today}
+
+    def update(self, symbols, fetch):
+        """
+        Appends missing dates for symbols. fetch(symbols, start) returns
+        {symbol: (dates, closes)}; symbols sharing a start date are fetched together.
+        Only the last stored date can be rewritten, by a newer close for it;
+        earlier closes stay as first reported (not adjusted later for splits
+        or dividends).
+        Returns {symbol: rows written}.
+        """
+        if not self.path:
+            return {}
+        by_start = {}
+        for symbol, start in self.due(symbols).items():
+            by_start.setdefault(start, []).append(symbol)
+        written = {}
+        for start, batch in by_start.items():
+            series = fetch(batch, start)
+            for symbol in batch:
+                if symbol in series:
+                    written[symbol] = self.append(symbol, *series[symbol])
+            # Symbols the provider had nothing for wait for the next interval too
+            now = time.monotonic()
+            with self._lock:
+                self._checked.update((symbol, now) for symbol in batch)
+        return written
+
+    def closes(self, symbols, start=None):
+        """
+        Aligns closes for symbols on the union of their dates.
+        Returns (dates, prices) where prices is (dates, symbols); a symbol is
+        carried forward over dates it has no row for and NaN before its first row.
+        """
+        series = [self.load(s) for s in symbols]
+        if start is not None:
+            start = np.datetime64(start, 'D')
+            series = [s[s['date'] >= start] for s in series]
+        if not any(len(s) for s in series):
+            return np.empty(0, dtype='datetime64[D]'), np.empty((0, len(symbols)))
+        dates = np.unique(np.concatenate([s['date'] for s in series]))
+        prices = np.full((len(dates), len(symbols)), np.nan)
+        for j, s in enumerate(series):
+            if not len(s):
+                continue
+            # Index of the latest row on or before each date (carry forward)
+            idx = np.searchsorted(s['date'], dates, side='right') - 1
+            valid = idx >= 0
+            prices[valid, j] = s['close'][idx[valid]]
+        return dates, prices
+
+
+def performance(dates, prices, units, periods_per_year=252):
+    """
+    Vectorized analytics for a portfolio holding `units` of each column of
+    `prices` (see PriceHistory.closes).
+
+    Daily returns only compare symbols priced on both days, so a symbol whose
+    history starts later enters like a deposit instead of as a gain, which
+    makes the compounded return time-weighted. Returns a dict with the daily
+    value series, time-weighted return (total and annualized), maximum
+    drawdown and annualized volatility, or None with fewer than two dates.
+    """
+    if len(dates) < 2:
+        return None
+    units = np.asarray(units, dtype=float)
+    values = prices * units
+    total = np.nansum(values, axis=1)
+
+    both = ~np.isnan(values[1:]) & ~np.isnan(values[:-1])
+    today = np.where(both, values[1:], 0).sum(axis=1)
+    yesterday = np.where(both, values[:-1], 0).sum(axis=1)
+    returns = np.divide(today, yesterday, out=np.ones_like(today), where=yesterday > 0) - 1
+
+    growth = np.cumprod(1 + returns)
+    twr = growth[-1] - 1
+    years = (dates[-1] - dates[0]).astype(int) / 365.25
+    annualized = (1 + twr) ** (1 / years) - 1 if years >= 1 and twr > -1 else None
+    index = np.concatenate(([1.0], growth))
+    drawdowns = index / np.maximum.accumulate(index) - 1
+    volatility = returns.std(ddof=1) * np.sqrt(periods_per_year) if len(returns) > 1 else 0.0
+
+    return {
+        'dates': [str(d) for d in dates],
+        'values': np.round(total, 2).tolist(),
+        'twr': float(twr),
+        'annualized_return': float(annualized) if annualized is not None else None,
+        'max_drawdown': float(drawdowns.min()),
+        'volatility': float(volatility),
+    }
+
+
+price_history = PriceHistory()
@@ -0,0 +1,132 @@
+import csv
+import heapq
+from app import db
+from app.models import Holding, Quote
+from app.services import ledger, market_data
+
+# Header names used by common broker exports, matched case-insensitively
+SYMBOL_COLUMNS = ('symbol', 'ticker', 'security', 'instrument', 'sym')
+UNITS_COLUMNS = ('units', 'quantity', 'qty', 'shares', 'position')
+
+MAX_REPORTED_ERRORS = 500 # rows past this are counted but not listed
+MAX_HEADER_SEARCH = 20 # broker exports often start with a few lines of account info
+MAX_SYMBOL_LENGTH = Holding.symbol.type.length
+
+
+class ImportFormatError(Exception):
+    """Raised when a file cannot be imported at all (e.g. no usable header)."""
+
+
+def _find_columns(header):
+    names = [h.strip().lower() for h in header]
+    symbol = next((names.index(c) for c in SYMBOL_COLUMNS if c in names), None)
+    units = next((names.index(c) for c in UNITS_COLUMNS if c in names), None)
+    return symbol, units
+
+def _parse_units(value):
+    value = value.strip().replace(',', '').replace('$', '')
+    if value.startswith('(') and value.endswith(')'): # accounting notation for negatives
+        value = '-' + value[1:-1]
+    return float(value)
+
+def parse_holdings(lines):
+    """
+    Streams (row_number, symbol, units, error) tuples from CSV lines.
+    Finds the header within the first few lines, so exports with a preamble
+    work. Exactly one of (symbol and units) or error is set per row.
+    """
+    reader = csv.reader(lines)
+    symbol_col = units_col = None
+    for header in reader:
+        if reader.line_num > MAX_HEADER_SEARCH:
+            break
+        symbol_col, units_col = _find_columns(header)
+        if symbol_col is not None and units_col is not None:
+            break
+    if symbol_col is None or units_col is None:
+        raise ImportFormatError('No header with a symbol and a quantity column was found.')
+
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        line = reader.line_num
+        if len(row) <= max(symbol_col, units_col):
+            yield line, None, None, 'Missing columns'
+            continue
+        symbol = row[symbol_col].strip().upper()
+        if not symbol:
+            yield line, None, None, 'Missing symbol'
+            continue
+        if len(symbol) > MAX_SYMBOL_LENGTH:
+            yield line, None, None, f'Symbol {symbol} is longer than {MAX_SYMBOL_LENGTH} characters'
+            continue
+        try:
+            units = _parse_units(row[units_col])
+        except ValueError:
+            yield line, None, None, f'Invalid quantity for {symbol}: {row[units_col]!r}'
+            continue
+        if units <= 0:
+            yield line, None, None, f'Quantity for {symbol} must be positive'
+            continue
+        yield line, symbol, units, None
+
+def import_holdings(portfolio, lines, api_key=None, mode='add'):
+    """
+    Imports holdings from CSV lines into a portfolio.
+
+    Rows are streamed and folded into one total per symbol, so memory grows
+    with the number of distinct symbols, not the file size. The distinct
+    symbols are validated together, then the units go into the ledger in
+    one batch, as opening balances of unknown cost ('add' adds them to
+    existing holdings, 'replace' records the difference, a sale if fewer).
+    Quotes fetched while validating are stored as well.
+
+    Returns a report dict: rows, imported, updated, error_count and errors
+    (a list of (line, message): the MAX_REPORTED_ERRORS with the lowest line numbers).
+    """
+    report = {'rows': 0, 'imported': 0, 'updated': 0, 'error_count': 0, 'errors': []}
+    # Unknown symbols are only found after all rows are read, so the errors
+    # to report are kept in a heap with the highest line on top
+    reported = []
+
+    def error(line, message):
+        report['error_count'] += 1
+        entry = (-line, message)
+        if len(reported) < MAX_REPORTED_ERRORS:
+            heapq.heappush(reported, entry)
+        elif entry > reported[0]:
+            heapq.heapreplace(reported, entry)
+
+    totals = {}
+    first_line = {}
+    for line, symbol, units, message in parse_holdings(lines):
+        report['rows'] += 1
+        if message:
+            error(line, message)
+            continue
+        totals[symbol] = totals.get(symbol, 0) + units
+        first_line.setdefault(symbol, line)
+
+    valid, prices = market_data.check_symbols(list(totals), api_key)
+    for symbol in list(totals):
+        if symbol not in valid:
+            error(first_line[symbol], f'Unknown symbol: {symbol}')
+            del totals[symbol]
+    report['errors'] = sorted((-line, message) for line, message in reported)
+
+    existing = {h.symbol: h.units for h in Holding.query.filter_by(portfolio_id=portfolio.id)}
+    trades = []
+    for symbol, units in totals.items():
+        if mode == 'replace' and symbol in existing:
+            units -= existing[symbol]
+        if units:
+            trades.append((symbol, 'open' if units > 0 else 'sell', abs(units), None))
+    if trades:
+        ledger.record_many(portfolio, trades)
+    if prices:
+        Quote.upsert_many(prices)
+    db.session.commit()
+
+    report['imported'] = sum(1 for s in totals if s not in existing)
+    report['updated'] = len(totals) - report['imported']
+    return report
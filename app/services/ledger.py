@@ -0,0 +1,174 @@
+from datetime import date as Date
+from flask import current_app
+from sqlalchemy import and_, delete, func, insert, or_
+from app import db
+from app.models import Holding, Transaction, PositionSnapshot
+
+DEFAULT_SNAPSHOT_INTERVAL = 100
+
+# Units left by float arithmetic after selling a whole position
+EPSILON = 1e-9
+
+
+def apply(position, kind, units, price):
+    """
+    Applies one transaction to a (units, cost_basis, realized_gain) position
+    and returns the new one, using the average cost method: a sell takes its
+    share of the book cost and realizes the difference to its proceeds.
+    Opening balances and trades without a price make the cost unknown, None,
+    until the position is closed. A sell without a price, or from an unknown
+    cost, makes the realized gain unknown for good.
+    """
+    held, cost, realized = position
+    if kind == 'sell':
+        if cost is None:
+            # No book cost to realize the proceeds against
+            realized = None
+        elif held > 0:
+            sold_cost = cost * min(units, held) / held
+            cost -= sold_cost
+            if realized is not None:
+                realized = None if price is None else realized + units * price - sold_cost
+        elif price is None:
+            realized = None
+        held -= units
+    else:
+        cost = None if cost is None or price is None or kind == 'open' else cost + units * price
+        held += units
+    if abs(held) < EPSILON:
+        held, cost = 0.0, 0.0
+    return held, cost, realized
+
+
+def record(portfolio, symbol, kind, units, price=None, date=None):
+    """Records one transaction, see record_many. Returns it."""
+    return record_many(portfolio, [(symbol, kind, units, price)], date)[0]
+
+
+def record_many(portfolio, trades, date=None):
+    """
+    Appends (symbol, kind, units, price) trades dated `date` (default today)
+    to a portfolio's ledger and brings its positions up to date.
+
+    The Holding rows are the materialized current positions: an appended
+    transaction is applied to its holding in place, so reading positions
+    costs the same however long the history is. Every
+    LEDGER_SNAPSHOT_INTERVAL transactions all of the portfolio's positions
+    are also copied into a PositionSnapshot, which positions_as_of starts
+    from. A backdated trade (dated before the latest one) invalidates the
+    snapshots after it, and its symbols are replayed from the nearest
+    earlier snapshot instead. Holdings are created for new symbols, from the
+    end of their ledger if they were removed before. The caller commits. Returns the Transaction objects.
+    """
+    date = date or Date.today()
+    latest = db.session.query(func.max(Transaction.date)).filter_by(portfolio_id=portfolio.id).scalar()
+    backdated = latest is not None and date < latest
+
+    holdings = {h.symbol: h for h in Holding.query.filter_by(portfolio_id=portfolio.id)}
+    # A removed holding's ledger stays, so a symbol bought again picks up where it ended
+    new_symbols = {t[0] for t in trades} - set(holdings)
+    reopened = positions_as_of(portfolio.id, symbols=new_symbols) if new_symbols and latest is not None else {}
+    transactions = []
+    for symbol, kind, units, price in trades:
+        holding = holdings.get(symbol)
+        if holding is None:
+            position = reopened.get(symbol, {'units': 0.0, 'cost_basis': 0.0, 'realized_gain': 0.0})
+            holding = holdings[symbol] = Holding(symbol=symbol, portfolio=portfolio, **position)
+            db.session.add(holding)
+        if not backdated:
+            holding.units, holding.cost_basis, holding.realized_gain = apply(
+                (holding.units, holding.cost_basis, holding.realized_gain), kind, units, price)
+        transactions.append(Transaction(portfolio_id=portfolio.id, symbol=symbol, kind=kind, units=units,
+                                        price=price, date=date))
+    db.session.add_all(transactions)
+    db.session.flush()
+
+    if backdated:
+        db.session.execute(delete(PositionSnapshot).where(
+            PositionSnapshot.portfolio_id == portfolio.id, PositionSnapshot.date > date))
+        symbols = {t[0] for t in trades}
+        positions = positions_as_of(portfolio.id, symbols=symbols)
+        for symbol in symbols:
+            position = positions.get(symbol, {'units': 0.0, 'cost_basis': 0.0, 'realized_gain': 0.0})
+            holding = holdings[symbol]
+            holding.units, holding.cost_basis, holding.realized_gain = \
+                position['units'], position['cost_basis'], position['realized_gain']
+
+    interval = current_app.config.get('LEDGER_SNAPSHOT_INTERVAL', DEFAULT_SNAPSHOT_INTERVAL)
+    count = portfolio.transaction_count or 0
+    portfolio.transaction_count = count + len(transactions)
+    # Holdings match the end of the ledger only if nothing was backdated
+    if not backdated and portfolio.transaction_count // interval > count // interval:
+        snapshot(portfolio.id, transactions[-1], holdings.values())
+    portfolio.bump_version()
+    return transactions
+
+
+def snapshot(portfolio_id, transaction, holdings):
+    """Stores the positions as they stand after `transaction`."""
+    rows = [{'portfolio_id': portfolio_id, 'transaction_id': transaction.id, 'date': transaction.date,
+             'symbol': h.symbol, 'units': h.units, 'cost_basis': h.cost_basis, 'realized_gain': h.realized_gain}
+            for h in holdings]
+    if rows:
+        db.session.execute(insert(PositionSnapshot), rows)
+
+
+def positions_as_of(portfolio_id, as_of=None, symbols=None):
+    """
+    Rebuilds a portfolio's positions at the end of `as_of` (default: all of
+    the ledger), optionally only for some symbols. Starts from the nearest
+    snapshot on or before that date and replays only the transactions
+    after it. Returns {symbol: {'units', 'cost_basis', 'realized_gain'}}.
+    """
+    query = PositionSnapshot.query.filter_by(portfolio_id=portfolio_id)
+    if as_of is not None:
+        query = query.filter(PositionSnapshot.date <= as_of)
+    start = query.order_by(PositionSnapshot.date.desc(), PositionSnapshot.transaction_id.desc()).first()
+
+    positions = {}
+    transactions = Transaction.query.filter_by(portfolio_id=portfolio_id)
+    if start is not None:
+        rows = PositionSnapshot.query.filter_by(portfolio_id=portfolio_id, transaction_id=start.transaction_id)
+        if symbols is not None:
+            rows = rows.filter(PositionSnapshot.symbol.in_(symbols))
+        positions = {s.symbol: (s.units, s.cost_basis, s.realized_gain) for s in rows}
+        transactions = transactions.filter(or_(
+            Transaction.date > start.date,
+            and_(Transaction.date == start.date, Transaction.id > start.transaction_id)))
+    if as_of is not None:
+        transactions = transactions.filter(Transaction.date <= as_of)
+    if symbols is not None:
+        transactions = transactions.filter(Transaction.symbol.in_(symbols))
+
+    for t in transactions.order_by(Transaction.date, Transaction.id):
+        position = positions.get(t.symbol, (0.0, 0.0, 0.0))
+        positions[t.symbol] = apply(position, t.kind, t.units, t.price)
+    return {symbol: {'units': units, 'cost_basis': cost, 'realized_gain': realized}
+            for symbol, (units, cost, realized) in positions.items()}
+
+
+def sellable_units(portfolio_id, symbol, as_of):
+    """
+    The most units of a symbol a sell dated `as_of` can take without the
+    position going negative, then or after any later transaction.
+    """
+    position = positions_as_of(portfolio_id, as_of, symbols=[symbol]).get(symbol)
+    units = lowest = position['units'] if position else 0.0
+    later = Transaction.query.filter(Transaction.portfolio_id == portfolio_id, Transaction.symbol == symbol,
+                                     Transaction.date > as_of)
+    for t in later.order_by(Transaction.date, Transaction.id):
+        units += -t.units if t.kind == 'sell' else t.units
+        lowest = min(lowest, units)
+    return max(lowest, 0.0)
+
+
+def remove(holding):
+    """
+    Closes a position: records a sale of its units (at no known price) and
+    removes the holding, so it no longer shows. Its transactions and
+    snapshots stay for the history and as-of positions. The caller commits.
+    """
+    if holding.units:
+        record(holding.portfolio, holding.symbol, 'sell', holding.units)
+    holding.portfolio.bump_version()
+    db.session.delete(holding)
@@ -1,120 +1,160 @@
-import requests
-import yfinance as yf
+from flask import has_request_context
 from flask_login import current_user
-from datetime import datetime
+from app.services.quote_cache import quote_cache
+from app.services.rate_limit import SingleFlight
+from app.services.symbols import symbol_index
+from app.services import hedging
+from app.services.providers import registry as providers
 
-BASE_URL = "https://api.twelvedata.com"
+HEDGE_AFTER = 2 # Seconds to wait for the first provider before also asking the next
+FETCH_DEADLINE = 20 # Seconds after which a fetch returns whatever it has
+
+singleflight = SingleFlight()
+
+def init_app(app):
+    """Applies fetch settings from the app config; providers are configured when first loaded."""
+    providers.init_app(app)
+
+    global HEDGE_AFTER, FETCH_DEADLINE
+    HEDGE_AFTER = app.config.get('MARKET_DATA_HEDGE_AFTER', HEDGE_AFTER)
+    FETCH_DEADLINE = app.config.get('MARKET_DATA_DEADLINE', FETCH_DEADLINE)
 
 def get_api_key():
-    if current_user.is_authenticated and current_user.api_key:
+    if has_request_context() and current_user.is_authenticated and current_user.api_key:
         return current_user.api_key
     return None
 
 def check_symbol(symbol):
     """
-    Verifies if a stock symbol is available on Twelve Data or Yahoo Finance.
-    Returns True if valid, False otherwise.
-    """
-    # 1. Try Twelve Data if API key is present
-    api_key = get_api_key()
-    if api_key:
-        url = f"{BASE_URL}/quote"
-        params = {
-            "symbol": symbol,
-            "apikey": api_key
-        }
-        try:
-            response = requests.get(url, params=params)
-            data = response.json()
-            if "code" not in data or data["code"] == 200:
-                return True
-        except Exception as e:
-            print(f"Twelve Data check failed: {e}")
-
-    # 2. Fallback to Yahoo Finance
-    try:
-        ticker = yf.Ticker(symbol)
-        # Try fetching 1 day of history to verify existence
-        hist = ticker.history(period="1d")
-        if not hist.empty:
-            return True
-        # If history is empty, it likely doesn't exist
-        return False
-    except Exception as e:
-        print(f"Yahoo Finance check failed: {e}")
+    Verifies if a stock symbol is valid.
+    Checks the local symbol universe first, then remembered answers, and only
+    then asks the enabled providers. Returns True if valid, False otherwise.
+    """
+    if symbol_index.contains(symbol):
+        return True
+    cached = symbol_index.cached_check(symbol)
+    if cached is not None:
+        return cached
+
+    valid = verify_symbol(symbol, get_api_key())
+    if valid is None:
         # If we hit a rate limit or other error, we can't verify.
         # Better to allow it than block valid symbols due to API limits.
         # The user will just see 0 price if it's truly invalid.
         return True
+    symbol_index.remember_check(symbol, valid)
+    return valid
 
-def get_yahoo_price(symbol):
-    try:
-        ticker = yf.Ticker(symbol)
-        # Get latest data
-        # history(period='1d') returns a DataFrame
-        hist = ticker.history(period="1d")
-        if not hist.empty:
-            price = float(hist['Close'].iloc[-1])
-            # Timestamp from the index (Date)
-            timestamp = hist.index[-1].strftime('%Y-%m-%d %H:%M:%S')
-            return {'price': price, 'timestamp': timestamp}
-    except Exception as e:
-        print(f"Error fetching Yahoo price for {symbol}: {e}")
-    return None
+def check_symbols(symbols, api_key=None):
+    """
+    Verifies many symbols at once, for bulk imports.
+    Symbols not in the local universe or remembered answers are checked with
+    one batched quote fetch: a symbol with a quote exists. Returns
+    (valid, prices): the set of valid symbols and the quotes fetched on the way.
+    """
+    valid, unknown = set(), []
+    for symbol in dict.fromkeys(symbols):
+        if symbol_index.contains(symbol):
+            valid.add(symbol)
+            continue
+        cached = symbol_index.cached_check(symbol)
+        if cached is None:
+            unknown.append(symbol)
+        elif cached:
+            valid.add(symbol)
+
+    prices = get_prices(unknown, api_key) if unknown else {}
+    # With the last fallback failing a missing quote proves nothing, so allow
+    # the symbol as check_symbol does, without remembering the answer
+    unverifiable = None
+    for symbol in unknown:
+        if symbol in prices:
+            symbol_index.remember_check(symbol, True)
+            valid.add(symbol)
+            continue
+        if unverifiable is None:
+            names = providers.names(api_key)
+            unverifiable = bool(names) and not providers.get(names[-1]).available()
+        if unverifiable:
+            valid.add(symbol)
+    return valid, prices
+
+def verify_symbol(symbol, api_key=None):
+    """
+    Asks the enabled providers, in order, whether a symbol exists.
+    Returns True or False, or None when no provider could answer.
+    """
+    answer = None
+    for name, provider in providers.providers('verify_symbol', api_key):
+        valid = provider.verify_symbol(symbol, api_key) if providers.needs_key(name) else provider.verify_symbol(symbol)
+        if valid:
+            return True
+        if valid is not None:
+            answer = valid
+    return answer
+
+def fetch_symbol_universe(api_key=None):
+    """
+    Downloads the list of stocks and ETFs from Twelve Data as (symbol, name) rows.
+    These reference endpoints do not use quote credits.
+    """
+    return providers.get('twelvedata').fetch_symbol_universe(api_key)
+
+def get_history(symbols, start):
+    """
+    Daily closes since `start` from the first enabled provider that keeps history.
+    Returns {symbol: (dates, closes)}, empty if no provider does.
+    """
+    for _, provider in providers.providers('get_history'):
+        return provider.get_history(symbols, start)
+    return {}
 
-def get_prices(symbols):
+def get_prices(symbols, api_key=None):
     """
     Fetches prices for multiple symbols.
-    Tries Twelve Data first, then falls back to Yahoo Finance for any missing/failed symbols.
-    """
-    results = {}
-    remaining_symbols = list(symbols)
-    
-    # 1. Try Twelve Data
-    api_key = get_api_key()
-    if api_key and remaining_symbols:
-        symbol_str = ",".join(remaining_symbols)
-        url = f"{BASE_URL}/quote"
-        params = {
-            "symbol": symbol_str,
-            "apikey": api_key
-        }
-        
-        try:
-            response = requests.get(url, params=params)
-            data = response.json()
-            
-            # Helper to process single item
-            def process_item(sym, item):
-                if "close" in item:
-                    return {
-                        'price': float(item["close"]),
-                        'timestamp': item.get("datetime", "")
-                    }
-                return None
-
-            if len(remaining_symbols) == 1:
-                # Single symbol response is a dict
-                res = process_item(remaining_symbols[0], data)
-                if res:
-                    results[remaining_symbols[0]] = res
-                    remaining_symbols.remove(remaining_symbols[0])
-            else:
-                # Multiple symbols response is dict of dicts
-                for sym in list(remaining_symbols): # Copy to iterate safely
-                    if sym in data:
-                        res = process_item(sym, data[sym])
-                        if res:
-                            results[sym] = res
-                            remaining_symbols.remove(sym)
-                            
-        except Exception as e:
-            print(f"Twelve Data fetch failed: {e}")
-
-    # 2. Fallback to Yahoo Finance for remaining symbols
-    for sym in remaining_symbols:
-        res = get_yahoo_price(sym)
-        if res:
-            results[sym] = res
-            
+    Serves fresh and stale quotes from the quote cache; stale ones are refreshed
+    in the background. Only symbols with no usable cache entry go upstream.
+    Uses the logged-in user's API key unless one is given.
+    """
+    if api_key is None:
+        api_key = get_api_key()
+    results, stale, missing = quote_cache.lookup(list(dict.fromkeys(symbols)))
+
+    def fetch(syms):
+        # Concurrent callers asking for the same symbols share one upstream fetch
+        return singleflight.run(syms, lambda owned: fetch_prices(owned, api_key))
+
+    if stale:
+        quote_cache.revalidate(list(stale), fetch)
+        results.update(stale)
+
+    if missing:
+        fetched = fetch(missing)
+        quote_cache.store_results(missing, fetched)
+        results.update(fetched)
+
     return results
+
+def refresh_prices(symbols, api_key=None):
+    """
+    Fetches prices for symbols upstream even if the quote cache has them, and
+    stores the results in the cache. For callers that record the fetch time,
+    such as the background refresher. Uses the logged-in user's API key unless one is given.
+    """
+    if api_key is None:
+        api_key = get_api_key()
+    symbols = list(dict.fromkeys(symbols))
+    fetched = singleflight.run(symbols, lambda owned: fetch_prices(owned, api_key))
+    quote_cache.store_results(symbols, fetched)
+    return fetched
+
+def fetch_prices(symbols, api_key=None):
+    """
+    Fetches prices for multiple symbols from the enabled providers, bypassing the cache.
+    The first provider (Twelve Data, for users with a key) goes first; the next
+    is asked for whatever is still missing once it answers, or straight away
+    if it has not answered within HEDGE_AFTER seconds. Returns what has
+    arrived by FETCH_DEADLINE seconds. Providers are loaded only when asked.
+    """
+    calls = [(name, providers.fetcher(name, api_key)) for name in providers.names(api_key)]
+    return hedging.fetch_sync(list(symbols), calls, hedge_after=HEDGE_AFTER, deadline=FETCH_DEADLINE)
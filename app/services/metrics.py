@@ -0,0 +1,275 @@
+import bisect
+import logging
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from flask import Response, g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger('app.slow_requests')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                     for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(n, '') for n in self.labels), 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {} # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def count(self, **labels):
+        series = self._series.get(tuple(labels.get(n, '') for n in self.labels))
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                    cumulative += count
+                    labels = _format_labels(self.labels + ('le',), key + (bound,))
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _format_labels(self.labels, key)
+                lines.append(f'{self.name}_sum{labels} {series[-1]}')
+                lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    """Metrics of this process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """Registers fn() -> [text lines], called at scrape time for values kept elsewhere."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for fn in self._collectors:
+            lines.extend(fn())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+REQUEST_LATENCY = registry.histogram(
+    'http_request_duration_seconds', 'Request latency by route.', ('endpoint', 'method', 'status'))
+PROVIDER_LATENCY = registry.histogram(
+    'provider_request_duration_seconds', 'Upstream market data call latency by provider.', ('provider',))
+PROVIDER_ERRORS = registry.counter(
+    'provider_errors_total', 'Upstream market data calls that raised.', ('provider',))
+PROVIDER_FALLBACKS = registry.counter(
+    'provider_fallbacks_total', "Fallback providers started, by reason ('hedge' or 'missing').",
+    ('provider', 'reason'))
+DB_QUERY_LATENCY = registry.histogram('db_query_duration_seconds', 'Database statement latency.')
+TEMPLATE_LATENCY = registry.histogram('template_render_duration_seconds', 'Template render time.', ('template',))
+
+
+class RequestTimings:
+    """Where one request spent its time. Upstream time is wall time, concurrent calls overlap."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.upstream_calls = 0
+        self.upstream_time = 0.0
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self._render_started = []
+
+    def breakdown(self):
+        return {
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 1),
+            'upstream_calls': self.upstream_calls,
+            'upstream_ms': round(self.upstream_time * 1000, 1),
+            'db_queries': self.db_queries,
+            'db_ms': round(self.db_time * 1000, 1),
+            'render_ms': round(self.render_time * 1000, 1),
+        }
+
+
+def current_timings():
+    """The RequestTimings of the current request, or None outside one."""
+    if has_request_context():
+        return g.get('_timings')
+    return None
+
+@contextmanager
+def track_upstream(provider=None):
+    """
+    Times a blocking upstream call. Counts toward the current request's
+    upstream time and, if a provider is named, that provider's latency histogram.
+    """
+    timings = current_timings()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if provider:
+            PROVIDER_ERRORS.inc(provider=provider)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        if provider:
+            PROVIDER_LATENCY.observe(elapsed, provider=provider)
+        if timings is not None:
+            timings.upstream_calls += 1
+            timings.upstream_time += elapsed
+
+
+class Instrumentation:
+    """
+    Request-level timing and the /metrics endpoint.
+
+    Every request gets a RequestTimings that collects upstream, database and
+    template time; its route latency goes into a histogram, the breakdown
+    is sent as a Server-Timing header, and requests slower than
+    SLOW_REQUEST_THRESHOLD seconds are logged with it (to SLOW_REQUEST_LOG
+    if set). Metrics are per process.
+    """
+
+    def __init__(self, app=None):
+        self.slow_threshold = 0
+        self._engines = weakref.WeakSet()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, db=None):
+        if not app.config.get('METRICS_ENABLED', True):
+            return
+        self.slow_threshold = app.config.get('SLOW_REQUEST_THRESHOLD', self.slow_threshold)
+        path = app.config.get('SLOW_REQUEST_LOG')
+        if path and not any(getattr(h, 'baseFilename', None) == path for h in slow_logger.handlers):
+            handler = logging.FileHandler(path)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            slow_logger.addHandler(handler)
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        if db is not None:
+            with app.app_context():
+                self._listen(db.engine)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        app.extensions['instrumentation'] = self
+
+    def _listen(self, engine):
+        if engine in self._engines:
+            return
+        self._engines.add(engine)
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info['query_started'].pop()
+            DB_QUERY_LATENCY.observe(elapsed)
+            timings = current_timings()
+            if timings is not None:
+                timings.db_queries += 1
+                timings.db_time += elapsed
+
+    def _before_request(self):
+        g._timings = RequestTimings()
+
+    def _before_render(self, sender, template, context, **extra):
+        timings = current_timings()
+        if timings is not None:
+            timings._render_started.append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        timings = current_timings()
+        if timings is not None and timings._render_started:
+            elapsed = time.perf_counter() - timings._render_started.pop()
+            timings.render_time += elapsed
+            TEMPLATE_LATENCY.observe(elapsed, template=template.name or '')
+
+    def _after_request(self, response):
+        timings = g.pop('_timings', None)
+        if timings is None:
+            return response
+        elapsed = time.perf_counter() - timings.started
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_LATENCY.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+        response.headers['Server-Timing'] = (
+            f'upstream;dur={timings.upstream_time * 1000:.1f}, db;dur={timings.db_time * 1000:.1f}, '
+            f'render;dur={timings.render_time * 1000:.1f}, total;dur={elapsed * 1000:.1f}')
+        if self.slow_threshold and elapsed >= self.slow_threshold:
+            b = timings.breakdown()
+            slow_logger.warning(
+                '%s %s %s took %.0f ms: upstream %.0f ms (%d calls), db %.0f ms (%d queries), render %.0f ms',
+                request.method, request.path, response.status_code, b['total_ms'], b['upstream_ms'],
+                b['upstream_calls'], b['db_ms'], b['db_queries'], b['render_ms'])
+        return response
+
+    def metrics_view(self):
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,215 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from app import db
+from app.services import market_data
+from app.services.quote_cache import quote_cache
+from app.services.write_behind import write_buffer
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    One browser's view of the hub: the symbols it watches and the updates it
+    has not taken yet. Pending updates are kept per symbol and a newer quote
+    replaces an older one, so a slow client holds at most one update per
+    symbol and skips straight to the latest price.
+    """
+
+    def __init__(self, symbols, api_key=None):
+        self.symbols = frozenset(symbols)
+        self.api_key = api_key
+        self.closed = False
+        self.coalesced = 0 # updates replaced before the client took them
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._waiting_since = None
+
+    def push(self, quotes):
+        with self._cond:
+            for symbol, quote in quotes.items():
+                if symbol in self.symbols:
+                    if symbol in self._pending:
+                        self.coalesced += 1
+                    self._pending[symbol] = quote
+            if self._pending:
+                if self._waiting_since is None:
+                    self._waiting_since = time.monotonic()
+                self._cond.notify()
+
+    def lagging_for(self):
+        """Seconds the oldest pending update has waited, 0 if none."""
+        with self._cond:
+            return time.monotonic() - self._waiting_since if self._waiting_since is not None else 0
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Waits for updates; returns {symbol: quote}, or {} on timeout or close."""
+        with self._cond:
+            if not self._pending and not self.closed:
+                self._cond.wait(timeout)
+            updates, self._pending = self._pending, {}
+            self._waiting_since = None
+            return updates
+
+
+class PriceHub:
+    """
+    Fans price updates out to every open price stream.
+
+    One poller thread collects the distinct symbols across all subscriptions
+    and fetches them once per PRICE_STREAM_INTERVAL, however many browsers
+    watch each symbol. Fetches go through market_data.get_prices, so fresh
+    quote cache entries cost nothing upstream. Only changed prices are stored
+    and pushed.
+
+    Backpressure: a client that falls behind only ever has the latest quote
+    per symbol pending. One that has not taken its updates for
+    PRICE_STREAM_CLIENT_TIMEOUT seconds is disconnected, and at most
+    PRICE_STREAM_MAX_CLIENTS streams are open per process.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.interval = 15
+        self.heartbeat = 15
+        self.max_clients = 100
+        self.client_timeout = 60
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._last = {}
+        self._thread = None
+        self._stop = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('PRICE_STREAM_INTERVAL', self.interval)
+        self.heartbeat = app.config.get('PRICE_STREAM_HEARTBEAT', self.heartbeat)
+        self.max_clients = app.config.get('PRICE_STREAM_MAX_CLIENTS', self.max_clients)
+        self.client_timeout = app.config.get('PRICE_STREAM_CLIENT_TIMEOUT', self.client_timeout)
+        with self._lock:
+            for sub in self._subscriptions:
+                sub.close()
+            self._subscriptions = set()
+            self._last = {}
+        app.extensions['price_hub'] = self
+
+    def subscribe(self, symbols, api_key=None):
+        """
+        Opens a subscription, primed with the last quotes the hub has seen for
+        its symbols. Returns None when the hub is full.
+        """
+        with self._lock:
+            if len(self._subscriptions) >= self.max_clients:
+                return None
+            sub = Subscription(symbols, api_key)
+            self._subscriptions.add(sub)
+            snapshot = {s: self._last[s] for s in sub.symbols if s in self._last}
+        if snapshot:
+            sub.push(snapshot)
+        if not self.app.testing:
+            self.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        sub.close()
+        with self._lock:
+            self._subscriptions.discard(sub)
+
+    def watched_symbols(self):
+        """Returns {api_key: [symbols]}, each distinct symbol once."""
+        by_key = {}
+        seen = set()
+        with self._lock:
+            subs = list(self._subscriptions)
+        # Symbols watched with a key are fetched with it, so Twelve Data is used where possible
+        for sub in sorted(subs, key=lambda s: s.api_key is None):
+            for symbol in sorted(sub.symbols - seen):
+                by_key.setdefault(sub.api_key, []).append(symbol)
+                seen.add(symbol)
+        return by_key
+
+    def publish(self, quotes):
+        """Pushes quotes that differ from the last ones seen. Returns the changed quotes."""
+        with self._lock:
+            changed = {s: q for s, q in quotes.items()
+                       if self._last.get(s, {}).get('price') != q['price']}
+            self._last.update(changed)
+            subs = list(self._subscriptions)
+        if changed:
+            for sub in subs:
+                sub.push(changed)
+        return changed
+
+    def evict_slow(self):
+        """Disconnects clients that have not taken their updates in time."""
+        with self._lock:
+            slow = [s for s in self._subscriptions if s.lagging_for() > self.client_timeout]
+            self._subscriptions.difference_update(slow)
+        for sub in slow:
+            sub.close()
+        return len(slow)
+
+    def poll_once(self):
+        """
+        Fetches every watched symbol once (through the quote cache), pushes the
+        changes and queues them for storage.
+        """
+        self.evict_slow()
+        changed = {}
+        for api_key, symbols in self.watched_symbols().items():
+            prices = market_data.get_prices(symbols, api_key=api_key)
+            changed.update(self.publish(prices))
+        # Stored as of when each quote was fetched, which for one served from the
+        # quote cache is before this poll. A stale quote the cache has replaced
+        # since is not stored; the next poll pushes its replacement.
+        by_time = {}
+        for symbol, fetched_at in quote_cache.fetched_times(changed).items():
+            by_time.setdefault(fetched_at, {})[symbol] = changed[symbol]
+        for fetched_at, quotes in by_time.items():
+            write_buffer.put_quotes(quotes, datetime.utcfromtimestamp(fetched_at))
+        return changed
+
+    def run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                if not self._subscriptions:
+                    # Nobody is watching: let the thread end, the next subscriber restarts it
+                    self._thread = None
+                    return
+            with self.app.app_context():
+                try:
+                    self.poll_once()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.warning("Price stream poll failed: %s", e)
+                finally:
+                    db.session.remove()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='price-hub', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+        self._thread = None
+        self._stop.clear()
+
+
+price_hub = PriceHub()
@@ -0,0 +1,103 @@
+import importlib
+import threading
+
+# Built-in providers: name -> (module imported on first use, needs a Twelve Data API key)
+BUILTIN_PROVIDERS = {
+    'twelvedata': ('app.services.providers.twelvedata', True),
+    'yahoo': ('app.services.providers.yahoo', False),
+    'local': ('app.services.providers.local', False),
+}
+
+
+class ProviderRegistry:
+    """
+    Market data providers, loaded on first use.
+
+    A provider is a module (or any object) with
+        get_prices(symbols[, api_key]) -> {symbol: {'price', 'timestamp'}}
+        available() -> False while it is known to be failing
+    and optionally
+        init_app(app): applies the app config, called when it is loaded
+        verify_symbol(symbol[, api_key]) -> True, False or None
+        get_history(symbols, start) -> {symbol: (dates, closes)}
+    Providers that need an API key are given the user's key and skipped for
+    users without one.
+
+    MARKET_DATA_PROVIDERS lists the enabled providers in the order they are
+    asked. Nothing is imported until a provider is actually called, so a
+    process that never falls back to Yahoo never imports yfinance and pandas.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = ['twelvedata', 'yahoo']
+        self._sources = {name: path for name, (path, _) in BUILTIN_PROVIDERS.items()}
+        self._needs_key = {name for name, (_, keyed) in BUILTIN_PROVIDERS.items() if keyed}
+        self._loaded = {}
+        self._lock = threading.RLock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        enabled = list(app.config.get('MARKET_DATA_PROVIDERS', self.enabled))
+        unknown = [name for name in enabled if name not in self._sources]
+        if unknown:
+            raise ValueError(f"Unknown market data providers: {', '.join(unknown)}")
+        with self._lock:
+            self.app = app
+            self.enabled = enabled
+            # Providers loaded under an earlier app pick up this one's settings
+            for provider in self._loaded.values():
+                if hasattr(provider, 'init_app'):
+                    provider.init_app(app)
+        app.extensions['market_data_providers'] = self
+
+    def register(self, name, provider, needs_key=False):
+        """Adds or replaces a provider: a module path imported on first use, or a provider object."""
+        with self._lock:
+            self._sources[name] = provider
+            self._loaded.pop(name, None)
+            if needs_key:
+                self._needs_key.add(name)
+            else:
+                self._needs_key.discard(name)
+
+    def get(self, name):
+        """The provider called name, imported and configured on first use."""
+        provider = self._loaded.get(name)
+        if provider is None:
+            with self._lock:
+                provider = self._loaded.get(name)
+                if provider is None:
+                    source = self._sources[name]
+                    provider = importlib.import_module(source) if isinstance(source, str) else source
+                    if self.app is not None and hasattr(provider, 'init_app'):
+                        provider.init_app(self.app)
+                    self._loaded[name] = provider
+        return provider
+
+    def is_loaded(self, name):
+        return name in self._loaded
+
+    def names(self, api_key=None):
+        """The enabled providers that can serve a caller with or without an API key, in order."""
+        return [name for name in self.enabled if api_key or name not in self._needs_key]
+
+    def fetcher(self, name, api_key=None):
+        """A get_prices callable for name that loads the provider only when called."""
+        if name in self._needs_key:
+            return lambda symbols: self.get(name).get_prices(symbols, api_key)
+        return lambda symbols: self.get(name).get_prices(symbols)
+
+    def providers(self, capability, api_key=None):
+        """Yields (name, provider) for the enabled providers with a capability, loading each as it is reached."""
+        for name in self.names(api_key):
+            provider = self.get(name)
+            if hasattr(provider, capability):
+                yield name, provider
+
+    def needs_key(self, name):
+        return name in self._needs_key
+
+
+registry = ProviderRegistry()
@@ -0,0 +1,67 @@
+"""
+Prices from a local CSV file (symbol,price[,timestamp[,currency]] per line), for offline
+development, demos and load tests. The file is re-read when it changes.
+"""
+import csv
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+path = None
+_lock = threading.Lock()
+_prices = {}
+_mtime = None
+
+def init_app(app):
+    global path, _mtime
+    configured = app.config.get('LOCAL_PRICES_PATH')
+    if configured and not os.path.isabs(configured):
+        configured = os.path.join(app.instance_path, configured)
+    with _lock:
+        path = configured
+        _prices.clear()
+        _mtime = None
+
+def available():
+    return bool(path) and os.path.exists(path)
+
+def _maybe_reload():
+    # Caller holds _lock
+    global _mtime
+    if not path or not os.path.exists(path):
+        return
+    mtime = os.path.getmtime(path)
+    if mtime == _mtime:
+        return
+    prices = {}
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or row[0].startswith('#') or row[0].lower() == 'symbol':
+                continue
+            try:
+                price = float(row[1])
+            except ValueError:
+                continue
+            quote = {'price': price, 'timestamp': row[2].strip() if len(row) > 2 else ''}
+            if len(row) > 3 and row[3].strip():
+                quote['currency'] = row[3].strip().upper()
+            prices[row[0].strip().upper()] = quote
+    _prices.clear()
+    _prices.update(prices)
+    _mtime = mtime
+    logger.info("Loaded %d local prices from %s", len(prices), path)
+
+def get_prices(symbols):
+    with _lock:
+        _maybe_reload()
+        return {s: dict(_prices[s]) for s in symbols if s in _prices}
+
+def verify_symbol(symbol):
+    with _lock:
+        _maybe_reload()
+        # Only a file that exists can say a symbol does not
+        if _mtime is None:
+            return None
+        return symbol in _prices
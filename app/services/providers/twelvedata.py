@@ -0,0 +1,128 @@
+import logging
+from app.services.transport import ProviderClient, CircuitOpenError
+from app.services.rate_limit import RateLimiter
+from app.services.metrics import track_upstream
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = "https://api.twelvedata.com"
+BATCH_SIZE = 8 # Symbols per /quote call; each symbol costs one credit
+MAX_WAIT = 2 # Seconds to wait for credits before falling back to Yahoo
+
+client = ProviderClient('twelvedata', BASE_URL)
+rate_limiter = RateLimiter()
+
+def init_app(app):
+    """Applies transport settings and the credit budget from the app config."""
+    client.configure(
+        base_url=app.config.get('TWELVE_DATA_URL', BASE_URL),
+        connect_timeout=app.config.get('MARKET_DATA_CONNECT_TIMEOUT'),
+        read_timeout=app.config.get('MARKET_DATA_READ_TIMEOUT'),
+        retries=app.config.get('MARKET_DATA_RETRIES'),
+        backoff=app.config.get('MARKET_DATA_BACKOFF'),
+        pool_size=app.config.get('MARKET_DATA_POOL_SIZE'),
+        failure_threshold=app.config.get('CIRCUIT_BREAKER_THRESHOLD'),
+        reset_timeout=app.config.get('CIRCUIT_BREAKER_RESET'),
+    )
+    client.breaker.reset()
+    rate_limiter.configure(capacity=app.config.get('TWELVE_DATA_CREDITS_PER_MINUTE'), per_seconds=60)
+
+    global BATCH_SIZE, MAX_WAIT
+    BATCH_SIZE = app.config.get('TWELVE_DATA_BATCH_SIZE', BATCH_SIZE)
+    MAX_WAIT = app.config.get('TWELVE_DATA_MAX_WAIT', MAX_WAIT)
+
+def available():
+    return client.breaker.state != 'open'
+
+def verify_symbol(symbol, api_key):
+    """True if Twelve Data has a quote for symbol, None if it could not say."""
+    if not rate_limiter.acquire(api_key, 1, timeout=MAX_WAIT):
+        return None
+    params = {
+        "symbol": symbol,
+        "apikey": api_key
+    }
+    try:
+        with track_upstream('twelvedata'):
+            data = client.get_json("/quote", params=params)
+        if "code" not in data or data["code"] == 200:
+            return True
+    except Exception as e:
+        logger.warning("Twelve Data check failed: %s", e)
+    return None
+
+def fetch_symbol_universe(api_key=None):
+    """
+    Downloads the list of stocks and ETFs as (symbol, name) rows.
+    These reference endpoints do not use quote credits.
+    """
+    rows = {}
+    for path in ("/stocks", "/etf"):
+        params = {"apikey": api_key} if api_key else {}
+        with track_upstream('twelvedata'):
+            data = client.get_json(path, params=params)
+        for item in data.get("data", []):
+            symbol = item.get("symbol")
+            if symbol:
+                rows.setdefault(symbol.upper(), item.get("name", ""))
+    return sorted(rows.items())
+
+def get_prices(symbols, api_key):
+    """
+    Fetches quotes in batches that fit the per-call credit budget.
+    Each batch first takes its credits (one per symbol) from the key's token
+    bucket; batches that cannot get credits in time are left for the fallback.
+    """
+    results = {}
+
+    # Helper to process single item
+    def process_item(sym, item):
+        if "close" in item:
+            quote = {
+                'price': float(item["close"]),
+                'timestamp': item.get("datetime", "")
+            }
+            # Listing currency; FX pairs ('USD/CAD') report currency_base/currency_quote instead
+            if item.get("currency"):
+                quote['currency'] = item["currency"].upper()
+            return quote
+        return None
+
+    for start in range(0, len(symbols), BATCH_SIZE):
+        batch = symbols[start:start + BATCH_SIZE]
+        if not rate_limiter.acquire(api_key, len(batch), timeout=MAX_WAIT):
+            logger.info("Twelve Data quota exhausted, skipping %d symbols", len(symbols) - start)
+            break
+
+        params = {
+            "symbol": ",".join(batch),
+            "apikey": api_key
+        }
+        try:
+            data = client.get_json("/quote", params=params)
+        except CircuitOpenError:
+            # Provider keeps failing: go straight to the fallback
+            break
+        except Exception as e:
+            logger.warning("Twelve Data fetch failed: %s", e)
+            continue
+
+        if data.get("code") == 429:
+            # Quota spent elsewhere (another worker or app): stop spending until it refills
+            rate_limiter.drain(api_key)
+            break
+
+        if len(batch) == 1:
+            # Single symbol response is a dict
+            res = process_item(batch[0], data)
+            if res:
+                results[batch[0]] = res
+        else:
+            # Multiple symbols response is dict of dicts
+            for sym in batch:
+                if isinstance(data.get(sym), dict):
+                    res = process_item(sym, data[sym])
+                    if res:
+                        results[sym] = res
+
+    return results
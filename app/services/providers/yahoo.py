@@ -0,0 +1,132 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import yfinance as yf
+from app.services.transport import CircuitBreaker
+from app.services.metrics import track_upstream
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = 8 # Thread pool size for symbols the batch download drops
+
+# yfinance manages its own HTTP session, so Yahoo only gets a breaker
+breaker = CircuitBreaker('yahoo')
+
+def init_app(app):
+    breaker.failure_threshold = app.config.get('CIRCUIT_BREAKER_THRESHOLD', breaker.failure_threshold)
+    breaker.reset_timeout = app.config.get('CIRCUIT_BREAKER_RESET', breaker.reset_timeout)
+    breaker.reset()
+
+def available():
+    return breaker.state != 'open'
+
+def ticker_for(symbol):
+    """Yahoo's ticker for a symbol: FX pairs are 'USDCAD=X' rather than 'USD/CAD'."""
+    return symbol.replace('/', '') + '=X' if '/' in symbol else symbol
+
+def verify_symbol(symbol):
+    """True or False, or None when Yahoo could not answer."""
+    if not breaker.allow():
+        logger.info("Yahoo Finance check skipped: circuit is open")
+        return None
+    try:
+        ticker = yf.Ticker(symbol)
+        # Try fetching 1 day of history to verify existence
+        with track_upstream('yahoo'):
+            hist = ticker.history(period="1d")
+        breaker.record_success()
+        if not hist.empty:
+            return True
+        # If history is empty, it likely doesn't exist
+        return False
+    except Exception as e:
+        breaker.record_failure()
+        logger.warning("Yahoo Finance check failed: %s", e)
+        return None
+
+def get_price(symbol):
+    if not breaker.allow():
+        return None
+    try:
+        ticker = yf.Ticker(ticker_for(symbol))
+        # Get latest data
+        # history(period='1d') returns a DataFrame
+        hist = ticker.history(period="1d")
+        breaker.record_success()
+        if not hist.empty:
+            price = float(hist['Close'].iloc[-1])
+            # Timestamp from the index (Date)
+            timestamp = hist.index[-1].strftime('%Y-%m-%d %H:%M:%S')
+            return {'price': price, 'timestamp': timestamp}
+    except Exception as e:
+        breaker.record_failure()
+        logger.warning("Error fetching Yahoo price for %s: %s", symbol, e)
+    return None
+
+def get_prices(symbols):
+    """
+    Fetches prices for many symbols.
+    All symbols go out in one multi-ticker download; any symbol the batch drops
+    is retried individually on a bounded thread pool, so latency follows the
+    slowest symbol rather than the number of symbols.
+    """
+    results = {}
+    symbols = list(dict.fromkeys(symbols))
+    if not symbols or not breaker.allow():
+        return results
+
+    try:
+        # 5 days so every exchange has at least one close, even after a holiday
+        data = yf.download([ticker_for(sym) for sym in symbols], period="5d", group_by="ticker",
+                           auto_adjust=False, threads=True, progress=False)
+        for sym in symbols:
+            try:
+                closes = data[ticker_for(sym)]['Close'].dropna()
+            except KeyError:
+                continue
+            if not closes.empty:
+                results[sym] = {
+                    'price': float(closes.iloc[-1]),
+                    'timestamp': closes.index[-1].strftime('%Y-%m-%d %H:%M:%S')
+                }
+        breaker.record_success()
+    except Exception as e:
+        breaker.record_failure()
+        logger.warning("Yahoo batch download failed: %s", e)
+
+    dropped = [sym for sym in symbols if sym not in results]
+    if dropped:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(dropped))) as pool:
+            for sym, res in zip(dropped, pool.map(get_price, dropped)):
+                if res:
+                    results[sym] = res
+
+    return results
+
+def get_history(symbols, start):
+    """
+    Daily closes since `start` (a date) for many symbols, in one multi-ticker download.
+    Returns {symbol: (dates, closes)} as datetime64[D] and float arrays.
+    """
+    results = {}
+    symbols = list(dict.fromkeys(symbols))
+    if not symbols or not breaker.allow():
+        return results
+
+    try:
+        with track_upstream('yahoo'):
+            data = yf.download(symbols, start=start.isoformat(), interval="1d", group_by="ticker",
+                               auto_adjust=False, threads=True, progress=False)
+        for sym in symbols:
+            try:
+                closes = data[sym]['Close'].dropna()
+            except KeyError:
+                continue
+            if not closes.empty:
+                dates = np.array(closes.index.strftime('%Y-%m-%d'), dtype='datetime64[D]')
+                results[sym] = (dates, closes.to_numpy(dtype=float))
+        breaker.record_success()
+    except Exception as e:
+        breaker.record_failure()
+        logger.warning("Yahoo history download failed: %s", e)
+    return results
@@ -0,0 +1,351 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from app.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class SharedQuoteStore:
+    """
+    On-disk tier of the quote cache.
+    A small SQLite file that every worker process opens, so a quote fetched
+    by one gunicorn worker is visible to all the others.
+    A NULL price marks a negative entry (symbol that failed to resolve).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS quotes ("
+            " symbol TEXT PRIMARY KEY,"
+            " price REAL,"
+            " timestamp TEXT,"
+            " fetched_at REAL NOT NULL,"
+            " currency TEXT)"
+        )
+        # Files from before quotes carried their currency
+        if 'currency' not in {row[1] for row in conn.execute("PRAGMA table_info(quotes)")}:
+            conn.execute("ALTER TABLE quotes ADD COLUMN currency TEXT")
+        conn.commit()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, symbols):
+        if not symbols:
+            return {}
+        placeholders = ",".join("?" * len(symbols))
+        rows = self._connect().execute(
+            f"SELECT symbol, price, timestamp, fetched_at, currency FROM quotes WHERE symbol IN ({placeholders})",
+            list(symbols)
+        ).fetchall()
+        entries = {}
+        for symbol, price, timestamp, fetched_at, currency in rows:
+            quote = None if price is None else {'price': price, 'timestamp': timestamp}
+            if quote and currency:
+                quote['currency'] = currency
+            entries[symbol] = (quote, fetched_at)
+        return entries
+
+    def set_many(self, entries):
+        rows = []
+        for symbol, (quote, fetched_at) in entries.items():
+            if quote is None:
+                rows.append((symbol, None, None, fetched_at, None))
+            else:
+                rows.append((symbol, quote['price'], quote['timestamp'], fetched_at, quote.get('currency')))
+        if rows:
+            self._connect().executemany(
+                "INSERT OR REPLACE INTO quotes (symbol, price, timestamp, fetched_at, currency) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def clear(self):
+        self._connect().execute("DELETE FROM quotes")
+
+    def close(self):
+        """Closes this thread's connection, e.g. before forking; the next call reopens it."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class QuoteCache:
+    """
+    Two-tier quote cache used by market_data.get_prices.
+
+    Tier 1 is an in-process LRU, tier 2 is a SQLite file shared by all workers.
+    Each entry is either fresh (younger than the symbol's TTL), stale (past the
+    TTL but inside the stale-while-revalidate window, served immediately while a
+    background refresh runs) or expired (treated as a miss).
+    Failed symbols are cached as negative entries with their own, shorter TTL.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()
+        self._refreshing = set()
+        self._executor = None
+        self.store = None
+        self.max_entries = 1024
+        self.default_ttl = 60
+        self.ttls = {}
+        self.negative_ttl = 300
+        self.stale_ttl = 900
+        self.background_refresh = True
+        self.reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('QUOTE_CACHE_SIZE', self.max_entries)
+        self.default_ttl = app.config.get('QUOTE_CACHE_TTL', self.default_ttl)
+        self.ttls = dict(app.config.get('QUOTE_CACHE_TTLS', {}))
+        self.negative_ttl = app.config.get('QUOTE_CACHE_NEGATIVE_TTL', self.negative_ttl)
+        self.stale_ttl = app.config.get('QUOTE_CACHE_STALE_TTL', self.stale_ttl)
+        self.background_refresh = app.config.get('QUOTE_CACHE_BACKGROUND_REFRESH', True)
+
+        path = app.config.get('QUOTE_CACHE_PATH')
+        if path:
+            if not os.path.isabs(path):
+                os.makedirs(app.instance_path, exist_ok=True)
+                path = os.path.join(app.instance_path, path)
+            self.store = SharedQuoteStore(path)
+        else:
+            self.store = None
+
+        with self._lock:
+            self._lru.clear()
+            self.reset_stats()
+        app.extensions['quote_cache'] = self
+
+    def ttl_for(self, symbol):
+        return self.ttls.get(symbol, self.default_ttl)
+
+    def reset_stats(self):
+        self.stats = {
+            'hits': 0,
+            'shared_hits': 0,
+            'stale_hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+        }
+
+    def _state(self, symbol, quote, fetched_at, now):
+        age = now - fetched_at
+        if quote is None:
+            return 'negative' if age < self.negative_ttl else 'expired'
+        ttl = self.ttl_for(symbol)
+        if age < ttl:
+            return 'fresh'
+        if age < ttl + self.stale_ttl:
+            return 'stale'
+        return 'expired'
+
+    def _remember(self, symbol, entry):
+        # Caller holds self._lock
+        self._lru[symbol] = entry
+        self._lru.move_to_end(symbol)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def lookup(self, symbols):
+        """
+        Splits symbols into cached results and symbols that need fetching.
+        Returns (fresh, stale, missing): fresh and stale map symbol to quote,
+        missing lists symbols with no usable entry. Negative entries appear in
+        none of them, so known-bad symbols are not fetched again until they expire.
+        """
+        now = time.time()
+        fresh, stale, missing = {}, {}, []
+        pending = []
+
+        with self._lock:
+            for symbol in symbols:
+                entry = self._lru.get(symbol)
+                if entry is None:
+                    pending.append(symbol)
+                    continue
+                state = self._state(symbol, entry[0], entry[1], now)
+                if state == 'expired':
+                    pending.append(symbol)
+                    continue
+                self._lru.move_to_end(symbol)
+                self._count(symbol, entry, state, fresh, stale)
+
+        if pending and self.store is not None:
+            try:
+                shared = self.store.get_many(pending)
+            except sqlite3.Error as e:
+                logger.warning("Shared quote cache read failed: %s", e)
+                shared = {}
+            with self._lock:
+                for symbol in list(pending):
+                    entry = shared.get(symbol)
+                    if entry is None:
+                        continue
+                    state = self._state(symbol, entry[0], entry[1], now)
+                    if state == 'expired':
+                        continue
+                    self._remember(symbol, entry)
+                    self.stats['shared_hits'] += 1
+                    self._count(symbol, entry, state, fresh, stale)
+                    pending.remove(symbol)
+
+        with self._lock:
+            self.stats['misses'] += len(pending)
+        missing.extend(pending)
+        return fresh, stale, missing
+
+    def _count(self, symbol, entry, state, fresh, stale):
+        # Caller holds self._lock
+        if state == 'fresh':
+            self.stats['hits'] += 1
+            fresh[symbol] = entry[0]
+        elif state == 'stale':
+            self.stats['stale_hits'] += 1
+            stale[symbol] = entry[0]
+        else:
+            self.stats['negative_hits'] += 1
+
+    def store_results(self, symbols, results):
+        """
+        Records the outcome of a fetch: every symbol in `results` is stored as
+        a fresh quote, every other requested symbol as a negative entry.
+        """
+        now = time.time()
+        entries = {}
+        for symbol in symbols:
+            entries[symbol] = (results.get(symbol), now)
+        with self._lock:
+            for symbol, entry in entries.items():
+                self._remember(symbol, entry)
+        if self.store is not None:
+            try:
+                self.store.set_many(entries)
+            except sqlite3.Error as e:
+                logger.warning("Shared quote cache write failed: %s", e)
+
+    def fetched_times(self, quotes):
+        """
+        Returns {symbol: fetched_at} for those of `quotes` ({symbol: quote})
+        that are still the in-memory entry for their symbol: when each was
+        fetched upstream, which for a cached quote is earlier than now.
+        """
+        times = {}
+        with self._lock:
+            for symbol, quote in quotes.items():
+                entry = self._lru.get(symbol)
+                if entry is not None and entry[0] == quote:
+                    times[symbol] = entry[1]
+        return times
+
+    def revalidate(self, symbols, fetch):
+        """
+        Refreshes stale symbols with `fetch(symbols) -> {symbol: quote}`.
+        Runs in a background thread unless QUOTE_CACHE_BACKGROUND_REFRESH is off.
+        Symbols already being refreshed are skipped.
+        """
+        with self._lock:
+            symbols = [s for s in symbols if s not in self._refreshing]
+            self._refreshing.update(symbols)
+        if not symbols:
+            return
+
+        def run():
+            try:
+                results = fetch(symbols)
+                # A failed refresh keeps serving the stale quote rather than
+                # replacing it with a negative entry.
+                self.store_results([s for s in symbols if s in results], results)
+                with self._lock:
+                    self.stats['refreshes'] += 1
+            except Exception as e:
+                logger.warning("Quote cache refresh failed: %s", e)
+                with self._lock:
+                    self.stats['refresh_errors'] += 1
+            finally:
+                with self._lock:
+                    self._refreshing.difference_update(symbols)
+
+        if self.background_refresh:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='quote-refresh')
+            self._executor.submit(run)
+        else:
+            run()
+
+    def prime(self, symbols, stored=None):
+        """
+        Loads quotes into memory ahead of traffic, e.g. when a worker starts:
+        from the shared store, else from `stored` ({symbol: (quote,
+        fetched_at)}). Expired entries are skipped and nothing is counted in
+        the stats. Returns how many symbols were loaded.
+        """
+        entries = dict(stored or {})
+        if self.store is not None:
+            try:
+                entries.update(self.store.get_many(list(symbols)))
+            except sqlite3.Error as e:
+                logger.warning("Shared quote cache read failed: %s", e)
+        now = time.time()
+        loaded = 0
+        with self._lock:
+            for symbol in symbols:
+                entry = entries.get(symbol)
+                if entry is None or self._state(symbol, entry[0], entry[1], now) == 'expired':
+                    continue
+                self._remember(symbol, entry)
+                loaded += 1
+        return loaded
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+        if self.store is not None:
+            self.store.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._lru)
+            stats['refreshing'] = len(self._refreshing)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['negative_hits'] + stats['misses']
+        stats['hit_rate'] = (lookups - stats['misses']) / lookups if lookups else 0.0
+        return stats
+
+
+quote_cache = QuoteCache()
+
+@registry.collector
+def quote_cache_metrics():
+    stats = quote_cache.get_stats()
+    lines = ['# HELP quote_cache_lookups_total Quote cache lookups by result.',
+             '# TYPE quote_cache_lookups_total counter']
+    for result in ('hits', 'stale_hits', 'negative_hits', 'misses'):
+        lines.append(f'quote_cache_lookups_total{{result="{result}"}} {stats[result]}')
+    # A subset of the hits above, not another result: lookups answered by the shared tier
+    lines += ['# HELP quote_cache_shared_hits_total Lookups answered from the shared tier rather than memory.',
+              '# TYPE quote_cache_shared_hits_total counter',
+              f'quote_cache_shared_hits_total {stats["shared_hits"]}']
+    lines += ['# HELP quote_cache_entries Quotes held in memory.',
+              '# TYPE quote_cache_entries gauge',
+              f'quote_cache_entries {stats["entries"]}']
+    return lines
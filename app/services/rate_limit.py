@@ -0,0 +1,129 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+class TokenBucket:
+    """
+    Token bucket holding up to `capacity` credits, refilled continuously at
+    `rate` credits per second.
+    """
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, credits=1, timeout=0):
+        """
+        Takes `credits` tokens, waiting up to `timeout` seconds for them.
+        Returns False without taking anything if they do not arrive in time
+        or if the request is larger than the bucket.
+        """
+        if credits > self.capacity:
+            return False
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= credits:
+                    self.tokens -= credits
+                    return True
+                wait = (credits - self.tokens) / self.rate if self.rate else float('inf')
+                if now + wait > deadline:
+                    return False
+                self._cond.wait(wait)
+
+    def drain(self):
+        """Empties the bucket, e.g. after the provider reports the quota as spent."""
+        with self._cond:
+            self._refill(time.monotonic())
+            self.tokens = 0.0
+
+
+class RateLimiter:
+    """
+    One token bucket per key (a Twelve Data API key).
+    Buckets live in the worker process, so with several workers each one
+    should be given its share of the key's quota.
+    """
+
+    def __init__(self, capacity=8, per_seconds=60):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self.configure(capacity, per_seconds)
+
+    def configure(self, capacity=None, per_seconds=None):
+        with self._lock:
+            if capacity is not None:
+                self.capacity = capacity
+            if per_seconds is not None:
+                self.per_seconds = per_seconds
+            self._buckets.clear()
+
+    def bucket(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.capacity, self.capacity / self.per_seconds)
+                self._buckets[key] = bucket
+            return bucket
+
+    def acquire(self, key, credits=1, timeout=0):
+        return self.bucket(key).acquire(credits, timeout)
+
+    def drain(self, key):
+        self.bucket(key).drain()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent fetches per key.
+    `run(keys, fetch)` calls `fetch` only for keys nobody else is fetching
+    right now and waits on the in-flight results for the rest, so two
+    requests for overlapping symbol sets share one upstream call per symbol.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def run(self, keys, fetch, timeout=None):
+        owned, waiting = [], {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                future = self._inflight.get(key)
+                if future is None:
+                    future = Future()
+                    self._inflight[key] = future
+                    owned.append(key)
+                else:
+                    waiting[key] = future
+
+        results = {}
+        if owned:
+            fetched = {}
+            try:
+                fetched = fetch(owned)
+            finally:
+                with self._lock:
+                    for key in owned:
+                        future = self._inflight.pop(key)
+                        future.set_result(fetched.get(key))
+            results.update((k, v) for k, v in fetched.items() if k in owned)
+
+        for key, future in waiting.items():
+            try:
+                value = future.result(timeout)
+            except Exception:
+                value = None
+            if value is not None:
+                results[key] = value
+        return results
@@ -0,0 +1,286 @@
+import heapq
+import numpy as np
+
+def _as_batch(units, prices, targets, cash):
+    units = np.atleast_2d(np.asarray(units, dtype=float))
+    prices = np.atleast_2d(np.asarray(prices, dtype=float))
+    targets = np.atleast_2d(np.asarray(targets, dtype=float))
+    cash = np.atleast_1d(np.asarray(cash, dtype=float))
+    return units, prices, targets, cash
+
+def fractional_trades(units, prices, targets, cash):
+    """
+    Unit changes that hit every target exactly, for a batch of portfolios.
+    All arrays are (portfolios, holdings); targets are fractions of the
+    portfolio value after adding cash; cash is (portfolios,).
+    Holdings without a price get no trade.
+    """
+    values = units * prices
+    total = values.sum(axis=1) + cash
+    target_values = total[:, None] * targets
+    priced = prices > 0
+    return np.where(priced, (target_values - values) / np.where(priced, prices, 1), 0.0), target_values
+
+def whole_unit_trades(units, prices, targets, cash, fractional=None, target_values=None):
+    """
+    Whole-unit trades that stay within available cash, for a batch of portfolios.
+
+    Starts from the fractional trades truncated toward zero, with the buys
+    first scaled down to the cash the truncated sells leave (targets adding
+    up to more than 100% ask for more than there is), then
+      1. if rounding still left less cash than needed (truncated sells raise
+         less than a withdrawal, i.e. negative cash, asks for), gives up one
+         buy unit or sells one more unit in each of the holdings where that
+         least increases drift, in that order, until the cash is covered, and
+      2. spends what is left one unit at a time on the most underweight
+         holding, as long as that unit brings it closer to target.
+    Every step works on all portfolios at once. Step 1 is a single pass;
+    rounding leaves less than a unit per holding to spend, so step 2 costs
+    about as many NumPy passes as the largest portfolio has holdings.
+    Returns (trades, cash_left).
+    """
+    if fractional is None:
+        fractional, target_values = fractional_trades(units, prices, targets, cash)
+    priced = prices > 0
+    rows = np.arange(units.shape[0])
+    sells = np.trunc(np.minimum(fractional, 0))
+    buys = np.maximum(fractional, 0)
+    available = np.maximum(cash - (sells * prices).sum(axis=1), 0)
+    needed = (buys * prices).sum(axis=1)
+    scale = np.where(needed > available, available / np.where(needed > 0, needed, 1), 1.0)
+    trades = sells + np.trunc(buys * scale[:, None])
+    cash_left = cash - (trades * prices).sum(axis=1)
+
+    # 1. Cover any shortfall left by rounding in one pass: rank the holdings by how
+    #    little one unit less adds to drift and cut one unit from each, best first,
+    #    until the cash is covered
+    short = -cash_left
+    if (short > 1e-9).any():
+        over = (units + trades) * prices - target_values
+        # Cancelling a buy unit or selling one more unit both raise cash by one price
+        can_cut = priced & (units + trades >= 1)
+        order = np.argsort(-np.where(can_cut, over - prices / 2, -np.inf), axis=1, kind='stable')
+        raised = np.take_along_axis(np.where(can_cut, prices, 0.0), order, axis=1)
+        # A unit is cut if what the better-ranked cuts raise does not cover the shortfall yet
+        cut = np.zeros_like(trades)
+        np.put_along_axis(cut, order, (raised > 0) & (np.cumsum(raised, axis=1) - raised < short[:, None] - 1e-9),
+                          axis=1)
+        trades -= cut
+        cash_left += (cut * prices).sum(axis=1)
+
+    # 2. Spend the remainder
+    while True:
+        shortfall = target_values - (units + trades) * prices
+        # One more unit reduces squared drift only if the holding is more than half a unit under target
+        can_buy = priced & (prices <= cash_left[:, None] + 1e-9) & (shortfall > prices / 2)
+        if not can_buy.any():
+            break
+        pick = np.where(can_buy, shortfall, -np.inf).argmax(axis=1)
+        buying = can_buy.any(axis=1)
+        trades[rows[buying], pick[buying]] += 1
+        cash_left[buying] -= prices[rows[buying], pick[buying]]
+
+    return trades, cash_left
+
+def rebalance(units, prices, targets, cash=0.0):
+    """
+    Rebalances one portfolio.
+    units, prices and targets are per-holding sequences (targets as fractions).
+    Returns (fractional_trades, whole_unit_trades, cash_left, target_values) as
+    1-D arrays / a float; positive trades are buys, negative are sells.
+    """
+    units, prices, targets, cash = _as_batch(units, prices, targets, cash)
+    fractional, target_values = fractional_trades(units, prices, targets, cash)
+    whole, cash_left = whole_unit_trades(units, prices, targets, cash, fractional, target_values)
+    return fractional[0], whole[0], float(cash_left[0]), target_values[0]
+
+def rebalance_batch(portfolios):
+    """
+    Rebalances many portfolios in one vectorized call.
+    `portfolios` is a list of (units, prices, targets, cash); portfolios of
+    different sizes are padded with unpriced holdings, which never trade.
+    Returns one (fractional, whole, cash_left, target_values) tuple per portfolio.
+    """
+    if not portfolios:
+        return []
+    width = max(len(p[0]) for p in portfolios)
+    shape = (len(portfolios), width)
+    units, prices, targets = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+    cash = np.zeros(len(portfolios))
+    for i, (u, p, t, c) in enumerate(portfolios):
+        n = len(u)
+        units[i, :n], prices[i, :n], targets[i, :n], cash[i] = u, p, t, c
+
+    fractional, target_values = fractional_trades(units, prices, targets, cash)
+    whole, cash_left = whole_unit_trades(units, prices, targets, cash, fractional, target_values)
+
+    results = []
+    for i, p in enumerate(portfolios):
+        n = len(p[0])
+        results.append((fractional[i, :n], whole[i, :n], float(cash_left[i]), target_values[i, :n]))
+    return results
+
+def _min_cost_flow(n, edges, source, sink):
+    """
+    Maximum flow of minimum cost on a small graph of n nodes (primal-dual:
+    Dijkstra sets node potentials, then Dinic pushes a blocking flow along
+    every cheapest path at once). Costs must be small non-negative integers,
+    so there are only as many phases as distinct path costs.
+    `edges` is a list of (from, to, capacity, cost); returns the flow on each edge.
+    """
+    graph = [[] for _ in range(n)]
+    to, cap, cost = [], [], []
+    for u, v, c, w in edges:
+        graph[u].append(len(to)); to.append(v); cap.append(c); cost.append(w)
+        graph[v].append(len(to)); to.append(u); cap.append(0.0); cost.append(-w)
+    eps = 1e-9
+    inf = float('inf')
+    potential = [0] * n
+    while True:
+        # Cheapest distances from the source under reduced costs
+        dist = [inf] * n
+        dist[source] = 0
+        heap = [(0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for e in graph[u]:
+                if cap[e] > eps:
+                    v = to[e]
+                    nd = d + cost[e] + potential[u] - potential[v]
+                    if nd < dist[v]:
+                        dist[v] = nd
+                        heapq.heappush(heap, (nd, v))
+        if dist[sink] == inf:
+            break
+        for u in range(n):
+            if dist[u] < inf:
+                potential[u] += dist[u]
+
+        # Blocking flows on the edges that lie on cheapest paths
+        def admissible(e, u):
+            v = to[e]
+            return cap[e] > eps and dist[v] < inf and cost[e] + potential[u] - potential[v] == 0
+        while True:
+            level = [-1] * n
+            level[source] = 0
+            queue = [source]
+            for u in queue:
+                for e in graph[u]:
+                    if level[to[e]] < 0 and admissible(e, u):
+                        level[to[e]] = level[u] + 1
+                        queue.append(to[e])
+            if level[sink] < 0:
+                break
+            cursor = [0] * n
+
+            def push(u, limit):
+                if u == sink:
+                    return limit
+                edges_u = graph[u]
+                while cursor[u] < len(edges_u):
+                    e = edges_u[cursor[u]]
+                    v = to[e]
+                    if level[v] == level[u] + 1 and admissible(e, u):
+                        pushed = push(v, min(limit, cap[e]))
+                        if pushed > eps:
+                            cap[e] -= pushed
+                            cap[e ^ 1] += pushed
+                            return pushed
+                    cursor[u] += 1
+                return 0.0
+
+            while push(source, inf) > eps:
+                pass
+    # Flow on an edge is what its reverse edge has gained
+    return [cap[2 * i + 1] for i in range(len(edges))]
+
+def household_rebalance(units, prices, eligible, targets, cash):
+    """
+    Rebalances several accounts toward one household allocation.
+
+    units and eligible are (accounts, symbols); prices (in one currency) and
+    targets (fractions of the household value including cash) are (symbols,);
+    cash is (accounts,). Cash cannot move between accounts, and an account
+    only trades the symbols it is eligible for.
+
+    Trades are planned as a minimum-cost flow of money, with the value traded
+    as the cost: cash and the proceeds of overweight symbols flow, inside
+    each account, to the underweight symbols it may buy. When an account has
+    money but cannot buy what is short, it can buy a symbol another account
+    holds while that account sells it, which moves the money across at the
+    price of two extra trades. So the plan reaches the household targets as
+    closely as the constraints allow with the least value traded. Excess that
+    cannot be reinvested is still sold and stays as cash. Whole units then
+    follow the per-account plan with the same rules as `whole_unit_trades`.
+    Returns (fractional, whole, cash_left, target_values): (accounts, symbols)
+    unit changes, (accounts,) cash and the household (symbols,) target values.
+    """
+    units = np.asarray(units, dtype=float)
+    prices = np.asarray(prices, dtype=float)
+    eligible = np.asarray(eligible, dtype=bool) & (prices > 0)
+    targets = np.asarray(targets, dtype=float)
+    cash = np.asarray(cash, dtype=float)
+    accounts, symbols = units.shape
+
+    values = units * prices
+    target_values = (values.sum() + cash.sum()) * targets
+    gap = np.where(prices > 0, target_values - values.sum(axis=0), 0.0)
+    sellable = np.where(eligible, values, 0.0)
+    excess = np.minimum(np.maximum(-gap, 0), sellable.sum(axis=0))
+    need = np.maximum(gap, 0)
+    held = list(zip(*np.nonzero(sellable > 1e-9)))
+    total = values.sum() + cash.sum() + 1.0
+
+    # Nodes: source, sink, accounts, per symbol a seller and a buyer, per held position its account's shares
+    source, sink = 0, 1
+    account = lambda a: 2 + a
+    seller = lambda s: 2 + accounts + s
+    buyer = lambda s: 2 + accounts + symbols + s
+    position = {key: 2 + accounts + 2 * symbols + i for i, key in enumerate(held)}
+    edges, keys = [], []
+    def add(u, v, capacity, cost, key=None):
+        edges.append((u, v, float(capacity), cost))
+        keys.append(key)
+
+    for a in np.flatnonzero(cash > 1e-9):
+        add(source, account(a), cash[a], 0)
+    for s in np.flatnonzero(excess > 1e-9):
+        add(source, seller(s), excess[s], 0)
+    for (a, s), node in position.items():
+        # Selling from a position credits its account
+        add(seller(s), node, sellable[a, s], 0)
+        add(node, account(a), sellable[a, s], 1, ('sell', a, s))
+    for a, s in zip(*np.nonzero(eligible)):
+        if need[s] > 1e-9:
+            add(account(a), buyer(s), total, 1, ('buy', a, s))
+        if (sellable[:, s] > 1e-9).any():
+            # Buying a held symbol here so another account can sell it
+            add(account(a), seller(s), total, 1, ('buy', a, s))
+    for s in np.flatnonzero(need > 1e-9):
+        add(buyer(s), sink, need[s], 0)
+
+    sold, bought = np.zeros_like(values), np.zeros_like(values)
+    for key, flow in zip(keys, _min_cost_flow(2 + accounts + 2 * symbols + len(held), edges, source, sink)):
+        if key is not None:
+            (sold if key[0] == 'sell' else bought)[key[1], key[2]] += flow
+    # A symbol bought and sold in the same account nets out
+    net = np.minimum(sold, bought)
+    sold, bought = sold - net, bought - net
+
+    # Sell the rest of the excess too, from whichever accounts still hold it
+    for s in np.flatnonzero(np.maximum(-gap, 0) - (sold - bought).sum(axis=0) > 1e-6):
+        left = min(-gap[s], sellable[:, s].sum()) - (sold[:, s] - bought[:, s]).sum()
+        for a in np.flatnonzero(sellable[:, s] - sold[:, s] > 1e-9):
+            if left <= 1e-9:
+                break
+            amount = min(left, sellable[a, s] - sold[a, s])
+            sold[a, s] += amount
+            left -= amount
+
+    account_prices = np.where(eligible, prices, 0.0)
+    account_targets = values + bought - sold
+    fractional = np.where(eligible, (bought - sold) / np.where(eligible, account_prices, 1), 0.0)
+    whole, cash_left = whole_unit_trades(units, account_prices, None, cash, fractional, account_targets)
+    return fractional, whole, cash_left, target_values
@@ -0,0 +1,208 @@
+import logging
+import os
+import threading
+import time
+try:
+    import fcntl
+except ImportError: # Windows: every process refreshes
+    fcntl = None
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app import db
+from app.models import User, Portfolio, Holding, Quote
+from app.services import market_data
+from app.services.fx import fx_rates
+from app.services.history import price_history
+from app.services.write_behind import write_buffer
+
+logger = logging.getLogger(__name__)
+
+
+class PriceRefresher:
+    """
+    Keeps the quote table up to date outside the request cycle.
+
+    Every tick it collects the distinct symbols across all holdings and
+    refreshes the ones that are due: symbols in a portfolio viewed within
+    PRICE_REFRESH_HOT_WINDOW every PRICE_REFRESH_INTERVAL seconds, all others
+    every PRICE_REFRESH_COLD_INTERVAL seconds. Hot symbols go first. The FX
+    pairs portfolios need for their base currencies are refreshed every
+    FX_REFRESH_INTERVAL seconds in the same batches, ahead of everything else.
+    It also appends new daily closes to the local price history.
+
+    Runs as a daemon thread inside the app (PRICE_REFRESH_MODE = 'thread') or
+    as its own process with `python run.py refresh-prices` ('external'). The
+    thread starts with the first request a process serves, so CLI commands
+    and shells do not run it. PRICE_REFRESH_LOCK names a lock file (relative
+    to the instance folder): of several processes, only the one holding it
+    refreshes, and the others try to take it over on every tick.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.mode = 'off'
+        self.interval = 60
+        self.cold_interval = 900
+        self.hot_window = 1800
+        self.batch_size = 200
+        self.fx_interval = 900
+        self.lock_path = None
+        self._lock_file = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._checked = {} # symbol -> when last fetched; unchanged quotes are not rewritten
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.mode = app.config.get('PRICE_REFRESH_MODE', self.mode)
+        self.interval = app.config.get('PRICE_REFRESH_INTERVAL', self.interval)
+        self.cold_interval = app.config.get('PRICE_REFRESH_COLD_INTERVAL', self.cold_interval)
+        self.hot_window = app.config.get('PRICE_REFRESH_HOT_WINDOW', self.hot_window)
+        self.batch_size = app.config.get('PRICE_REFRESH_BATCH_SIZE', self.batch_size)
+        self.fx_interval = app.config.get('FX_REFRESH_INTERVAL', self.fx_interval)
+        self.lock_path = app.config.get('PRICE_REFRESH_LOCK')
+        if self.lock_path and not os.path.isabs(self.lock_path):
+            os.makedirs(app.instance_path, exist_ok=True)
+            self.lock_path = os.path.join(app.instance_path, self.lock_path)
+        with self._lock:
+            self._checked = {}
+        app.extensions['price_refresher'] = self
+        if self.mode == 'thread' and not app.testing and app.config.get('BACKGROUND_THREADS', True):
+            app.before_request(self.start)
+
+    def due_symbols(self, now=None):
+        """
+        Returns [(symbol, api_key)] for symbols that need a refresh, hot first.
+        The API key is that of any user holding the symbol (None means Yahoo only).
+        """
+        now = now or datetime.utcnow()
+        hot_since = now - timedelta(seconds=self.hot_window)
+        rows = db.session.query(
+            Holding.symbol,
+            func.max(Portfolio.last_viewed),
+            func.max(Quote.updated_at),
+            func.max(User.api_key),
+        ).join(Portfolio, Holding.portfolio_id == Portfolio.id) \
+         .join(User, Portfolio.user_id == User.id) \
+         .outerjoin(Quote, Quote.symbol == Holding.symbol) \
+         .group_by(Holding.symbol).all()
+
+        with self._lock:
+            checked = dict(self._checked)
+        due = []
+        for symbol, last_viewed, updated_at, api_key in rows:
+            if symbol in checked and (updated_at is None or checked[symbol] > updated_at):
+                updated_at = checked[symbol]
+            hot = last_viewed is not None and last_viewed >= hot_since
+            max_age = self.interval if hot else self.cold_interval
+            if updated_at is None or (now - updated_at).total_seconds() >= max_age:
+                # Never-priced symbols first, then hot ones, oldest first within each group
+                due.append(((updated_at is not None, not hot, updated_at or now), symbol, api_key or None))
+        due.sort(key=lambda item: item[0])
+        return self.due_pairs(now, checked) + [(symbol, api_key) for _, symbol, api_key in due]
+
+    def due_pairs(self, now, checked):
+        """Returns [(pair symbol, api_key)] for FX rates older than FX_REFRESH_INTERVAL."""
+        pairs = fx_rates.pairs_needed()
+        if not pairs:
+            return []
+        stored = dict(db.session.query(Quote.symbol, Quote.updated_at).filter(Quote.symbol.in_(list(pairs))))
+        due = []
+        for pair, api_key in sorted(pairs.items()):
+            updated_at = max(filter(None, (stored.get(pair), checked.get(pair))), default=None)
+            if updated_at is None or (now - updated_at).total_seconds() >= self.fx_interval:
+                due.append((pair, api_key))
+        return due
+
+    def refresh_symbols(self, symbols, api_key=None):
+        """
+        Fetches prices for symbols upstream, updating the quote cache, and queues
+        them on the write-behind buffer, which stores the changed ones. Cached
+        quotes are not used: they would be stored as updated now when they were
+        fetched earlier. Returns the quotes that were found.
+        """
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols:
+            return {}
+        prices = market_data.refresh_prices(symbols, api_key=api_key)
+        now = datetime.utcnow()
+        with self._lock:
+            self._checked.update((symbol, now) for symbol in prices)
+        write_buffer.put_quotes(prices, now)
+        return prices
+
+    def refresh_once(self):
+        """Refreshes one batch of due symbols. Returns how many symbols were refreshed."""
+        due = self.due_symbols()[:self.batch_size]
+        by_key = {}
+        for symbol, api_key in due:
+            by_key.setdefault(api_key, []).append(symbol)
+        refreshed = 0
+        for api_key, symbols in by_key.items():
+            refreshed += len(self.refresh_symbols(symbols, api_key))
+        return refreshed
+
+    def update_history(self):
+        """Appends missing daily closes for every held symbol. Returns rows written per symbol."""
+        symbols = [s for s, in db.session.query(Holding.symbol).distinct()]
+        return price_history.update(symbols, market_data.get_history)
+
+    def holds_lock(self):
+        """True if this process is the one to refresh: it holds PRICE_REFRESH_LOCK, or none is set."""
+        if not self.lock_path or fcntl is None:
+            return True
+        if self._lock_file is None:
+            lock_file = open(self.lock_path, 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._lock_file = lock_file
+        return True
+
+    def release_lock(self):
+        if self._lock_file is not None:
+            self._lock_file.close() # releases the flock
+            self._lock_file = None
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            if not self.holds_lock():
+                self._stop.wait(max(1, self.interval / 4))
+                continue
+            with self.app.app_context():
+                try:
+                    self.refresh_once()
+                    # Each symbol is only checked every PRICE_HISTORY_UPDATE_INTERVAL
+                    self.update_history()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.exception("Price refresh failed: %s", e)
+                finally:
+                    db.session.remove()
+            # Tick often enough that hot symbols are never much older than the interval
+            self._stop.wait(max(1, self.interval / 4 - (time.monotonic() - started)))
+
+    def start(self):
+        with self._lock: # requests on several threads may start it at once
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name='price-refresher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.release_lock()
+        self._stop.clear()
+
+
+refresher = PriceRefresher()
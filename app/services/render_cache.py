@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import session
+from flask_login import current_user
+from markupsafe import Markup
+from app.services.metrics import registry
+
+RENDER_CACHE_LOOKUPS = registry.counter(
+    'render_cache_lookups_total',
+    "Render cache lookups, by page or fragment and result ('hit', 'miss' or 'bypass').", ('name', 'result'))
+
+
+class RenderCache:
+    """
+    In-process LRU of rendered pages and page fragments.
+
+    Entries are keyed by the page or fragment name, the current user's id and
+    what the caller says the HTML depends on (for portfolio pages, the
+    holdings version and the quote epoch, the newest stored quote among the
+    portfolio's symbols), so a page is reused only for the user it was
+    rendered for and only until its holdings or prices change. Entries also
+    expire after RENDER_CACHE_TTL seconds, which bounds how stale relative
+    times such as 'updated 3 min ago' get. Memory is bounded by
+    RENDER_CACHE_MAX_BYTES of HTML; the least recently used entries go first.
+    Whole pages are not cached while flash messages are pending, as those
+    render into the page.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.ttl = 30
+        self.max_bytes = 16 * 1024 * 1024
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> (html, size, expires)
+        self._bytes = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RENDER_CACHE_ENABLED', self.enabled)
+        self.ttl = app.config.get('RENDER_CACHE_TTL', self.ttl)
+        self.max_bytes = app.config.get('RENDER_CACHE_MAX_BYTES', self.max_bytes)
+        self.clear()
+        app.extensions['render_cache'] = self
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def size(self):
+        """Bytes of HTML held."""
+        with self._lock:
+            return self._bytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= now:
+                del self._entries[key]
+                self._bytes -= entry[1]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _set(self, key, html, now):
+        # Python strings of HTML are mostly ASCII: one byte per character
+        size = len(html)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (html, size, now + self.ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def render(self, name, key, build, page=True):
+        """
+        Returns the HTML for `name` from the cache if it was rendered for the
+        current user with the same key, otherwise calls build() and caches
+        the result. page=False marks a fragment, which flashes do not affect.
+        """
+        if not self.enabled or (page and session.get('_flashes')):
+            RENDER_CACHE_LOOKUPS.inc(name=name, result='bypass')
+            return Markup(build())
+        key = (name, current_user.get_id(), key)
+        now = time.monotonic()
+        html = self._get(key, now)
+        if html is not None:
+            RENDER_CACHE_LOOKUPS.inc(name=name, result='hit')
+            return html
+        RENDER_CACHE_LOOKUPS.inc(name=name, result='miss')
+        html = Markup(build())
+        self._set(key, html, now)
+        return html
+
+
+render_cache = RenderCache()
+
+@registry.collector
+def render_cache_metrics():
+    return ['# HELP render_cache_entries Pages and fragments held in the render cache.',
+            '# TYPE render_cache_entries gauge',
+            f'render_cache_entries {len(render_cache)}',
+            '# HELP render_cache_bytes Bytes of HTML held in the render cache.',
+            '# TYPE render_cache_bytes gauge',
+            f'render_cache_bytes {render_cache.size}']
@@ -0,0 +1,147 @@
+import csv
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SymbolIndex:
+    """
+    Local universe of known symbols, used to validate symbols and to power
+    autocomplete without a network round trip.
+
+    Symbols are kept in a sorted fixed-width byte array, so membership and
+    prefix lookups are binary searches. The index is loaded from a CSV file
+    (symbol,name per line) on first use and reloaded when the file changes,
+    checked at most every SYMBOL_UNIVERSE_RELOAD_INTERVAL seconds.
+
+    Symbols missing from the file can still be verified over the network;
+    the most recent SYMBOL_CHECK_CACHE_SIZE answers are kept for
+    SYMBOL_CHECK_TTL seconds.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.path = None
+        self.reload_interval = 300
+        self.check_ttl = 86400
+        self.max_checks = 4096
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def _reset(self):
+        self._symbols = np.array([], dtype='S1')
+        self._names = []
+        self._mtime = None
+        self._checked_at = None
+        self._checks = OrderedDict() # symbol -> (valid, when), least recently used first
+
+    def init_app(self, app):
+        path = app.config.get('SYMBOL_UNIVERSE_PATH')
+        if path and not os.path.isabs(path):
+            path = os.path.join(app.instance_path, path)
+        with self._lock:
+            self.path = path
+            self.reload_interval = app.config.get('SYMBOL_UNIVERSE_RELOAD_INTERVAL', self.reload_interval)
+            self.check_ttl = app.config.get('SYMBOL_CHECK_TTL', self.check_ttl)
+            self.max_checks = app.config.get('SYMBOL_CHECK_CACHE_SIZE', self.max_checks)
+            self._reset()
+        app.extensions['symbol_index'] = self
+
+    def _maybe_reload(self):
+        # Caller holds self._lock
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        if not self.path or not os.path.exists(self.path):
+            return
+        mtime = os.path.getmtime(self.path)
+        if mtime == self._mtime:
+            return
+        self._load(self.path)
+        self._mtime = mtime
+
+    def _load(self, path):
+        rows = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if not row or row[0].startswith('#') or row[0].lower() == 'symbol':
+                    continue
+                symbol = row[0].strip().upper()
+                if symbol:
+                    rows[symbol] = row[1].strip() if len(row) > 1 else ''
+        ordered = sorted(rows)
+        self._symbols = np.array([s.encode() for s in ordered], dtype=f'S{max(map(len, ordered), default=1)}')
+        self._names = [rows[s] for s in ordered]
+        logger.info("Loaded %d symbols from %s", len(ordered), path)
+
+    def __len__(self):
+        with self._lock:
+            self._maybe_reload()
+            return len(self._symbols)
+
+    def contains(self, symbol):
+        key = symbol.upper().encode()
+        with self._lock:
+            self._maybe_reload()
+            i = np.searchsorted(self._symbols, key)
+            return bool(i < len(self._symbols) and self._symbols[i] == key)
+
+    def search(self, prefix, limit=10):
+        """Returns up to `limit` {'symbol', 'name'} dicts for symbols starting with prefix."""
+        key = prefix.strip().upper().encode()
+        if not key:
+            return []
+        with self._lock:
+            self._maybe_reload()
+            start = np.searchsorted(self._symbols, key, side='left')
+            end = np.searchsorted(self._symbols, key + b'\xff', side='left')
+            end = min(end, start + limit)
+            return [{'symbol': self._symbols[i].decode(), 'name': self._names[i]} for i in range(start, end)]
+
+    def write(self, rows):
+        """
+        Replaces the universe file with (symbol, name) rows.
+        Written to a temporary file and renamed, so readers never see half a file.
+        """
+        tmp = f"{self.path}.tmp"
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(tmp, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['symbol', 'name'])
+            writer.writerows(rows)
+        os.replace(tmp, self.path)
+        with self._lock:
+            # pick the new file up on the next lookup, even if its mtime looks unchanged
+            self._checked_at = None
+            self._mtime = None
+
+    def cached_check(self, symbol):
+        """Returns the remembered network answer for a symbol, or None."""
+        key = symbol.upper()
+        with self._lock:
+            entry = self._checks.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] >= self.check_ttl:
+                del self._checks[key]
+                return None
+            self._checks.move_to_end(key)
+            return entry[0]
+
+    def remember_check(self, symbol, valid):
+        key = symbol.upper()
+        with self._lock:
+            self._checks[key] = (valid, time.monotonic())
+            self._checks.move_to_end(key)
+            while len(self._checks) > self.max_checks:
+                self._checks.popitem(last=False)
+
+
+symbol_index = SymbolIndex()
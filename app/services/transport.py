@@ -0,0 +1,163 @@
+import logging
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying for idempotent requests: rate limiting and
+# gateway/upstream trouble. Anything else is returned to the caller as-is.
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker.
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    are skipped for `reset_timeout` seconds. The first call after that is let
+    through as a probe (half-open): success closes the circuit, failure opens
+    it again.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return 'closed'
+        if now - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def reset(self):
+        self.record_success()
+
+
+class ProviderClient:
+    """
+    HTTP transport for one market-data provider.
+    Keeps a pooled keep-alive session, applies connect/read timeouts to every
+    call, retries idempotent failures with jittered exponential backoff and
+    reports the outcome to the provider's circuit breaker.
+    """
+
+    def __init__(self, name, base_url, connect_timeout=3.05, read_timeout=10,
+                 retries=2, backoff=0.5, pool_size=10, breaker=None):
+        self.name = name
+        self.breaker = breaker or CircuitBreaker(name)
+        self._session = None
+        self._session_lock = threading.Lock()
+        self.configure(base_url=base_url, connect_timeout=connect_timeout, read_timeout=read_timeout,
+                       retries=retries, backoff=backoff, pool_size=pool_size)
+
+    def configure(self, base_url=None, connect_timeout=None, read_timeout=None,
+                  retries=None, backoff=None, pool_size=None,
+                  failure_threshold=None, reset_timeout=None):
+        if base_url is not None:
+            self.base_url = base_url.rstrip('/')
+        if connect_timeout is not None:
+            self.connect_timeout = connect_timeout
+        if read_timeout is not None:
+            self.read_timeout = read_timeout
+        if retries is not None:
+            self.retries = retries
+        if backoff is not None:
+            self.backoff = backoff
+        if pool_size is not None:
+            self.pool_size = pool_size
+            self.close() # the next call builds a session with the new pool size
+        if failure_threshold is not None:
+            self.breaker.failure_threshold = failure_threshold
+        if reset_timeout is not None:
+            self.breaker.reset_timeout = reset_timeout
+
+    @property
+    def session(self):
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+            return self._session
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter: spreads retries from many workers instead of synchronising them
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def get(self, path, params=None):
+        """
+        Sends a GET request and returns the response.
+        Raises CircuitOpenError without touching the network when the breaker is
+        open, and requests.RequestException once retries are exhausted.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        attempt = 0
+        while True:
+            try:
+                response = self.session.get(url, params=params,
+                                            timeout=(self.connect_timeout, self.read_timeout))
+                if response.status_code in RETRY_STATUSES or response.status_code >= 500:
+                    raise requests.HTTPError(f"{response.status_code} from {self.name}", response=response)
+                self.breaker.record_success()
+                return response
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                if attempt >= self.retries:
+                    self.breaker.record_failure()
+                    raise
+                logger.info("%s request failed (%s), retrying", self.name, e)
+                self._sleep_before_retry(attempt)
+                attempt += 1
+
+    def get_json(self, path, params=None):
+        return self.get(path, params=params).json()
@@ -0,0 +1,149 @@
+import numpy as np
+from sqlalchemy import func
+from app import db
+from app.models import Portfolio, Holding, Quote
+from app.services.fx import fx_rates, infer_currency
+from app.services.history import price_history, performance
+
+def value_holdings(portfolio_id, base_currency=None):
+    """
+    Values a portfolio from stored quotes.
+    Holdings and their quotes come back from a single joined statement.
+    With a base_currency, values are converted from each quote's currency
+    in one vectorized step through the cached FX rate matrix; a value whose
+    rate is not known yet is left unconverted and flagged 'fx_missing'.
+    Holdings are the ledger's materialized positions, so their cost basis
+    comes along without replaying any transactions.
+    Returns (holdings, rows, total_value): the Holding objects, one dict per
+    holding for the templates, and the portfolio's total value.
+    """
+    holdings = Holding.query.filter_by(portfolio_id=portfolio_id).order_by(Holding.id).all()
+
+    prices = np.array([h.quote.price if h.quote and h.quote.price is not None else 0.0 for h in holdings])
+    currencies = [h.quote.currency if h.quote and h.quote.currency else infer_currency(h.symbol) for h in holdings]
+    rates = np.ones(len(holdings))
+    if base_currency:
+        rates = fx_rates.rates(currencies, base_currency)
+    missing = np.isnan(rates)
+    base_prices = prices * np.where(missing, 1.0, rates)
+    values = base_prices * np.array([h.units for h in holdings], dtype=float)
+
+    rows = []
+    for i, h in enumerate(holdings):
+        quote = h.quote
+        rows.append({
+            'id': h.id,
+            'symbol': h.symbol,
+            'units': h.units,
+            'price': float(prices[i]),
+            'currency': currencies[i],
+            'fx_rate': None if missing[i] else float(rates[i]),
+            'fx_missing': bool(missing[i]),
+            'base_price': float(base_prices[i]),
+            'timestamp': quote.timestamp if quote and quote.timestamp else "N/A",
+            'updated_at': quote.updated_at if quote else None,
+            'value': float(values[i]),
+            'cost_basis': h.cost_basis,
+            'realized_gain': h.realized_gain,
+            # Unrealized, in the listing currency like the cost
+            'gain': None if h.cost_basis is None else h.units * float(prices[i]) - h.cost_basis,
+            'target_percentage': h.target_percentage
+        })
+    return holdings, rows, float(values.sum())
+
+def portfolio_performance(rows, start=None):
+    """
+    Performance analytics for valued holdings (rows from value_holdings),
+    computed from the local price history with the current units, in the
+    base currency at today's exchange rates.
+    Returns the dict from history.performance, or None without enough history.
+    """
+    if not rows:
+        return None
+    dates, prices = price_history.closes([r['symbol'] for r in rows], start=start)
+    return performance(dates, prices, [r['units'] * (r.get('fx_rate') or 1.0) for r in rows])
+
+def portfolio_summaries(user_id):
+    """
+    Values all of a user's portfolios with one aggregate statement, summed
+    per portfolio and quote currency, then converted to each portfolio's base
+    currency in one vectorized step per base currency.
+    Returns a list of dicts with the Portfolio, its holding count, total value
+    and when its most recently stored quote was updated.
+    """
+    rows = db.session.query(
+        Portfolio,
+        Quote.currency,
+        func.count(Holding.id),
+        func.coalesce(func.sum(Holding.units * Quote.price), 0.0),
+        func.max(Quote.updated_at),
+    ).outerjoin(Holding, Holding.portfolio_id == Portfolio.id) \
+     .outerjoin(Quote, Quote.symbol == Holding.symbol) \
+     .filter(Portfolio.user_id == user_id) \
+     .group_by(Portfolio.id, Quote.currency) \
+     .order_by(Portfolio.id).all()
+
+    totals = np.array([total for _, _, _, total, _ in rows], dtype=float)
+    for base in {p.base_currency for p, _, _, _, _ in rows if p.base_currency}:
+        selected = [i for i, (p, _, _, _, _) in enumerate(rows) if p.base_currency == base]
+        totals[selected], _ = fx_rates.convert(totals[selected], [rows[i][1] for i in selected], base)
+
+    summaries = {}
+    for (p, _, count, _, updated), total in zip(rows, totals):
+        summary = summaries.setdefault(p.id, {'portfolio': p, 'holdings_count': 0, 'total_value': 0.0,
+                                              'quotes_updated_at': None})
+        summary['holdings_count'] += count
+        summary['total_value'] += float(total)
+        if updated is not None and (summary['quotes_updated_at'] is None or updated > summary['quotes_updated_at']):
+            summary['quotes_updated_at'] = updated
+    return list(summaries.values())
+
+def value_household(user_id, base_currency=None):
+    """
+    Values all of a user's portfolios together, in one currency, for
+    household rebalancing. Returns a dict with the Portfolio list, the
+    symbols held anywhere, (portfolios, symbols) arrays of units and of which
+    portfolio has a holding row for each symbol, per-symbol prices, and each
+    symbol's current target as a share of the household (the portfolios'
+    targets weighted by portfolio value).
+    """
+    portfolios = Portfolio.query.filter_by(user_id=user_id).order_by(Portfolio.id).all()
+    valued = [value_holdings(p.id, base_currency)[1:] for p in portfolios]
+    symbols = list(dict.fromkeys(r['symbol'] for rows, _ in valued for r in rows))
+    index = {symbol: i for i, symbol in enumerate(symbols)}
+
+    shape = (len(portfolios), len(symbols))
+    units, held, targets = np.zeros(shape), np.zeros(shape, dtype=bool), np.zeros(shape)
+    prices = np.zeros(len(symbols))
+    totals = np.array([total for _, total in valued], dtype=float)
+    for a, (rows, _) in enumerate(valued):
+        for r in rows:
+            s = index[r['symbol']]
+            units[a, s] += r['units']
+            held[a, s] = True
+            targets[a, s] += (r['target_percentage'] or 0) / 100.0
+            prices[s] = prices[s] or r['base_price']
+    weights = totals / totals.sum() if totals.sum() > 0 else np.full(len(portfolios), 1 / max(len(portfolios), 1))
+    return {
+        'portfolios': portfolios,
+        'symbols': symbols,
+        'units': units,
+        'held': held,
+        'prices': prices,
+        'values': totals,
+        'targets': weights @ targets if len(portfolios) else prices,
+    }
+
+def portfolio_version(portfolio_id, user_id):
+    """
+    Returns (holdings_version, quotes_updated_at) for one of a user's portfolios,
+    or None if the user has no such portfolio. One aggregate statement, no
+    holdings loaded: a valuation can only change when one of the two does.
+    """
+    return db.session.query(
+        Portfolio.holdings_version,
+        func.max(Quote.updated_at),
+    ).outerjoin(Holding, Holding.portfolio_id == Portfolio.id) \
+     .outerjoin(Quote, Quote.symbol == Holding.symbol) \
+     .filter(Portfolio.id == portfolio_id, Portfolio.user_id == user_id) \
+     .group_by(Portfolio.id).first()
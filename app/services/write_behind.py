@@ -0,0 +1,191 @@
+import atexit
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import bindparam, or_, update
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Portfolio, Quote
+from app.services.fx import fx_rates, is_pair
+from app.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+WRITE_BUFFER_UPDATES = registry.counter(
+    'write_buffer_updates_total', "Updates offered to the write-behind buffer, by result ('queued' or 'unchanged').",
+    ('result',))
+WRITE_BUFFER_FLUSHES = registry.counter(
+    'write_buffer_flushes_total', "Write-behind flushes, by result ('ok' or 'error').", ('result',))
+
+
+class WriteBehindBuffer:
+    """
+    Collects quote updates and portfolio view times in memory and writes them
+    in one transaction every WRITE_BEHIND_INTERVAL seconds, so page views stay
+    read-only and refreshes from the refresher, the price stream and the
+    Refresh button share commits.
+
+    A quote whose price and timestamp match what is pending or was last
+    written is dropped, and the upsert leaves stored quotes that did not
+    change alone. Newer updates replace pending ones for the same symbol or
+    portfolio. At most WRITE_BEHIND_MAX_PENDING entries are held: a writer
+    that fills the buffer flushes it itself. The buffer is flushed at exit;
+    a failed flush keeps its entries for the next one. The flusher thread
+    starts with the first update queued, so processes that never write
+    (CLI commands, shells) do not run one.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.interval = 2
+        self.max_pending = 5000
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._quotes = {}
+        self._views = {}
+        self._written = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._atexit = False
+        self._autostart = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('WRITE_BEHIND_INTERVAL', self.interval)
+        self.max_pending = app.config.get('WRITE_BEHIND_MAX_PENDING', self.max_pending)
+        with self._lock:
+            self._quotes = {}
+            self._views = {}
+            self._written = {}
+        app.extensions['write_buffer'] = self
+        self._autostart = not app.testing and app.config.get('BACKGROUND_THREADS', True)
+        if not app.testing and not self._atexit:
+            atexit.register(self.close)
+            self._atexit = True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._quotes) + len(self._views)
+
+    def put_quotes(self, prices, updated_at=None):
+        """Queues {symbol: {'price', 'timestamp'[, 'currency']}}. Returns how many quotes changed."""
+        updated_at = updated_at or datetime.utcnow()
+        queued = 0
+        with self._lock:
+            for symbol, q in prices.items():
+                key = (q['price'], q['timestamp'], q.get('currency'))
+                pending = self._quotes.get(symbol)
+                last = (pending['price'], pending['timestamp'], pending['currency']) if pending \
+                    else self._written.get(symbol)
+                if key == last:
+                    continue
+                self._quotes[symbol] = {'price': q['price'], 'timestamp': q['timestamp'], 'currency': q.get('currency'),
+                                        'updated_at': updated_at}
+                queued += 1
+            full = len(self._quotes) + len(self._views) >= self.max_pending
+        WRITE_BUFFER_UPDATES.inc(queued, result='queued')
+        WRITE_BUFFER_UPDATES.inc(len(prices) - queued, result='unchanged')
+        if self._autostart:
+            self.start()
+        if full:
+            self.flush()
+        return queued
+
+    def touch(self, portfolio_id, when=None):
+        """Queues a portfolio's last_viewed time."""
+        when = when or datetime.utcnow()
+        with self._lock:
+            if self._views.get(portfolio_id) is None or self._views[portfolio_id] < when:
+                self._views[portfolio_id] = when
+            full = len(self._quotes) + len(self._views) >= self.max_pending
+        WRITE_BUFFER_UPDATES.inc(result='queued')
+        if self._autostart:
+            self.start()
+        if full:
+            self.flush()
+
+    def pending_view(self, portfolio_id):
+        """The queued last_viewed time for a portfolio, or None."""
+        with self._lock:
+            return self._views.get(portfolio_id)
+
+    def flush(self):
+        """Writes everything pending in one transaction. Returns the number of entries written."""
+        with self._flush_lock:
+            with self._lock:
+                quotes, self._quotes = self._quotes, {}
+                views, self._views = self._views, {}
+            if not quotes and not views:
+                return 0
+            try:
+                # Own session, so a flush never commits a caller's unfinished work
+                with Session(db.engine) as session, session.begin():
+                    if quotes:
+                        Quote.upsert_many(quotes, only_changed=True, session=session)
+                    if views:
+                        table = Portfolio.__table__
+                        stmt = update(table).where(
+                            table.c.id == bindparam('pid'),
+                            or_(table.c.last_viewed.is_(None), table.c.last_viewed < bindparam('viewed')),
+                        ).values(last_viewed=bindparam('viewed'))
+                        session.execute(stmt, [{'pid': pid, 'viewed': when} for pid, when in views.items()])
+            except Exception as e:
+                with self._lock:
+                    # Put the entries back unless something newer arrived meanwhile
+                    for symbol, q in quotes.items():
+                        self._quotes.setdefault(symbol, q)
+                    for pid, when in views.items():
+                        if self._views.get(pid) is None or self._views[pid] < when:
+                            self._views[pid] = when
+                WRITE_BUFFER_FLUSHES.inc(result='error')
+                logger.warning("Write-behind flush of %d entries failed: %s", len(quotes) + len(views), e)
+                return 0
+            with self._lock:
+                self._written.update((s, (q['price'], q['timestamp'], q['currency'])) for s, q in quotes.items())
+            if any(is_pair(symbol) for symbol in quotes):
+                # New exchange rates: rebuild this process's rate matrix on next use
+                fx_rates.invalidate()
+            WRITE_BUFFER_FLUSHES.inc(result='ok')
+            return len(quotes) + len(views)
+
+    def run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            with self.app.app_context():
+                self.flush()
+
+    def start(self):
+        with self._lock: # writers on several threads may start it at once
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._stop.clear()
+
+    def close(self):
+        """Stops the flusher and writes what is left; registered to run at exit."""
+        self.stop()
+        if self.app is not None:
+            with self.app.app_context():
+                self.flush()
+
+
+write_buffer = WriteBehindBuffer()
+
+@registry.collector
+def write_buffer_metrics():
+    return ['# HELP write_buffer_pending Entries waiting in the write-behind buffer.',
+            '# TYPE write_buffer_pending gauge',
+            f'write_buffer_pending {len(write_buffer)}']
@@ -0,0 +1,204 @@
+"""
+Production serving: Gunicorn with the app loaded once in the master process.
+
+The master creates the app, brings the database up to date and imports
+the templates and market data providers, then forks the workers, which
+share all of that copy-on-write. Each worker starts its own background
+threads, opens its database connections and primes its quote cache before
+it accepts a request, and flushes its write-behind buffer when it exits.
+
+Zero-downtime reload: `kill -USR2 <master pid>` starts a new master from
+the new code next to the old one, on the same sockets. Once all of its
+workers are warm, the last one asks the old master to shut down
+gracefully (SIGTERM), so the old workers finish the requests they have.
+A plain HUP also replaces the workers, but with the code already loaded.
+"""
+import calendar
+import multiprocessing
+import os
+import signal
+from sqlalchemy import text
+from app import create_app, db
+from app.migrations import upgrade
+from app.models import Holding, Quote
+from app.services.fx import fx_rates
+from app.services.price_stream import price_hub
+from app.services.providers import registry as providers
+from app.services.quote_cache import quote_cache
+from app.services.refresher import refresher
+from app.services.write_behind import write_buffer
+from config import Config
+
+# Set in the master when it is ready, inherited by the workers it forks: the old
+# master's pid after a USR2 reload, and how many workers have warmed up so far
+_handover = {'old_master': 0, 'workers': 0, 'warm': None}
+
+
+def preforked(config_class):
+    """
+    A config for an app created before forking: background threads wait for
+    the workers, and price streams, which each hold one of a worker's threads
+    while open, are capped so one thread is always left for pages.
+    """
+    streams = min(config_class.PRICE_STREAM_MAX_CLIENTS, max(config_class.SERVER_THREADS - 1, 0))
+    return type('Preforked' + config_class.__name__, (config_class,),
+                {'BACKGROUND_THREADS': False, 'PRICE_STREAM_MAX_CLIENTS': streams})
+
+
+def server_options(app):
+    """Gunicorn settings from the SERVER_* config."""
+    config = app.config
+    pidfile = config.get('SERVER_PIDFILE')
+    if pidfile and not os.path.isabs(pidfile):
+        os.makedirs(app.instance_path, exist_ok=True)
+        pidfile = os.path.join(app.instance_path, pidfile)
+    return {
+        'bind': config['SERVER_BIND'],
+        'workers': config['SERVER_WORKERS'],
+        # Threads, so an open price stream does not hold a whole worker
+        'worker_class': 'gthread',
+        'threads': config['SERVER_THREADS'],
+        'timeout': config['SERVER_TIMEOUT'],
+        'graceful_timeout': config['SERVER_GRACEFUL_TIMEOUT'],
+        'keepalive': config['SERVER_KEEPALIVE'],
+        'pidfile': pidfile or None,
+        'preload_app': True,
+    }
+
+
+def preload(app):
+    """
+    Master-side setup before forking: upgrades the database and loads what
+    every worker would otherwise load on its first requests.
+    """
+    with app.app_context():
+        upgrade()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    for name in providers.enabled:
+        providers.get(name)
+
+
+def before_fork(app):
+    """Closes the master's connections, so no worker inherits a socket or SQLite handle in use."""
+    with app.app_context():
+        db.engine.dispose()
+    if quote_cache.store is not None:
+        quote_cache.store.close()
+
+
+def start_worker(app):
+    """
+    Starts the background threads an app process runs; see BACKGROUND_THREADS.
+    Every worker starts the refresher thread, but only the one holding its
+    lock refreshes; another takes over if that worker exits.
+    """
+    if app.testing:
+        return
+    write_buffer.start()
+    if refresher.mode == 'thread':
+        refresher.start()
+
+
+def warm_up(app):
+    """
+    Gets a worker ready for traffic: opens as many database connections as
+    it has threads (up to the pool size), primes the quote cache with the
+    held symbols and loads the FX rate matrix.
+    Returns {'connections', 'quotes'}: how many of each were readied.
+    """
+    with app.app_context():
+        wanted = app.config.get('SERVER_THREADS', 1)
+        pool_size = getattr(db.engine.pool, 'size', None)
+        if callable(pool_size):
+            wanted = min(wanted, pool_size())
+        connections = []
+        try:
+            for _ in range(wanted):
+                connection = db.engine.connect()
+                connection.execute(text('SELECT 1'))
+                connections.append(connection)
+        finally:
+            for connection in connections:
+                connection.close() # back into the pool, still open
+
+        symbols = [s for s, in db.session.query(Holding.symbol).distinct().limit(quote_cache.max_entries)]
+        # Stored prices stand in for symbols the shared cache does not have
+        stored = {q.symbol: ({'price': q.price, 'timestamp': q.timestamp, 'currency': q.currency},
+                             calendar.timegm(q.updated_at.timetuple()))
+                  for q in Quote.query.filter(Quote.symbol.in_(symbols), Quote.price.isnot(None),
+                                              Quote.updated_at.isnot(None))}
+        quotes = quote_cache.prime(symbols, stored)
+        fx_rates.version # loads the rate matrix
+        db.session.remove()
+    return {'connections': len(connections), 'quotes': quotes}
+
+
+def stop_worker(app):
+    """Stops the background threads and writes what the write-behind buffer still holds."""
+    refresher.stop()
+    price_hub.stop()
+    write_buffer.close()
+
+
+def hooks(app):
+    """Gunicorn server hooks for the app, by setting name."""
+
+    def when_ready(server):
+        _handover.update(old_master=server.master_pid, workers=server.num_workers,
+                         warm=multiprocessing.Value('i', 0))
+
+    def pre_fork(server, worker):
+        before_fork(app)
+
+    def post_fork(server, worker):
+        start_worker(app)
+
+    def post_worker_init(worker):
+        # Gunicorn calls this before the worker's first accept
+        ready = warm_up(app)
+        worker.log.info('Worker warm: %(connections)d connections, %(quotes)d quotes', ready)
+        warm = _handover['warm']
+        if warm is None:
+            return
+        with warm.get_lock():
+            warm.value += 1
+            last = warm.value == _handover['workers']
+        if last and _handover['old_master']:
+            worker.log.info('All workers warm; stopping the old master %d', _handover['old_master'])
+            try:
+                os.kill(_handover['old_master'], signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def worker_exit(server, worker):
+        stop_worker(app)
+
+    return {'when_ready': when_ready, 'pre_fork': pre_fork, 'post_fork': post_fork,
+            'post_worker_init': post_worker_init, 'worker_exit': worker_exit}
+
+
+def serve_app(app, options=None):
+    """Serves an app created with a preforked config until the master is stopped."""
+    from gunicorn.app.base import BaseApplication # only needed to serve
+
+    settings = dict(server_options(app), **(options or {}))
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for name, value in settings.items():
+                self.cfg.set(name, value)
+            for name, hook in hooks(app).items():
+                self.cfg.set(name, hook)
+
+        def load(self):
+            return app
+
+    Server().run()
+
+
+def serve(config_class=Config, options=None):
+    """Creates and preloads the app from config_class, then serves it with Gunicorn."""
+    app = create_app(preforked(config_class))
+    preload(app)
+    serve_app(app, options)
@@ -0,0 +1,144 @@
+"""
+Read throughput under concurrent writers, before and after the production
+database profile (indexes, WAL, synchronous=NORMAL, busy_timeout).
+
+    python benchmarks/bench_db_concurrency.py [--seconds 3] [--readers 8] [--writers 2]
+
+"Before" reproduces the old defaults: rollback journal, synchronous=FULL and
+no secondary indexes. Results are printed as JSON.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import text
+from app import create_app, db
+from app.migrations import upgrade
+from app.models import User, Portfolio, Holding, Quote
+from app.services.valuation import value_holdings
+from config import Config
+
+USERS, PORTFOLIOS_PER_USER, HOLDINGS_PER_PORTFOLIO, SYMBOLS = 50, 4, 25, 400
+
+def make_config(path, profile):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        QUOTE_CACHE_PATH = None
+        PRICE_REFRESH_MODE = 'off'
+        DB_POOL_SIZE = 16
+    if profile == 'before':
+        BenchConfig.SQLITE_JOURNAL_MODE = 'DELETE'
+        BenchConfig.SQLITE_SYNCHRONOUS = 'FULL'
+    return BenchConfig
+
+def seed():
+    rng = random.Random(1)
+    symbols = [f'SYM{i}' for i in range(SYMBOLS)]
+    db.session.add_all(Quote(symbol=s, price=rng.uniform(5, 500), updated_at=datetime.utcnow()) for s in symbols)
+    for u in range(USERS):
+        user = User(username=f'user{u}')
+        db.session.add(user)
+        for p in range(PORTFOLIOS_PER_USER):
+            portfolio = Portfolio(name=f'P{p}', type='TFSA', owner=user)
+            for s in rng.sample(symbols, HOLDINGS_PER_PORTFOLIO):
+                db.session.add(Holding(symbol=s, units=rng.randint(1, 100), portfolio=portfolio))
+    db.session.commit()
+
+def drop_secondary_indexes():
+    with db.engine.begin() as conn:
+        for name in ('ix_holding_portfolio_symbol', 'ix_holding_symbol', 'ix_portfolio_user_id'):
+            conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+
+def run(profile, seconds, readers, writers):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(make_config(os.path.join(tmp, 'bench.db'), profile))
+        with app.app_context():
+            upgrade()
+            seed()
+            if profile == 'before':
+                drop_secondary_indexes()
+            portfolio_ids = [p.id for p in Portfolio.query.all()]
+            symbols = [q.symbol for q in Quote.query.all()]
+            db.session.remove()
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        stats = {'reads': 0, 'writes': 0, 'errors': 0, 'read_latencies': []}
+
+        def reader(seed):
+            rng = random.Random(seed)
+            with app.app_context():
+                while not stop.is_set():
+                    started = time.perf_counter()
+                    try:
+                        value_holdings(rng.choice(portfolio_ids))
+                        db.session.rollback()
+                    except Exception:
+                        db.session.rollback()
+                        with lock:
+                            stats['errors'] += 1
+                        continue
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        stats['reads'] += 1
+                        stats['read_latencies'].append(elapsed)
+
+        def writer(seed):
+            rng = random.Random(seed)
+            with app.app_context():
+                while not stop.is_set():
+                    try:
+                        # A refresh tick: bulk-upsert a batch of quotes
+                        Quote.upsert_many({s: {'price': rng.uniform(5, 500), 'timestamp': ''}
+                                           for s in rng.sample(symbols, 50)})
+                        db.session.commit()
+                    except Exception:
+                        db.session.rollback()
+                        with lock:
+                            stats['errors'] += 1
+                        continue
+                    with lock:
+                        stats['writes'] += 1
+
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+        threads += [threading.Thread(target=writer, args=(1000 + i,)) for i in range(writers)]
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        with app.app_context():
+            db.engine.dispose()
+
+        latencies = sorted(stats['read_latencies']) or [0]
+        return {
+            'profile': profile,
+            'readers': readers,
+            'writers': writers,
+            'seconds': seconds,
+            'reads_per_sec': round(stats['reads'] / seconds, 1),
+            'writes_per_sec': round(stats['writes'] / seconds, 1),
+            'errors': stats['errors'],
+            'read_p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+            'read_p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    args = parser.parse_args()
+    results = [run(profile, args.seconds, args.readers, args.writers) for profile in ('before', 'after')]
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+"""
+Latency and throughput of the main pages under concurrent load, with market
+data served by a local stub instead of Twelve Data and Yahoo.
+
+    python benchmarks/bench_load.py [--seconds 5] [--sizes 10,100,1000] [--concurrency 1,4,16]
+        [--routes view,index,rebalance] [--servers werkzeug,gunicorn] [--workers 4]
+        [--stub-latency 0.05] [--stub-jitter 0.05] [--stub-failure-rate 0] [--output results.json]
+
+The app is built with create_app against a temporary SQLite file and served
+by each of --servers in turn: 'werkzeug' is the threaded development server,
+'gunicorn' the production server from app/serving.py, forked from the same
+preloaded app with --workers workers (SERVER_THREADS threads each). There
+is one user per size, with a portfolio of that many holdings. Prices are first loaded through the stub, which answers Twelve Data `/quote` batches and a
+Yahoo-style quote endpoint with the configured latency and failure rate.
+
+Every route is then hit for --seconds at each concurrency level, each worker
+with its own logged-in session. p50/p99 latency (ms), requests per second and
+errors per cell are written as JSON to --output and stdout, along with the
+run's settings and git commit so runs can be compared over time.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+import numpy as np
+import requests
+from werkzeug.serving import make_server
+from app import create_app, db, serving
+from app.migrations import upgrade
+from app.models import User, Portfolio, Holding
+from app.services.providers import registry as providers
+from app.services.refresher import refresher
+from app.services.write_behind import write_buffer
+from config import Config
+from stub_server import StubServer
+
+API_KEY = 'bench'
+PASSWORD = 'password'
+
+def make_stub(latency, jitter, failure_rate):
+    """A stub serving Twelve Data's /quote and Yahoo's quote endpoint with deterministic prices."""
+    stub = StubServer()
+    stub.delay, stub.jitter, stub.failure_rate = latency, jitter, failure_rate
+
+    def price(symbol):
+        return round(5 + random.Random(symbol).random() * 495, 2)
+
+    def twelve_data_quote(query):
+        stamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        symbols = query.get('symbol', '').split(',')
+        quotes = {s: {'symbol': s, 'close': str(price(s)), 'datetime': stamp} for s in symbols}
+        return 200, quotes[symbols[0]] if len(symbols) == 1 else quotes
+
+    def yahoo_quote(query):
+        symbols = query.get('symbols', '').split(',')
+        return 200, {'quoteResponse': {'error': None, 'result': [
+            {'symbol': s, 'regularMarketPrice': price(s), 'regularMarketTime': int(time.time())}
+            for s in symbols]}}
+
+    stub.route('/quote', twelve_data_quote)
+    stub.route('/v7/finance/quote', yahoo_quote)
+    return stub.start()
+
+class StubYahoo:
+    """
+    Yahoo provider reading the stub's quote endpoint. yfinance has its
+    endpoints built in, so it is registered in place of the real one.
+    """
+
+    def __init__(self, url):
+        self.url = url
+
+    def available(self):
+        return True
+
+    def get_prices(self, symbols):
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols:
+            return {}
+        try:
+            response = requests.get(self.url + '/v7/finance/quote', params={'symbols': ','.join(symbols)}, timeout=10)
+            response.raise_for_status()
+        except requests.RequestException:
+            return {}
+        return {q['symbol']: {'price': float(q['regularMarketPrice']),
+                              'timestamp': datetime.utcfromtimestamp(q['regularMarketTime']).strftime('%Y-%m-%d %H:%M:%S')}
+                for q in response.json()['quoteResponse']['result']}
+
+def make_config(path, stub):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        QUOTE_CACHE_PATH = None
+        PRICE_REFRESH_MODE = 'off'
+        PRICE_HISTORY_PATH = os.path.join(os.path.dirname(path), 'history')
+        TWELVE_DATA_URL = stub.url
+        TWELVE_DATA_CREDITS_PER_MINUTE = 100000
+        TWELVE_DATA_BATCH_SIZE = 120
+        SLOW_REQUEST_THRESHOLD = 0
+        DB_POOL_SIZE = 32
+    return serving.preforked(BenchConfig)
+
+def seed(sizes):
+    """One user per size, each with a portfolio of that many holdings. Returns {size: portfolio id}."""
+    rng = random.Random(1)
+    symbols = [f'SYM{i}' for i in range(max(sizes))]
+    portfolios = {}
+    for size in sizes:
+        user = User(username=f'bench{size}', api_key=API_KEY)
+        user.set_password(PASSWORD)
+        portfolio = Portfolio(name=f'{size} holdings', type='TFSA', owner=user)
+        db.session.add_all([user, portfolio])
+        db.session.add_all(Holding(symbol=s, units=rng.randint(1, 100), portfolio=portfolio,
+                                   target_percentage=100 / size) for s in symbols[:size])
+        db.session.commit()
+        portfolios[size] = portfolio.id
+    # Load every price through the stub, the way the background refresher would
+    while refresher.refresh_once():
+        pass
+    write_buffer.flush()
+    return portfolios
+
+def start_werkzeug(app):
+    """Serves app on the threaded development server. Returns (base_url, stop)."""
+    serving.start_worker(app)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', server.shutdown
+
+def start_gunicorn(app, workers):
+    """
+    Serves app with Gunicorn in a forked child, the way serve.py does after
+    preloading. Returns (base_url, stop) once the workers answer.
+    """
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    serving.before_fork(app)
+    options = {'bind': f'127.0.0.1:{port}', 'workers': workers, 'pidfile': None, 'loglevel': 'warning'}
+    process = multiprocessing.get_context('fork').Process(target=serving.serve_app, args=(app, options))
+    process.start()
+    base_url = f'http://127.0.0.1:{port}'
+
+    def stop():
+        process.terminate() # SIGTERM: graceful shutdown
+        process.join()
+
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            requests.get(f'{base_url}/auth/login', timeout=1)
+            return base_url, stop
+        except requests.RequestException:
+            if not process.is_alive() or time.monotonic() > deadline:
+                stop()
+                raise RuntimeError('Gunicorn did not start')
+            time.sleep(0.1)
+
+def login(base_url, size):
+    session = requests.Session()
+    response = session.post(f'{base_url}/auth/login', data={'username': f'bench{size}', 'password': PASSWORD},
+                            allow_redirects=False)
+    if response.status_code != 302:
+        raise RuntimeError(f'Login as bench{size} failed: {response.status_code}')
+    return session
+
+def make_request(route, base_url, portfolio_id, size):
+    """Returns a function that sends one request for route on a session."""
+    if route == 'view':
+        return lambda s: s.get(f'{base_url}/portfolio/{portfolio_id}')
+    if route == 'index':
+        return lambda s: s.get(f'{base_url}/portfolio/')
+    if route == 'rebalance':
+        symbols = [f'SYM{i}' for i in range(size)]
+        form = {'cash': '1000', **{f'ratio_{s}': str(100 / size) for s in symbols}}
+        return lambda s: s.post(f'{base_url}/portfolio/rebalance/{portfolio_id}', data=form)
+    if route == 'refresh':
+        return lambda s: s.post(f'{base_url}/portfolio/{portfolio_id}/refresh', allow_redirects=False)
+    raise ValueError(f'Unknown route {route}')
+
+def measure(send, sessions, seconds):
+    """Runs one worker per session for `seconds`. Returns latency percentiles, throughput and errors."""
+    stop = threading.Event()
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+
+    def worker(session):
+        mine, failed = [], 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                response = send(session)
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            if ok:
+                mine.append(time.perf_counter() - started)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(s,)) for s in sessions]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    ms = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(float(np.percentile(ms, 50)), 2) if len(ms) else None,
+        'p99_ms': round(float(np.percentile(ms, 99)), 2) if len(ms) else None,
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure_server(server, base_url, sizes, levels, routes, portfolios, seconds):
+    """Every route at every size and concurrency level against one server. Returns result cells."""
+    results = []
+    for size in sizes:
+        for level in levels:
+            sessions = [login(base_url, size) for _ in range(level)]
+            for route in routes:
+                send = make_request(route, base_url, portfolios[size], size)
+                send(sessions[0]) # warm up templates and connections
+                cell = measure(send, sessions, seconds)
+                results.append({'server': server, 'route': route, 'holdings': size, 'concurrency': level, **cell})
+                print(f'{server:>8} {route:>9} {size:>5} holdings x{level:<3} p50 {cell["p50_ms"]} ms  '
+                      f'p99 {cell["p99_ms"]} ms  {cell["throughput_rps"]} req/s  {cell["errors"]} errors',
+                      file=sys.stderr)
+            for session in sessions:
+                session.close()
+    return results
+
+def run(args):
+    sizes = [int(s) for s in args.sizes.split(',')]
+    levels = [int(c) for c in args.concurrency.split(',')]
+    routes = args.routes.split(',')
+    servers = args.servers.split(',')
+    unknown = set(servers) - {'werkzeug', 'gunicorn'}
+    if unknown:
+        raise SystemExit(f"Unknown servers: {', '.join(sorted(unknown))}")
+    stub = make_stub(args.stub_latency, args.stub_jitter, args.stub_failure_rate)
+    providers.register('yahoo', StubYahoo(stub.url))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(make_config(os.path.join(tmp, 'bench.db'), stub))
+        with app.app_context():
+            upgrade()
+            warm_started = time.perf_counter()
+            portfolios = seed(sizes)
+            warm_seconds = time.perf_counter() - warm_started
+            db.session.remove()
+
+        results = []
+        try:
+            for server in servers:
+                if server == 'werkzeug':
+                    base_url, stop = start_werkzeug(app)
+                else:
+                    base_url, stop = start_gunicorn(app, args.workers)
+                try:
+                    results.extend(measure_server(server, base_url, sizes, levels, routes, portfolios, args.seconds))
+                finally:
+                    stop()
+        finally:
+            stub.stop()
+            with app.app_context():
+                db.engine.dispose()
+
+    return {
+        'benchmark': 'load',
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'servers': servers,
+        'workers': args.workers if 'gunicorn' in servers else None,
+        'seconds_per_cell': args.seconds,
+        'stub': {'latency': args.stub_latency, 'jitter': args.stub_jitter,
+                 'failure_rate': args.stub_failure_rate, 'requests': len(stub.requests)},
+        'warmup_seconds': round(warm_seconds, 2),
+        'results': results,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--sizes', default='10,100,1000')
+    parser.add_argument('--concurrency', default='1,4,16')
+    parser.add_argument('--routes', default='view,index,rebalance')
+    parser.add_argument('--servers', default='werkzeug', help="comma-separated: 'werkzeug', 'gunicorn'")
+    parser.add_argument('--workers', type=int, default=4, help='Gunicorn workers')
+    parser.add_argument('--stub-latency', type=float, default=0.05)
+    parser.add_argument('--stub-jitter', type=float, default=0.05)
+    parser.add_argument('--stub-failure-rate', type=float, default=0)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
@@ -0,0 +1,86 @@
+"""
+Benchmark for app/services/rebalancer.py.
+
+    python benchmarks/bench_rebalancer.py
+
+Times the batched engine on many small portfolios and on single large ones,
+and household rebalancing across dozens of accounts with hundreds of
+holdings, and prints the results as JSON.
+"""
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.services.rebalancer import rebalance, rebalance_batch, household_rebalance
+
+def random_portfolio(rng, n):
+    return (rng.integers(0, 500, n).astype(float), rng.uniform(5, 900, n),
+            rng.dirichlet(np.ones(n)), float(rng.uniform(0, 50000)))
+
+def random_household(rng, accounts, symbols, per_account):
+    """Each account may trade per_account symbols and holds most of them."""
+    eligible = np.zeros((accounts, symbols), dtype=bool)
+    for a in range(accounts):
+        eligible[a, rng.choice(symbols, per_account, replace=False)] = True
+    units = np.where(eligible & (rng.random((accounts, symbols)) < 0.7),
+                     rng.integers(0, 500, (accounts, symbols)), 0).astype(float)
+    return (units, rng.uniform(5, 900, symbols), eligible, rng.dirichlet(np.ones(symbols)),
+            rng.uniform(0, 20000, accounts))
+
+def timed(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+def main():
+    rng = np.random.default_rng(42)
+    results = []
+
+    for portfolios, holdings in [(100, 10), (1000, 10), (500, 40)]:
+        batch = [random_portfolio(rng, holdings) for _ in range(portfolios)]
+        results.append({
+            'case': 'batch',
+            'portfolios': portfolios,
+            'holdings_per_portfolio': holdings,
+            'total_holdings': portfolios * holdings,
+            'ms': round(timed(lambda: rebalance_batch(batch)), 3),
+        })
+
+    for holdings in [100, 1000, 5000]:
+        p = random_portfolio(rng, holdings)
+        results.append({
+            'case': 'single',
+            'portfolios': 1,
+            'holdings_per_portfolio': holdings,
+            'total_holdings': holdings,
+            'ms': round(timed(lambda: rebalance(*p)), 3),
+        })
+
+    for accounts, symbols, per_account in [(3, 30, 20), (12, 100, 30), (36, 300, 40), (60, 500, 60)]:
+        household = random_household(rng, accounts, symbols, per_account)
+        units, prices, eligible, targets, cash = household
+        fractional, whole, cash_left, target_values = household_rebalance(*household)
+        gap = np.abs((units * prices).sum(axis=0) - target_values)
+        results.append({
+            'case': 'household',
+            'portfolios': accounts,
+            'symbols': symbols,
+            'total_holdings': int(eligible.sum()),
+            'ms': round(timed(lambda: household_rebalance(*household)), 3),
+            'trades': int((whole != 0).sum()),
+            # Value traded against the household gap it had to close
+            'traded_value': round(float((np.abs(fractional) * prices).sum()), 2),
+            'gap_before': round(float(gap.sum()), 2),
+            'gap_after': round(float(np.abs(((units + fractional) * prices).sum(axis=0) - target_values).sum()), 2),
+        })
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
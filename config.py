@@ -4,3 +4,113 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-key-please-change'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///portfolio.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Database profile. SQLALCHEMY_ENGINE_OPTIONS is built from these unless set explicitly.
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 5)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 10)
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 1800) # seconds
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT') or 30) # seconds to wait for a connection
+    DB_POOL_PRE_PING = True
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE') or 'WAL'
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL' # safe with WAL
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000) # ms a writer waits for a lock
+
+    # Quote cache: in-process LRU backed by a SQLite file shared by all workers.
+    # A relative path is resolved against the instance folder; None disables the shared tier.
+    QUOTE_CACHE_PATH = os.environ.get('QUOTE_CACHE_PATH') or 'quote_cache.db'
+    QUOTE_CACHE_SIZE = int(os.environ.get('QUOTE_CACHE_SIZE') or 1024)
+    QUOTE_CACHE_TTL = int(os.environ.get('QUOTE_CACHE_TTL') or 60) # seconds a quote is fresh
+    QUOTE_CACHE_TTLS = {} # per-symbol overrides, e.g. {'VFV.TO': 300}
+    QUOTE_CACHE_NEGATIVE_TTL = int(os.environ.get('QUOTE_CACHE_NEGATIVE_TTL') or 300)
+    QUOTE_CACHE_STALE_TTL = int(os.environ.get('QUOTE_CACHE_STALE_TTL') or 900) # stale-while-revalidate window
+    QUOTE_CACHE_BACKGROUND_REFRESH = True
+
+    # Market-data transport
+    TWELVE_DATA_URL = os.environ.get('TWELVE_DATA_URL') or 'https://api.twelvedata.com'
+    MARKET_DATA_CONNECT_TIMEOUT = float(os.environ.get('MARKET_DATA_CONNECT_TIMEOUT') or 3.05)
+    MARKET_DATA_READ_TIMEOUT = float(os.environ.get('MARKET_DATA_READ_TIMEOUT') or 10)
+    MARKET_DATA_RETRIES = int(os.environ.get('MARKET_DATA_RETRIES') or 2)
+    MARKET_DATA_BACKOFF = float(os.environ.get('MARKET_DATA_BACKOFF') or 0.5) # base seconds, jittered
+    MARKET_DATA_POOL_SIZE = int(os.environ.get('MARKET_DATA_POOL_SIZE') or 10)
+    CIRCUIT_BREAKER_THRESHOLD = int(os.environ.get('CIRCUIT_BREAKER_THRESHOLD') or 5) # consecutive failures
+    CIRCUIT_BREAKER_RESET = int(os.environ.get('CIRCUIT_BREAKER_RESET') or 30) # seconds before a probe
+    # Hedged fetches: ask Yahoo too if Twelve Data has not answered in time
+    MARKET_DATA_HEDGE_AFTER = float(os.environ.get('MARKET_DATA_HEDGE_AFTER') or 2) # seconds
+    MARKET_DATA_DEADLINE = float(os.environ.get('MARKET_DATA_DEADLINE') or 20) # seconds per fetch
+
+    # Providers asked for prices, in order: 'twelvedata' (users with an API key), 'yahoo', and
+    # 'local', prices from a CSV file (symbol,price[,timestamp]) resolved against the instance folder.
+    # Each is imported the first time it is used.
+    MARKET_DATA_PROVIDERS = (os.environ.get('MARKET_DATA_PROVIDERS') or 'twelvedata,yahoo').split(',')
+    LOCAL_PRICES_PATH = os.environ.get('LOCAL_PRICES_PATH') or 'prices.csv'
+
+    # Twelve Data quota, per API key and per worker process (free tier: 8 credits/minute)
+    TWELVE_DATA_CREDITS_PER_MINUTE = int(os.environ.get('TWELVE_DATA_CREDITS_PER_MINUTE') or 8)
+    TWELVE_DATA_BATCH_SIZE = int(os.environ.get('TWELVE_DATA_BATCH_SIZE') or 8) # symbols per /quote call
+    TWELVE_DATA_MAX_WAIT = float(os.environ.get('TWELVE_DATA_MAX_WAIT') or 2) # seconds to wait for credits
+
+    # Production server (`python serve.py`), see app/serving.py. The app is loaded once and forked into workers.
+    SERVER_BIND = os.environ.get('SERVER_BIND') or '0.0.0.0:8000'
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS') or (os.cpu_count() or 1) * 2 + 1)
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS') or 4) # per worker; each open price stream holds one
+    SERVER_TIMEOUT = int(os.environ.get('SERVER_TIMEOUT') or 60) # seconds before a stuck worker is replaced
+    SERVER_GRACEFUL_TIMEOUT = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT') or 30) # seconds to finish requests on reload
+    SERVER_KEEPALIVE = int(os.environ.get('SERVER_KEEPALIVE') or 5) # seconds an idle connection stays open
+    # `kill -USR2 $(cat instance/server.pid)` reloads without downtime; relative to the instance folder
+    SERVER_PIDFILE = os.environ.get('SERVER_PIDFILE') or 'server.pid'
+    # Background threads start in the process that needs them: the refresher on the first request
+    # it serves, the write-behind flusher on the first update it queues, so CLI commands and shells
+    # start neither. A preforking server turns this off and starts them in each worker after the fork
+    BACKGROUND_THREADS = True
+
+    # Background price refresher: 'thread' runs inside each app process,
+    # 'external' expects `python run.py refresh-prices` to run separately, 'off' disables it.
+    PRICE_REFRESH_MODE = os.environ.get('PRICE_REFRESH_MODE') or 'thread'
+    # Lock file (in the instance folder) so only one of several processes refreshes; empty for none
+    PRICE_REFRESH_LOCK = os.environ.get('PRICE_REFRESH_LOCK', 'refresher.lock')
+    PRICE_REFRESH_INTERVAL = int(os.environ.get('PRICE_REFRESH_INTERVAL') or 60) # recently viewed portfolios
+    PRICE_REFRESH_COLD_INTERVAL = int(os.environ.get('PRICE_REFRESH_COLD_INTERVAL') or 900) # everything else
+    PRICE_REFRESH_HOT_WINDOW = int(os.environ.get('PRICE_REFRESH_HOT_WINDOW') or 1800) # seconds a view counts as recent
+    PRICE_REFRESH_BATCH_SIZE = int(os.environ.get('PRICE_REFRESH_BATCH_SIZE') or 200) # symbols per tick
+
+    # Live price stream (Server-Sent Events) on the portfolio page
+    PRICE_STREAM_INTERVAL = int(os.environ.get('PRICE_STREAM_INTERVAL') or 15) # seconds between polls
+    PRICE_STREAM_HEARTBEAT = int(os.environ.get('PRICE_STREAM_HEARTBEAT') or 15) # keepalive comment interval
+    PRICE_STREAM_MAX_CLIENTS = int(os.environ.get('PRICE_STREAM_MAX_CLIENTS') or 100) # open streams per process
+    PRICE_STREAM_CLIENT_TIMEOUT = int(os.environ.get('PRICE_STREAM_CLIENT_TIMEOUT') or 60) # drop clients this far behind
+
+    # Write-behind buffer for refreshed quotes and portfolio view times
+    WRITE_BEHIND_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL') or 2) # seconds between flushes
+    WRITE_BEHIND_MAX_PENDING = int(os.environ.get('WRITE_BEHIND_MAX_PENDING') or 5000) # entries held before a writer flushes
+
+    # Currencies: portfolios are valued in their base currency with FX rates fetched alongside prices
+    DEFAULT_BASE_CURRENCY = os.environ.get('DEFAULT_BASE_CURRENCY') or 'CAD' # preselected for new portfolios
+    CURRENCIES = (os.environ.get('CURRENCIES') or 'CAD,USD,EUR,GBP').split(',') # offered as base currencies
+    FX_REFRESH_INTERVAL = int(os.environ.get('FX_REFRESH_INTERVAL') or 900) # seconds between rate refreshes
+    FX_CACHE_TTL = int(os.environ.get('FX_CACHE_TTL') or 60) # seconds a process reuses its rate matrix
+
+    # Transaction ledger: positions are snapshotted every so many transactions per portfolio
+    LEDGER_SNAPSHOT_INTERVAL = int(os.environ.get('LEDGER_SNAPSHOT_INTERVAL') or 100) # bounds as-of replays
+
+    # Rendered portfolio pages and fragments, reused until holdings or prices change
+    RENDER_CACHE_ENABLED = (os.environ.get('RENDER_CACHE_ENABLED') or '1') != '0'
+    RENDER_CACHE_TTL = int(os.environ.get('RENDER_CACHE_TTL') or 30) # seconds; bounds staleness of 'updated ... ago'
+    RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES') or 16 * 1024 * 1024) # HTML held per process
+
+    # Daily price history, one file per symbol; relative paths are resolved against the instance folder
+    PRICE_HISTORY_PATH = os.environ.get('PRICE_HISTORY_PATH') or 'history'
+    PRICE_HISTORY_YEARS = int(os.environ.get('PRICE_HISTORY_YEARS') or 5) # backfill for new symbols
+    PRICE_HISTORY_UPDATE_INTERVAL = int(os.environ.get('PRICE_HISTORY_UPDATE_INTERVAL') or 21600) # seconds between checks per symbol
+
+    # Instrumentation: Prometheus metrics at /metrics and a log of slow requests
+    METRICS_ENABLED = (os.environ.get('METRICS_ENABLED') or '1') != '0'
+    SLOW_REQUEST_THRESHOLD = float(os.environ.get('SLOW_REQUEST_THRESHOLD') or 1.0) # seconds; 0 turns the log off
+    SLOW_REQUEST_LOG = os.environ.get('SLOW_REQUEST_LOG') # file for slow requests; default is the app log
+    LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
+
+    # Local symbol universe: CSV of symbol,name used for validation and autocomplete.
+    # A relative path is resolved against the instance folder; `python run.py update-symbols` fills it.
+    SYMBOL_UNIVERSE_PATH = os.environ.get('SYMBOL_UNIVERSE_PATH') or 'symbols.csv'
+    SYMBOL_UNIVERSE_RELOAD_INTERVAL = int(os.environ.get('SYMBOL_UNIVERSE_RELOAD_INTERVAL') or 300) # seconds
+    SYMBOL_CHECK_TTL = int(os.environ.get('SYMBOL_CHECK_TTL') or 86400) # remember network checks this long
+    SYMBOL_CHECK_CACHE_SIZE = int(os.environ.get('SYMBOL_CHECK_CACHE_SIZE') or 4096) # network checks remembered
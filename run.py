@@ -1,14 +1,23 @@
+import logging
+import sys
 from app import create_app, db
-from app.models import User, Portfolio, Holding
+from app.migrations import upgrade
+from app.models import User, Portfolio, Holding, Quote
 
 app = create_app()
+logging.basicConfig(level=app.config['LOG_LEVEL'], format='%(asctime)s %(levelname)s %(name)s: %(message)s')
 
 @app.shell_context_processor
 def make_shell_context():
-    return {'db': db, 'User': User, 'Portfolio': Portfolio, 'Holding': Holding}
-
-with app.app_context():
-    db.create_all()
+    return {'db': db, 'User': User, 'Portfolio': Portfolio, 'Holding': Holding, 'Quote': Quote}
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    # Not at import: WSGI servers importing this module leave upgrades to `upgrade-db` or serve.py
+    with app.app_context():
+        upgrade()
+    if len(sys.argv) > 1:
+        # e.g. `python run.py refresh-prices` runs the price refresher as its own process
+        with app.app_context():
+            app.cli.main(args=sys.argv[1:], prog_name='run.py')
+    else:
+        app.run(debug=True, host='0.0.0.0', port=5001)
@@ -0,0 +1,8 @@
+import logging
+from app.serving import serve
+from config import Config
+
+if __name__ == '__main__':
+    # Production server: Gunicorn workers forked from one preloaded app, set up by the SERVER_* config
+    logging.basicConfig(level=Config.LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    serve(Config)
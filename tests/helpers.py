@@ -0,0 +1,9 @@
+from config import Config
+
+
+class TestConfig(Config):
+    """Settings shared by the test modules: an in-memory database and no shared quote cache."""
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    QUOTE_CACHE_PATH = None
+    QUOTE_CACHE_BACKGROUND_REFRESH = False
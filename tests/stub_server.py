@@ -0,0 +1,84 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that timed out close the socket before the stub answers
+        pass
+
+
+class StubServer:
+    """
+    Local HTTP server standing in for a market-data provider.
+    Routes map a path (or a path prefix ending in '/') to a function taking
+    the parsed query string and returning (status, body). `delay` adds
+    latency to every response, plus up to `jitter` seconds at random, and a
+    `failure_rate` share of requests is answered with `failure_status`.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        self.delay = 0
+        self.jitter = 0
+        self.failure_rate = 0
+        self.failure_status = 503
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                with stub._lock:
+                    stub.requests.append((url.path, query))
+                    delay = stub.delay + stub._random.uniform(0, stub.jitter)
+                    failed = stub._random.random() < stub.failure_rate
+                if delay:
+                    time.sleep(delay)
+                handler = stub.routes.get(url.path)
+                if handler is None:
+                    prefix = url.path.rsplit('/', 1)[0] + '/'
+                    handler = stub.routes.get(prefix)
+                    query = dict(query, _path=url.path[len(prefix):])
+                if failed:
+                    status, body = stub.failure_status, {'code': stub.failure_status, 'status': 'error'}
+                else:
+                    status, body = handler(query) if handler else (404, {'code': 404})
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = QuietServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def route(self, path, handler):
+        self.routes[path] = handler
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
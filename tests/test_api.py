@@ -0,0 +1,101 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from app import create_app, db
+from app.models import User, Portfolio, Holding, Quote
+from app.services import market_data
+from helpers import TestConfig
+
+class ApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(username='testuser', api_key='key')
+        self.user.set_password('password')
+        self.portfolio = Portfolio(name='TFSA', type='TFSA', owner=self.user)
+        db.session.add_all([
+            self.user, self.portfolio,
+            Holding(symbol='VOO', units=2, target_percentage=60, portfolio=self.portfolio),
+            Holding(symbol='QQQ', units=1, target_percentage=40, portfolio=self.portfolio),
+            Quote(symbol='VOO', price=300.0, updated_at=datetime.utcnow() - timedelta(minutes=2)),
+            Quote(symbol='QQQ', price=400.0, updated_at=datetime.utcnow() - timedelta(minutes=1)),
+        ])
+        db.session.commit()
+        self.url = f'/api/portfolios/{self.portfolio.id}/valuation'
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self):
+        self.client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+
+    def test_requires_login(self):
+        self.assertEqual(self.client.get('/api/portfolios').status_code, 401)
+
+    def test_portfolios(self):
+        self.login()
+        response = self.client.get('/api/portfolios')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.headers.get('ETag'))
+        item = response.get_json()['portfolios'][0]
+        self.assertEqual(item['name'], 'TFSA')
+        self.assertEqual(item['holdings_count'], 2)
+        self.assertEqual(item['total_value'], 1000.0)
+
+    def test_valuation(self):
+        self.login()
+        with mock.patch.object(market_data, 'fetch_prices', side_effect=AssertionError('network')):
+            data = self.client.get(self.url).get_json()
+        self.assertEqual(data['total_value'], 1000.0)
+        self.assertEqual([h['symbol'] for h in data['holdings']], ['VOO', 'QQQ'])
+        self.assertEqual(data['holdings'][0]['weight'], 0.6)
+
+    def test_conditional_get(self):
+        self.login()
+        etag = self.client.get(self.url).headers['ETag']
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+
+        # New quotes change the ETag
+        Quote.upsert_many({'VOO': {'price': 310.0, 'timestamp': 't'}})
+        db.session.commit()
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+
+        # So do holding changes
+        holding = Holding.query.filter_by(symbol='QQQ').first()
+        self.client.post(f'/portfolio/edit_stock/{holding.id}', data={'units': 3})
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['total_value'], 1820.0)
+
+    def test_field_selection(self):
+        self.login()
+        data = self.client.get(self.url + '?fields=total_value,holdings.symbol,holdings.value').get_json()
+        self.assertEqual(data, {'total_value': 1000.0, 'holdings': [
+            {'symbol': 'VOO', 'value': 600.0}, {'symbol': 'QQQ', 'value': 400.0}]})
+        # Different fields are a different representation
+        full = self.client.get(self.url)
+        partial = self.client.get(self.url + '?fields=total_value')
+        self.assertNotEqual(full.headers['ETag'], partial.headers['ETag'])
+
+    def test_other_users_portfolio(self):
+        other = User(username='other')
+        other.set_password('password')
+        theirs = Portfolio(name='Theirs', owner=other)
+        db.session.add_all([other, theirs])
+        db.session.commit()
+        self.login()
+        self.assertEqual(self.client.get(f'/api/portfolios/{theirs.id}/valuation').status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,9 @@
 import unittest
 from app import create_app, db
 from app.models import User, Portfolio, Holding
-from config import Config
+import helpers
 
-class TestConfig(Config):
-    TESTING = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+class TestConfig(helpers.TestConfig):
     WTF_CSRF_ENABLED = False
 
 class PortfolioTestCase(unittest.TestCase):
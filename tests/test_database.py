@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+from sqlalchemy import inspect, text
+from app import create_app, db
+from app.migrations import upgrade
+import helpers
+
+class TestConfig(helpers.TestConfig):
+    DB_POOL_SIZE = 3
+    SQLITE_BUSY_TIMEOUT = 1234
+
+class DatabaseProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        class FileConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(self.tmp.name, 'test.db')}"
+        self.app = create_app(FileConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        upgrade()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.app_context.pop()
+        self.tmp.cleanup()
+
+    def test_pragmas_on_connect(self):
+        with db.engine.connect() as conn:
+            self.assertEqual(conn.execute(text('PRAGMA journal_mode')).scalar(), 'wal')
+            self.assertEqual(conn.execute(text('PRAGMA synchronous')).scalar(), 1) # NORMAL
+            self.assertEqual(conn.execute(text('PRAGMA busy_timeout')).scalar(), 1234)
+
+    def test_pool_settings(self):
+        self.assertEqual(db.engine.pool.size(), 3)
+
+    def test_indexes(self):
+        inspector = inspect(db.engine)
+        holding = {tuple(i['column_names']) for i in inspector.get_indexes('holding')}
+        self.assertIn(('portfolio_id', 'symbol'), holding)
+        self.assertIn(('symbol',), holding)
+        portfolio = {tuple(i['column_names']) for i in inspector.get_indexes('portfolio')}
+        self.assertIn(('user_id',), portfolio)
+
+    def test_upgrade_adds_indexes_to_existing_tables(self):
+        with db.engine.begin() as conn:
+            conn.execute(text('DROP INDEX ix_holding_portfolio_symbol'))
+        upgrade()
+        names = {i['name'] for i in inspect(db.engine).get_indexes('holding')}
+        self.assertIn('ix_holding_portfolio_symbol', names)
+
+    def test_valuation_uses_index(self):
+        with db.engine.connect() as conn:
+            plan = conn.execute(text('EXPLAIN QUERY PLAN SELECT * FROM holding WHERE portfolio_id = 1')).fetchall()
+        self.assertIn('ix_holding_portfolio_symbol', str(plan))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+from app import create_app, db
+from app.models import User, Portfolio, Holding, Quote
+from app.services import market_data
+from app.services.fx import fx_rates, infer_currency
+from app.services.refresher import refresher
+from app.services.valuation import value_holdings, portfolio_summaries
+from app.services.write_behind import write_buffer
+from helpers import TestConfig
+
+class FxTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(username='testuser', api_key='key')
+        self.user.set_password('password')
+        self.portfolio = Portfolio(name='RRSP', base_currency='CAD', owner=self.user)
+        now = datetime.utcnow()
+        db.session.add_all([
+            self.user, self.portfolio,
+            Holding(symbol='VOO', units=2, portfolio=self.portfolio),
+            Holding(symbol='VFV.TO', units=10, portfolio=self.portfolio),
+            Holding(symbol='SAP.DE', units=1, portfolio=self.portfolio),
+            Quote(symbol='VOO', price=100.0, timestamp='t', updated_at=now),
+            Quote(symbol='VFV.TO', price=50.0, timestamp='t', updated_at=now),
+            Quote(symbol='SAP.DE', price=200.0, timestamp='t', updated_at=now),
+            Quote(symbol='USD/CAD', price=1.25, timestamp='t', updated_at=now),
+            Quote(symbol='EUR/USD', price=1.2, timestamp='t', updated_at=now),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_currencies_are_inferred(self):
+        self.assertEqual(infer_currency('VOO'), 'USD')
+        self.assertEqual(infer_currency('VFV.TO'), 'CAD')
+        self.assertEqual(infer_currency('USD/CAD'), 'CAD')
+        self.assertEqual(db.session.get(Quote, 'SAP.DE').currency, 'EUR')
+
+    def test_rate_matrix_fills_inverse_and_cross_rates(self):
+        rates = fx_rates.rates(['USD', 'CAD', 'EUR', 'JPY'], 'CAD')
+        self.assertAlmostEqual(rates[0], 1.25)
+        self.assertEqual(rates[1], 1.0)
+        self.assertAlmostEqual(rates[2], 1.2 * 1.25) # EUR -> USD -> CAD
+        self.assertTrue(rates[3] != rates[3]) # unknown: NaN
+        self.assertAlmostEqual(fx_rates.rates(['CAD'], 'USD')[0], 0.8)
+
+    def test_holdings_are_valued_in_base_currency(self):
+        holdings, rows, total = value_holdings(self.portfolio.id, 'CAD')
+        self.assertEqual([r['fx_rate'] for r in rows], [1.25, 1.0, 1.5])
+        self.assertEqual([r['value'] for r in rows], [250.0, 500.0, 300.0])
+        self.assertEqual(total, 1050.0)
+        self.assertEqual(rows[0]['price'], 100.0) # still in the listing currency
+
+        summary, = portfolio_summaries(self.user.id)
+        self.assertEqual(summary['holdings_count'], 3)
+        self.assertAlmostEqual(summary['total_value'], 1050.0)
+
+        # No base currency: summed as stored, as before currencies
+        self.assertEqual(value_holdings(self.portfolio.id)[2], 900.0)
+
+    def test_missing_rate_is_flagged_not_dropped(self):
+        holdings, rows, total = value_holdings(self.portfolio.id, 'GBP')
+        self.assertTrue(all(r['fx_missing'] for r in rows))
+        self.assertEqual(total, 900.0)
+
+    def test_rates_refresh_in_the_price_batch(self):
+        db.session.get(Quote, 'USD/CAD').updated_at = datetime(2024, 1, 1)
+        db.session.commit()
+        # EUR/CAD has only a cross rate so far, so it is fetched too
+        self.assertEqual(refresher.due_symbols(), [('EUR/CAD', 'key'), ('USD/CAD', 'key')])
+        self.assertAlmostEqual(fx_rates.rates(['USD'], 'CAD')[0], 1.25)
+
+        prices = {'EUR/CAD': {'price': 1.6, 'timestamp': 't2'}, 'USD/CAD': {'price': 1.4, 'timestamp': 't2'}}
+        with mock.patch.object(market_data, 'fetch_prices', return_value=prices) as fetch:
+            refresher.refresh_once()
+        fetch.assert_called_once_with(['EUR/CAD', 'USD/CAD'], 'key')
+        write_buffer.flush()
+        # The flush invalidated the cached matrix
+        self.assertEqual(list(fx_rates.rates(['USD', 'EUR'], 'CAD')), [1.4, 1.6])
+        self.assertEqual(refresher.due_symbols(), [])
+
+    def test_api_etag_follows_rates(self):
+        self.client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+        url = f'/api/portfolios/{self.portfolio.id}/valuation'
+        response = self.client.get(url)
+        self.assertEqual(response.json['base_currency'], 'CAD')
+        self.assertEqual(response.json['holdings'][0]['currency'], 'USD')
+        etag = response.headers['ETag'].strip('"')
+
+        write_buffer.put_quotes({'USD/CAD': {'price': 1.3, 'timestamp': 't2'}})
+        write_buffer.flush()
+        response = self.client.get(url, headers={'If-None-Match': f'"{etag}"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertAlmostEqual(response.json['total_value'], 100 * 2 * 1.3 + 500 + 300 * 1.3 / 1.25)
+
+if __name__ == '__main__':
+    unittest.main()
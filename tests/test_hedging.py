@@ -0,0 +1,70 @@
+import time
+import unittest
+from app.services import hedging
+
+def quote(price):
+    return {'price': price, 'timestamp': ''}
+
+class Provider:
+    """Fake provider that answers after `delay` seconds and records its calls."""
+    def __init__(self, prices, delay=0.0, error=None):
+        self.prices = prices
+        self.delay = delay
+        self.error = error
+        self.calls = []
+
+    def __call__(self, symbols):
+        self.calls.append(list(symbols))
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return {s: quote(self.prices[s]) for s in symbols if s in self.prices}
+
+def fetch(primary, fallback, symbols, hedge_after=0.1, deadline=2):
+    start = time.monotonic()
+    results = hedging.fetch_sync(symbols, [('primary', primary), ('fallback', fallback)],
+                                 hedge_after=hedge_after, deadline=deadline)
+    return {s: q['price'] for s, q in results.items()}, time.monotonic() - start
+
+class HedgingTestCase(unittest.TestCase):
+    def test_fast_primary_is_not_hedged(self):
+        primary, fallback = Provider({'A': 1, 'B': 2}), Provider({'A': 9, 'B': 9})
+        results, _ = fetch(primary, fallback, ['A', 'B'])
+        self.assertEqual(results, {'A': 1, 'B': 2})
+        self.assertEqual(fallback.calls, [])
+
+    def test_fallback_gets_only_missing_symbols(self):
+        primary, fallback = Provider({'A': 1}), Provider({'A': 9, 'B': 2})
+        results, elapsed = fetch(primary, fallback, ['A', 'B'], hedge_after=1)
+        self.assertEqual(results, {'A': 1, 'B': 2})
+        self.assertEqual(fallback.calls, [['B']])
+        # Started as soon as the primary answered, not after the hedge budget
+        self.assertLess(elapsed, 0.5)
+
+    def test_slow_primary_is_hedged(self):
+        primary = Provider({'A': 1, 'B': 2, 'C': 3}, delay=0.4)
+        fallback = Provider({'A': 9, 'B': 8})
+        results, elapsed = fetch(primary, fallback, ['A', 'B', 'C'])
+        self.assertEqual(fallback.calls, [['A', 'B', 'C']])
+        # First valid quote per symbol wins; C only came from the primary
+        self.assertEqual(results, {'A': 9, 'B': 8, 'C': 3})
+        self.assertLess(elapsed, 1)
+
+    def test_deadline(self):
+        primary = Provider({'A': 1}, delay=1)
+        fallback = Provider({'A': 9}, delay=1)
+        results, elapsed = fetch(primary, fallback, ['A'], hedge_after=0.05, deadline=0.2)
+        self.assertEqual(results, {})
+        self.assertLess(elapsed, 0.6)
+
+    def test_failed_or_invalid_quotes_fall_back(self):
+        primary = Provider({}, error=RuntimeError('down'))
+        fallback = Provider({'A': 1})
+        self.assertEqual(fetch(primary, fallback, ['A'])[0], {'A': 1})
+
+        primary = Provider({'A': 0, 'B': float('nan')})
+        fallback = Provider({'A': 1, 'B': 2})
+        self.assertEqual(fetch(primary, fallback, ['A', 'B'])[0], {'A': 1, 'B': 2})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+from datetime import date, timedelta
+from unittest import mock
+import numpy as np
+from app import create_app, db
+from app.models import User, Portfolio, Holding, Quote
+from app.services.history import price_history, performance
+import helpers
+
+class TestConfig(helpers.TestConfig):
+    PRICE_HISTORY_YEARS = 1
+
+def days(*values):
+    return np.array(values, dtype='datetime64[D]')
+
+class PriceHistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        class HistoryConfig(TestConfig):
+            PRICE_HISTORY_PATH = self.tmp.name
+        self.app = create_app(HistoryConfig)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_append_only_adds_new_dates(self):
+        self.assertEqual(price_history.append('VOO', days('2024-01-02', '2024-01-03'), [1.0, 2.0]), 2)
+        # The last stored day is replaced, older days are left alone
+        written = price_history.append('VOO', days('2024-01-02', '2024-01-03', '2024-01-04'), [9.0, 2.5, 3.0])
+        self.assertEqual(written, 2)
+        rows = price_history.load('VOO')
+        self.assertEqual(rows['date'].tolist(), days('2024-01-02', '2024-01-03', '2024-01-04').tolist())
+        self.assertEqual(rows['close'].tolist(), [1.0, 2.5, 3.0])
+        self.assertEqual(len(price_history.load('NONE')), 0)
+
+    def test_append_never_shrinks_mapped_rows(self):
+        price_history.append('VOO', days('2024-01-02', '2024-01-03'), [1.0, 2.0])
+        mapped = price_history.load('VOO')
+        # Replacing the last day rewrites it in place
+        price_history.append('VOO', days('2024-01-03'), [2.5])
+        self.assertEqual(mapped['close'].tolist(), [1.0, 2.5])
+
+        # A partial record left by an interrupted write is dropped
+        with open(price_history._file('VOO'), 'ab') as f:
+            f.write(b'\0' * 5)
+        price_history.append('VOO', days('2024-01-03'), [3.0])
+        rows = price_history.load('VOO')
+        self.assertEqual(rows['close'].tolist(), [1.0, 3.0])
+        self.assertEqual(os.path.getsize(price_history._file('VOO')), rows.nbytes)
+
+    def test_update_fetches_missing_dates_only(self):
+        price_history.append('VOO', days('2024-01-02'), [1.0])
+        fetch = mock.Mock(return_value={'VOO': (days('2024-01-02', '2024-01-03'), [1.5, 2.0]),
+                                        'QQQ': (days('2024-01-03'), [5.0])})
+        written = price_history.update(['VOO', 'QQQ'], fetch)
+        self.assertEqual(written, {'VOO': 2, 'QQQ': 1})
+        starts = {tuple(call.args[0]): call.args[1] for call in fetch.call_args_list}
+        self.assertEqual(starts, {('VOO',): date(2024, 1, 2), ('QQQ',): date.today() - timedelta(days=365)})
+
+        # Checked symbols wait for the update interval
+        fetch.reset_mock()
+        self.assertEqual(price_history.update(['VOO', 'QQQ'], fetch), {})
+        fetch.assert_not_called()
+
+    def test_closes_carry_forward(self):
+        price_history.append('A', days('2024-01-01', '2024-01-03'), [1.0, 3.0])
+        price_history.append('B', days('2024-01-02'), [10.0])
+        dates, prices = price_history.closes(['A', 'B'])
+        self.assertEqual(len(dates), 3)
+        np.testing.assert_array_equal(prices, [[1.0, np.nan], [1.0, 10.0], [3.0, 10.0]])
+
+class PerformanceTestCase(unittest.TestCase):
+    def test_analytics(self):
+        dates = days('2024-01-01', '2024-01-02', '2024-01-03', '2024-01-04')
+        prices = np.array([[100, np.nan], [110, np.nan], [99, 50], [99, 55]], dtype=float)
+        result = performance(dates, prices, [1, 2])
+        self.assertEqual(result['values'], [100, 110, 199, 209])
+        # B's arrival on day 3 is not a gain; only A's move counts that day
+        self.assertAlmostEqual(result['twr'], 1.1 * 0.9 * (209 / 199) - 1)
+        self.assertAlmostEqual(result['max_drawdown'], -0.1)
+        returns = np.array([0.1, -0.1, 10 / 199])
+        self.assertAlmostEqual(result['volatility'], returns.std(ddof=1) * np.sqrt(252))
+        self.assertIsNone(result['annualized_return'])
+        self.assertIsNone(performance(dates[:1], prices[:1], [1, 2]))
+
+class ViewAnalyticsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        class HistoryConfig(TestConfig):
+            PRICE_HISTORY_PATH = self.tmp.name
+        self.app = create_app(HistoryConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.tmp.cleanup()
+
+    def test_view_shows_performance(self):
+        user = User(username='testuser')
+        user.set_password('password')
+        portfolio = Portfolio(name='TFSA', owner=user)
+        db.session.add_all([user, portfolio, Holding(symbol='VOO', units=2, portfolio=portfolio),
+                            Quote(symbol='VOO', price=120.0)])
+        db.session.commit()
+        price_history.append('VOO', np.arange('2020-01-01', '2024-01-01', dtype='datetime64[D]'),
+                             np.linspace(100, 120, 1461))
+        self.client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+
+        response = self.client.get(f'/portfolio/{portfolio.id}')
+        self.assertIn(b'Time-Weighted Return', response.data)
+        self.assertIn(b'20.00%', response.data)
+        self.assertIn(b'valueChart', response.data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+from app import create_app, db
+from app.models import User, Portfolio, Holding, Quote
+from app.services import market_data
+from app.services.importer import import_holdings, parse_holdings, ImportFormatError
+import helpers
+
+class TestConfig(helpers.TestConfig):
+    SYMBOL_UNIVERSE_RELOAD_INTERVAL = 0
+
+BROKER_EXPORT = """Account Summary,TFSA 12345
+As of,2024-01-02
+
+Symbol,Description,Quantity,Market Value
+VFV.TO,Vanguard S&P 500,"1,200",120000
+AAPL,Apple Inc,10,1900
+AAPL,Apple Inc,5,950
+ZZZZ,Unknown,3,0
+XEQT.TO,iShares All-Equity,abc,0
+,Cash,,500
+MSFT,Microsoft,-2,0
+"""
+
+def fake_fetch(symbols, api_key=None):
+    return {s: {'price': 10.0, 'timestamp': 't'} for s in symbols if s != 'ZZZZ'}
+
+class ImporterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, 'symbols.csv')
+        with open(path, 'w') as f:
+            f.write("symbol,name\nVFV.TO,Vanguard S&P 500 Index ETF\n")
+        class ImportConfig(TestConfig):
+            SYMBOL_UNIVERSE_PATH = path
+        self.app = create_app(ImportConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(username='testuser', api_key='key')
+        self.user.set_password('password')
+        self.portfolio = Portfolio(name='TFSA', type='TFSA', owner=self.user)
+        db.session.add_all([self.user, self.portfolio])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.tmp.cleanup()
+
+    def test_parse_finds_header_after_preamble(self):
+        rows = list(parse_holdings(io.StringIO(BROKER_EXPORT)))
+        self.assertEqual(rows[0], (5, 'VFV.TO', 1200.0, None))
+        errors = {line: message for line, _, _, message in rows if message}
+        self.assertEqual(set(errors), {9, 10, 11})
+        self.assertIn('Invalid quantity', errors[9])
+
+    def test_parse_without_header(self):
+        with self.assertRaises(ImportFormatError):
+            list(parse_holdings(io.StringIO("a,b\n1,2\n")))
+
+    def test_import_validates_distinct_symbols_in_one_batch(self):
+        db.session.add(Holding(symbol='AAPL', units=1, portfolio=self.portfolio))
+        db.session.commit()
+        with mock.patch.object(market_data, 'fetch_prices', side_effect=fake_fetch) as fetch:
+            report = import_holdings(self.portfolio, io.StringIO(BROKER_EXPORT), api_key='key')
+        # VFV.TO is in the local universe; the rest go out together, once
+        fetch.assert_called_once_with(['AAPL', 'ZZZZ'], 'key')
+
+        self.assertEqual(report['rows'], 7)
+        self.assertEqual(report['imported'], 1)
+        self.assertEqual(report['updated'], 1)
+        self.assertEqual(report['error_count'], 4)
+        self.assertIn((8, 'Unknown symbol: ZZZZ'), report['errors'])
+        holdings = {h.symbol: h.units for h in Holding.query.filter_by(portfolio_id=self.portfolio.id)}
+        self.assertEqual(holdings, {'AAPL': 16.0, 'VFV.TO': 1200.0})
+        self.assertEqual(db.session.get(Quote, 'AAPL').price, 10.0)
+
+    def test_reports_errors_with_the_lowest_lines(self):
+        lines = 'Symbol,Units\nZZZZ,1\nVERYLONGSYMBOL,1\n' + 'VFV.TO,x\n' * 3
+        with mock.patch.object(market_data, 'fetch_prices', side_effect=fake_fetch), \
+                mock.patch('app.services.importer.MAX_REPORTED_ERRORS', 2):
+            report = import_holdings(self.portfolio, io.StringIO(lines))
+        # The unknown symbol is found last but is on the first line
+        self.assertEqual(report['error_count'], 5)
+        self.assertEqual(report['errors'], [(2, 'Unknown symbol: ZZZZ'),
+                                            (3, 'Symbol VERYLONGSYMBOL is longer than 10 characters')])
+        self.assertEqual(Holding.query.count(), 0)
+
+    def test_replace_mode(self):
+        db.session.add(Holding(symbol='VFV.TO', units=7, portfolio=self.portfolio))
+        db.session.commit()
+        report = import_holdings(self.portfolio, io.StringIO("Ticker,Shares\nVFV.TO,3\n"), mode='replace')
+        self.assertEqual(report['updated'], 1)
+        self.assertEqual(Holding.query.one().units, 3.0)
+
+    def test_upload_route_reports_errors(self):
+        self.client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+        data = {'file': (io.BytesIO(b'\xef\xbb\xbfSymbol,Units\nVFV.TO,2\nVFV.TO,x\n'), 'holdings.csv')}
+        response = self.client.post(f'/portfolio/{self.portfolio.id}/import', data=data,
+                                    content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'1 holdings added', response.data)
+        self.assertIn(b'Invalid quantity for VFV.TO', response.data)
+        self.assertEqual(Holding.query.one().units, 2.0)
+
+    def test_cli_command(self):
+        path = os.path.join(self.tmp.name, 'export.csv')
+        with open(path, 'w') as f:
+            f.write("symbol,quantity\nVFV.TO,4\n")
+        result = self.app.test_cli_runner().invoke(args=['import-holdings', str(self.portfolio.id), path])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('1 added', result.output)
+        self.assertEqual(Holding.query.one().units, 4.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import unittest
+from datetime import date
+from unittest import mock
+from app import create_app, db
+from app.migrations import upgrade
+from app.models import User, Portfolio, Holding, Quote, Transaction, PositionSnapshot
+from app.services import ledger
+from app.services.refresher import refresher
+import helpers
+
+class TestConfig(helpers.TestConfig):
+    LEDGER_SNAPSHOT_INTERVAL = 3
+
+class LedgerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        user = User(username='testuser')
+        user.set_password('password')
+        self.portfolio = Portfolio(name='TFSA', type='TFSA', owner=user)
+        db.session.add_all([user, self.portfolio, Quote(symbol='VOO', price=30.0, timestamp='t')])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def position(self, symbol='VOO'):
+        h = Holding.query.filter_by(portfolio_id=self.portfolio.id, symbol=symbol).one()
+        return h.units, h.cost_basis, h.realized_gain
+
+    def test_average_cost(self):
+        position = (0.0, 0.0, 0.0)
+        position = ledger.apply(position, 'buy', 10, 10.0)
+        position = ledger.apply(position, 'buy', 10, 20.0)
+        self.assertEqual(position, (20, 300.0, 0.0))
+        position = ledger.apply(position, 'sell', 5, 25.0)
+        self.assertEqual(position, (15, 225.0, 50.0))
+        # Unknown costs stay unknown until the position is closed
+        position = ledger.apply(position, 'open', 5, None)
+        self.assertEqual(position, (20, None, 50.0))
+        # A sale from an unknown cost has no known gain, even with a price
+        self.assertEqual(ledger.apply(position, 'sell', 20, 30.0), (0.0, 0.0, None))
+        self.assertEqual(ledger.apply((5, None, 0.0), 'sell', 2, 30.0), (3, None, None))
+
+    def test_positions_are_materialized_and_snapshotted(self):
+        trades = [(date(2024, 1, 1), 'buy', 10, 10.0), (date(2024, 2, 1), 'buy', 10, 20.0),
+                  (date(2024, 3, 1), 'sell', 5, 25.0), (date(2024, 4, 1), 'sell', 5, 30.0)]
+        for when, kind, units, price in trades:
+            ledger.record(self.portfolio, 'VOO', kind, units, price, when)
+            db.session.commit()
+        self.assertEqual(self.position(), (10, 150.0, 125.0))
+        self.assertEqual(self.portfolio.transaction_count, 4)
+        # One snapshot, after the third transaction
+        snapshot, = PositionSnapshot.query.all()
+        self.assertEqual((snapshot.date, snapshot.units, snapshot.realized_gain), (date(2024, 3, 1), 15, 50.0))
+
+        # Rebuilt from the snapshot even once the transactions before it are gone
+        Transaction.query.filter(Transaction.date <= date(2024, 3, 1)).delete()
+        self.assertEqual(ledger.positions_as_of(self.portfolio.id, date(2024, 4, 15))['VOO'],
+                         {'units': 10, 'cost_basis': 150.0, 'realized_gain': 125.0})
+        self.assertEqual(ledger.positions_as_of(self.portfolio.id, date(2024, 3, 1))['VOO']['units'], 15)
+
+    def test_backdated_transaction_is_replayed(self):
+        for when, kind, units, price in [(date(2024, 1, 1), 'buy', 10, 10.0), (date(2024, 2, 1), 'buy', 10, 20.0),
+                                         (date(2024, 3, 1), 'sell', 10, 30.0)]:
+            ledger.record(self.portfolio, 'VOO', kind, units, price, when)
+        self.assertEqual(self.position(), (10, 150.0, 150.0))
+        self.assertEqual(PositionSnapshot.query.count(), 1)
+
+        # A sale before the second buy changes the average cost of everything after it
+        ledger.record(self.portfolio, 'VOO', 'sell', 10, 10.0, date(2024, 1, 15))
+        db.session.commit()
+        self.assertEqual(PositionSnapshot.query.count(), 0)
+        self.assertEqual(self.position(), (0.0, 0.0, 100.0))
+        self.assertEqual(ledger.positions_as_of(self.portfolio.id, date(2024, 2, 1))['VOO']['cost_basis'], 200.0)
+
+    def test_routes_record_transactions(self):
+        self.client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+        url = f'/portfolio/{self.portfolio.id}/transactions'
+        with mock.patch('app.routes.portfolio.check_symbol', return_value=True), \
+                mock.patch.object(refresher, 'refresh_symbols') as refresh:
+            self.client.post(url, data={'kind': 'buy', 'symbol': 'voo', 'units': '4', 'price': '25',
+                                        'date': '2024-05-01'})
+        refresh.assert_called_once_with(['VOO'], api_key=None)
+        holding = Holding.query.one()
+        self.client.post(f'/portfolio/edit_stock/{holding.id}', data={'units': '2', 'price': '30'})
+        self.assertEqual(self.position(), (2, 50.0, 10.0))
+        self.assertEqual([t.kind for t in Transaction.query.order_by(Transaction.id)], ['buy', 'sell'])
+
+        response = self.client.get(url, query_string={'as_of': '2024-05-01'})
+        self.assertIn(b'$100.00', response.data)
+        self.assertIn(b'$10.00', self.client.get(f'/portfolio/{self.portfolio.id}').data) # unrealized gain
+
+        self.client.get(f'/portfolio/delete_stock/{holding.id}')
+        # The history stays, closed with a sale of unknown price
+        self.assertEqual(Holding.query.count(), 0)
+        self.assertEqual([t.kind for t in Transaction.query.order_by(Transaction.id)], ['buy', 'sell', 'sell'])
+        self.assertEqual(ledger.positions_as_of(self.portfolio.id)['VOO'],
+                         {'units': 0.0, 'cost_basis': 0.0, 'realized_gain': None})
+        self.assertIn(b'$100.00', self.client.get(url, query_string={'as_of': '2024-05-01'}).data)
+
+        # Bought again, it continues from the end of its ledger
+        ledger.record(self.portfolio, 'VOO', 'buy', 1, 40.0)
+        self.assertEqual(self.position(), (1, 40.0, None))
+
+    def test_routes_reject_selling_more_than_held(self):
+        self.client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+        url = f'/portfolio/{self.portfolio.id}/transactions'
+        ledger.record(self.portfolio, 'VOO', 'buy', 10, 10.0, date(2024, 1, 1))
+        ledger.record(self.portfolio, 'VOO', 'buy', 10, 20.0, date(2024, 3, 1))
+        ledger.record(self.portfolio, 'VOO', 'sell', 15, 30.0, date(2024, 4, 1))
+        db.session.commit()
+
+        response = self.client.post(url, data={'kind': 'sell', 'symbol': 'VOO', 'units': '6'}, follow_redirects=True)
+        self.assertIn(b'only 5 can be sold', response.data)
+        # Only 10 were held on 2024-02-01, and the sale on 2024-04-01 leaves 5 of them
+        response = self.client.post(url, data={'kind': 'sell', 'symbol': 'VOO', 'units': '6', 'date': '2024-02-01'},
+                                    follow_redirects=True)
+        self.assertIn(b'only 5 can be sold as of 2024-02-01', response.data)
+        self.client.post(url, data={'kind': 'sell', 'symbol': 'VOO', 'units': '5', 'date': '2024-02-01'})
+        self.assertEqual(self.position()[0], 0.0)
+
+        holding = Holding.query.one()
+        response = self.client.post(f'/portfolio/edit_stock/{holding.id}', data={'units': '-1'}, follow_redirects=True)
+        self.assertIn(b'Cannot sell more than', response.data)
+        self.assertEqual(Transaction.query.count(), 4)
+
+    def test_zero_unit_holding_makes_symbol_eligible(self):
+        self.client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+        url = f'/portfolio/{self.portfolio.id}/add_stock'
+        with mock.patch('app.routes.portfolio.check_symbol', return_value=True), \
+                mock.patch.object(refresher, 'refresh_symbols'):
+            self.client.post(url, data={'symbol': 'VOO', 'units': '0'})
+            self.client.post(url, data={'symbol': 'VOO', 'units': '0'})
+            response = self.client.post(url, data={'symbol': 'VOO', 'units': '-1'}, follow_redirects=True)
+        self.assertIn(b'Units cannot be negative', response.data)
+        self.assertEqual(self.position(), (0.0, 0.0, 0.0))
+        self.assertEqual(Transaction.query.count(), 1)
+        page = self.client.get('/portfolio/household').data.decode()
+        self.assertRegex(page, rf'name="eligible_{self.portfolio.id}_VOO"\s+title="[^"]*"\s+checked')
+
+    def test_upgrade_opens_ledgers_for_existing_holdings(self):
+        db.session.add(Holding(symbol='VOO', units=7, portfolio=self.portfolio))
+        db.session.commit()
+        upgrade()
+        upgrade()
+        transaction, = Transaction.query.all()
+        self.assertEqual((transaction.kind, transaction.units, transaction.price), ('open', 7, None))
+        self.assertEqual(ledger.positions_as_of(self.portfolio.id)['VOO']['units'], 7)
+        self.assertEqual(self.position(), (7, None, 0.0))
+
+        # A gain the ledger left unknown stays unknown on the next start
+        ledger.record(self.portfolio, 'VOO', 'sell', 2, 30.0)
+        db.session.commit()
+        upgrade()
+        db.session.expire_all()
+        self.assertEqual(self.position(), (5, None, None))
+
+if __name__ == '__main__':
+    unittest.main()
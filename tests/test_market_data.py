@@ -0,0 +1,45 @@
+import unittest
+from unittest import mock
+import pandas as pd
+from app.services.providers import yahoo
+
+def yahoo_frame(closes):
+    """Builds a frame shaped like yf.download(..., group_by='ticker')."""
+    index = pd.to_datetime(['2024-01-02', '2024-01-03'])
+    columns = pd.MultiIndex.from_product([list(closes), ['Open', 'Close']], names=['Ticker', 'Price'])
+    frame = pd.DataFrame(index=index, columns=columns, dtype=float)
+    for sym, values in closes.items():
+        frame[(sym, 'Open')] = values
+        frame[(sym, 'Close')] = values
+    return frame
+
+class YahooBatchTestCase(unittest.TestCase):
+    def test_batch_then_pool_for_dropped_symbols(self):
+        frame = yahoo_frame({
+            'AAPL': [190.0, 191.5],
+            'VFV.TO': [120.0, float('nan')], # no close on the last day for this exchange
+            'NOPE': [float('nan'), float('nan')],
+        })
+        single = {'MSFT': {'price': 410.0, 'timestamp': '2024-01-03 00:00:00'}}
+
+        with mock.patch.object(yahoo.yf, 'download', return_value=frame) as download, \
+             mock.patch.object(yahoo, 'get_price', side_effect=single.get) as get_one:
+            results = yahoo.get_prices(['AAPL', 'VFV.TO', 'MSFT', 'NOPE', 'AAPL'])
+
+        download.assert_called_once()
+        self.assertEqual(download.call_args[0][0], ['AAPL', 'VFV.TO', 'MSFT', 'NOPE'])
+        self.assertEqual(results['AAPL'], {'price': 191.5, 'timestamp': '2024-01-03 00:00:00'})
+        self.assertEqual(results['VFV.TO'], {'price': 120.0, 'timestamp': '2024-01-02 00:00:00'})
+        self.assertEqual(results['MSFT'], single['MSFT'])
+        self.assertNotIn('NOPE', results)
+        self.assertEqual(sorted(c.args[0] for c in get_one.call_args_list), ['MSFT', 'NOPE'])
+
+    def test_batch_failure_falls_back_to_pool(self):
+        with mock.patch.object(yahoo.yf, 'download', side_effect=RuntimeError('rate limited')), \
+             mock.patch.object(yahoo, 'get_price',
+                               side_effect=lambda s: {'price': 1.0, 'timestamp': ''}):
+            results = yahoo.get_prices(['A', 'B', 'C'])
+        self.assertEqual(set(results), {'A', 'B', 'C'})
+
+if __name__ == '__main__':
+    unittest.main()
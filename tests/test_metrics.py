@@ -0,0 +1,86 @@
+import re
+import time
+import unittest
+from unittest import mock
+from app import create_app, db
+from app.models import User, Portfolio, Holding, Quote
+from app.services import hedging, metrics
+from app.services.providers import yahoo
+import helpers
+
+class TestConfig(helpers.TestConfig):
+    SLOW_REQUEST_THRESHOLD = 0
+
+def server_timing(response):
+    return {name: float(dur) for name, dur in re.findall(r'(\w+);dur=([\d.]+)', response.headers['Server-Timing'])}
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        user = User(username='testuser')
+        user.set_password('password')
+        self.portfolio = Portfolio(name='TFSA', owner=user)
+        db.session.add_all([user, self.portfolio, Holding(symbol='VOO', units=2, portfolio=self.portfolio),
+                            Quote(symbol='VOO', price=10.0)])
+        db.session.commit()
+        self.client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_view_breakdown_and_route_histogram(self):
+        before = metrics.REQUEST_LATENCY.count(endpoint='portfolio.view', method='GET', status=200)
+        response = self.client.get(f'/portfolio/{self.portfolio.id}')
+        timing = server_timing(response)
+        self.assertGreater(timing['db'], 0)
+        self.assertGreater(timing['render'], 0)
+        self.assertEqual(timing['upstream'], 0)
+        self.assertGreaterEqual(timing['total'], timing['db'] + timing['render'])
+        self.assertEqual(metrics.REQUEST_LATENCY.count(endpoint='portfolio.view', method='GET', status=200),
+                         before + 1)
+
+        text = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="portfolio.view",method="GET",'
+                      'status="200",le="+Inf"}', text)
+        self.assertIn('template_render_duration_seconds_count{template="portfolio/view.html"}', text)
+        self.assertIn('quote_cache_lookups_total{result="hits"}', text)
+        # Shared-tier hits are already counted as hits, so they are not another result
+        self.assertNotIn('result="shared_hits"', text)
+        self.assertIn('quote_cache_shared_hits_total ', text)
+
+    def test_upstream_time_and_provider_histogram(self):
+        before = metrics.PROVIDER_LATENCY.count(provider='yahoo')
+
+        def slow_yahoo(symbols):
+            time.sleep(0.05)
+            return {s: {'price': 11.0, 'timestamp': ''} for s in symbols}
+
+        with mock.patch.object(yahoo, 'get_prices', side_effect=slow_yahoo):
+            response = self.client.post(f'/portfolio/{self.portfolio.id}/refresh')
+        self.assertGreaterEqual(server_timing(response)['upstream'], 50)
+        self.assertEqual(metrics.PROVIDER_LATENCY.count(provider='yahoo'), before + 1)
+
+    def test_fallback_counter(self):
+        before = metrics.PROVIDER_FALLBACKS.value(provider='fallback', reason='missing')
+        hedging.fetch_sync(['A'], [('primary', lambda s: {}), ('fallback', lambda s: {})])
+        self.assertEqual(metrics.PROVIDER_FALLBACKS.value(provider='fallback', reason='missing'), before + 1)
+
+    def test_slow_request_log(self):
+        with self.assertLogs('app.slow_requests', level='WARNING') as logs:
+            metrics.instrumentation.slow_threshold = 0.000001
+            try:
+                self.client.get(f'/portfolio/{self.portfolio.id}')
+            finally:
+                metrics.instrumentation.slow_threshold = 0
+        self.assertRegex(logs.output[0], r'GET /portfolio/\d+ 200 took \d+ ms: upstream 0 ms \(0 calls\), '
+                                         r'db \d+ ms \(\d+ queries\), render \d+ ms')
+
+if __name__ == '__main__':
+    unittest.main()
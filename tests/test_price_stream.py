@@ -0,0 +1,130 @@
+import json
+import time
+from datetime import datetime, timedelta
+import unittest
+from unittest import mock
+from app import create_app, db
+from app.models import User, Portfolio, Holding, Quote
+from app.services import market_data
+from app.services.price_stream import price_hub
+from app.services.quote_cache import quote_cache
+from app.services.write_behind import write_buffer
+import helpers
+
+class TestConfig(helpers.TestConfig):
+    PRICE_STREAM_HEARTBEAT = 0.05
+    PRICE_STREAM_MAX_CLIENTS = 3
+    PRICE_STREAM_CLIENT_TIMEOUT = 60
+
+def quote(price):
+    return {'price': price, 'timestamp': '2024-01-02 16:00:00'}
+
+class PriceHubTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_one_poll_per_distinct_symbol(self):
+        first = price_hub.subscribe(['VOO', 'QQQ'], api_key='key')
+        second = price_hub.subscribe(['VOO'])
+        fetch = mock.Mock(side_effect=lambda symbols, api_key=None: {s: quote(10.0) for s in symbols})
+        with mock.patch.object(market_data, 'fetch_prices', fetch):
+            price_hub.poll_once()
+        fetch.assert_called_once_with(['QQQ', 'VOO'], 'key')
+
+        self.assertEqual(first.get(0), {'QQQ': quote(10.0), 'VOO': quote(10.0)})
+        self.assertEqual(second.get(0), {'VOO': quote(10.0)})
+        write_buffer.flush()
+        self.assertEqual(db.session.get(Quote, 'VOO').price, 10.0)
+
+        # Unchanged prices are not pushed again
+        self.assertEqual(price_hub.publish({'VOO': quote(10.0)}), {})
+        self.assertEqual(second.get(0), {})
+
+    def test_cached_quotes_keep_their_fetch_time(self):
+        quote_cache.store_results(['VOO', 'QQQ'], {'VOO': quote(10.0), 'QQQ': quote(20.0)})
+        for symbol, age in (('VOO', 30), ('QQQ', 600)): # fresh, and stale
+            q, fetched_at = quote_cache._lru[symbol]
+            quote_cache._lru[symbol] = (q, fetched_at - age)
+        price_hub.subscribe(['VOO', 'QQQ'])
+        fetch = mock.Mock(side_effect=lambda symbols, api_key=None: {s: quote(21.0) for s in symbols})
+        with mock.patch.object(market_data, 'fetch_prices', fetch):
+            self.assertEqual(set(price_hub.poll_once()), {'VOO', 'QQQ'})
+            write_buffer.flush()
+            age = datetime.utcnow() - db.session.get(Quote, 'VOO').updated_at
+            self.assertGreater(age, timedelta(seconds=29))
+            # The stale quote was replaced by the revalidation it triggered
+            self.assertIsNone(db.session.get(Quote, 'QQQ'))
+            self.assertEqual(price_hub.poll_once(), {'QQQ': quote(21.0)})
+            write_buffer.flush()
+        self.assertEqual(db.session.get(Quote, 'QQQ').price, 21.0)
+
+    def test_slow_client_gets_latest_quote_only(self):
+        sub = price_hub.subscribe(['VOO'])
+        price_hub.publish({'VOO': quote(1.0)})
+        price_hub.publish({'VOO': quote(2.0)})
+        self.assertEqual(sub.get(0), {'VOO': quote(2.0)})
+        self.assertEqual(sub.coalesced, 1)
+
+    def test_evicts_clients_that_fall_behind(self):
+        slow = price_hub.subscribe(['VOO'])
+        idle = price_hub.subscribe(['QQQ'])
+        price_hub.publish({'VOO': quote(1.0)})
+        price_hub.client_timeout = 0
+        time.sleep(0.01)
+        self.assertEqual(price_hub.evict_slow(), 1)
+        self.assertTrue(slow.closed)
+        self.assertFalse(idle.closed)
+        self.assertEqual(price_hub.watched_symbols(), {None: ['QQQ']})
+
+    def test_new_subscriber_gets_last_quotes(self):
+        price_hub.publish({'VOO': quote(5.0)})
+        self.assertEqual(price_hub.subscribe(['VOO']).get(0), {'VOO': quote(5.0)})
+
+    def test_max_clients(self):
+        subs = [price_hub.subscribe(['VOO']) for _ in range(3)]
+        self.assertIsNone(price_hub.subscribe(['VOO']))
+        price_hub.unsubscribe(subs[0])
+        self.assertIsNotNone(price_hub.subscribe(['VOO']))
+
+class StreamRouteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        user = User(username='testuser')
+        user.set_password('password')
+        self.portfolio = Portfolio(name='TFSA', owner=user)
+        db.session.add_all([user, self.portfolio, Holding(symbol='VOO', units=2, portfolio=self.portfolio)])
+        db.session.commit()
+        self.client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_stream_pushes_prices(self):
+        price_hub.publish({'VOO': quote(12.5), 'QQQ': quote(1.0)})
+        response = self.client.get(f'/portfolio/{self.portfolio.id}/stream', buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = response.iter_encoded()
+        self.assertTrue(next(chunks).startswith(b'retry:'))
+        event = next(chunks).decode()
+        self.assertTrue(event.startswith('event: prices\n'))
+        self.assertEqual(json.loads(event.split('data: ')[1]), {'VOO': quote(12.5)})
+        self.assertEqual(next(chunks), b': keepalive\n\n')
+        response.close()
+        self.assertEqual(price_hub.watched_symbols(), {})
+
+if __name__ == '__main__':
+    unittest.main()
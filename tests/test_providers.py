@@ -0,0 +1,86 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from app import create_app
+from app.services import market_data
+from app.services.providers import registry, ProviderRegistry
+from helpers import TestConfig
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Generous: catches a heavy import creeping back into startup, not machine noise
+STARTUP_BUDGET = 5.0 # seconds from interpreter start to a served request
+
+# Runs in a fresh interpreter so modules imported by other tests do not count
+STARTUP_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+
+sys.path.insert(0, 'tests')
+from helpers import TestConfig
+app = create_app(TestConfig)
+app.test_client().get('/auth/login')
+ready = time.perf_counter()
+heavy = sorted(m for m in ('yfinance', 'pandas') if m in sys.modules)
+
+from app.services.providers import registry
+registry.get('yahoo')
+print(json.dumps({'import': imported - started, 'startup': ready - started, 'heavy': heavy,
+                  'yahoo_load': time.perf_counter() - ready}))
+'''
+
+class StartupTestCase(unittest.TestCase):
+    def test_startup_does_not_import_providers(self):
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=ROOT, check=True,
+                                capture_output=True, text=True).stdout
+        timings = json.loads(output.strip().splitlines()[-1])
+        self.assertEqual(timings['heavy'], [])
+        self.assertLess(timings['startup'], STARTUP_BUDGET)
+        self.assertLessEqual(timings['import'], timings['startup'])
+
+class ProviderRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tmp.name, 'prices.csv'), 'w') as f:
+            f.write('symbol,price,timestamp\nVOO,410.5,2024-01-02\nVFV.TO,120\n')
+        class LocalConfig(TestConfig):
+            MARKET_DATA_PROVIDERS = ['local']
+            LOCAL_PRICES_PATH = os.path.join(self.tmp.name, 'prices.csv')
+        self.app = create_app(LocalConfig)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_local_provider_only(self):
+        with mock.patch.object(registry, 'get', wraps=registry.get) as get:
+            results = market_data.fetch_prices(['VOO', 'VFV.TO', 'NOPE'], api_key='key')
+            self.assertIs(market_data.verify_symbol('NOPE', 'key'), False)
+        self.assertEqual(results, {'VOO': {'price': 410.5, 'timestamp': '2024-01-02'},
+                                   'VFV.TO': {'price': 120.0, 'timestamp': ''}})
+        self.assertEqual({c.args[0] for c in get.call_args_list}, {'local'})
+
+    def test_loads_on_first_call(self):
+        providers = ProviderRegistry(self.app)
+        provider = mock.Mock(spec=['get_prices', 'available', 'init_app'])
+        providers.register('stub', provider)
+        providers.enabled = ['stub']
+        fetch = providers.fetcher('stub', api_key='key')
+        self.assertFalse(providers.is_loaded('stub'))
+        fetch(['A'])
+        provider.init_app.assert_called_once_with(self.app)
+        provider.get_prices.assert_called_once_with(['A'])
+
+    def test_unknown_provider_is_refused(self):
+        class BadConfig(TestConfig):
+            MARKET_DATA_PROVIDERS = ['twelvedata', 'bloomberg']
+        with self.assertRaises(ValueError):
+            create_app(BadConfig)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from app import create_app
+from app.services import market_data
+from app.services.quote_cache import QuoteCache, quote_cache
+import helpers
+
+class TestConfig(helpers.TestConfig):
+    QUOTE_CACHE_TTL = 60
+    QUOTE_CACHE_NEGATIVE_TTL = 30
+    QUOTE_CACHE_STALE_TTL = 120
+
+def quote(price):
+    return {'price': price, 'timestamp': '2024-01-02 16:00:00'}
+
+class QuoteCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.cache = QuoteCache(self.app)
+
+    def age(self, symbol, seconds):
+        q, fetched_at = self.cache._lru[symbol]
+        self.cache._lru[symbol] = (q, fetched_at - seconds)
+
+    def test_fresh_stale_and_expired(self):
+        self.cache.store_results(['AAPL'], {'AAPL': quote(190.0)})
+
+        fresh, stale, missing = self.cache.lookup(['AAPL'])
+        self.assertEqual(fresh, {'AAPL': quote(190.0)})
+
+        self.age('AAPL', 90)
+        fresh, stale, missing = self.cache.lookup(['AAPL'])
+        self.assertEqual((fresh, stale, missing), ({}, {'AAPL': quote(190.0)}, []))
+
+        self.age('AAPL', 200)
+        fresh, stale, missing = self.cache.lookup(['AAPL'])
+        self.assertEqual((fresh, stale, missing), ({}, {}, ['AAPL']))
+
+        stats = self.cache.get_stats()
+        self.assertEqual((stats['hits'], stats['stale_hits'], stats['misses']), (1, 1, 1))
+
+    def test_per_symbol_ttl(self):
+        self.cache.ttls = {'VFV.TO': 600}
+        self.cache.store_results(['AAPL', 'VFV.TO'], {'AAPL': quote(1.0), 'VFV.TO': quote(2.0)})
+        self.age('AAPL', 90)
+        self.age('VFV.TO', 90)
+        fresh, stale, missing = self.cache.lookup(['AAPL', 'VFV.TO'])
+        self.assertEqual(list(fresh), ['VFV.TO'])
+        self.assertEqual(list(stale), ['AAPL'])
+
+    def test_negative_caching(self):
+        self.cache.store_results(['NOPE'], {})
+        self.assertEqual(self.cache.lookup(['NOPE']), ({}, {}, []))
+        self.assertEqual(self.cache.get_stats()['negative_hits'], 1)
+
+        self.age('NOPE', 31)
+        self.assertEqual(self.cache.lookup(['NOPE']), ({}, {}, ['NOPE']))
+
+    def test_lru_eviction(self):
+        self.cache.max_entries = 2
+        self.cache.store_results(['A', 'B'], {'A': quote(1.0), 'B': quote(2.0)})
+        self.cache.lookup(['A'])
+        self.cache.store_results(['C'], {'C': quote(3.0)})
+        self.assertEqual(list(self.cache._lru), ['A', 'C'])
+
+    def test_revalidate_keeps_stale_quote_on_failure(self):
+        self.cache.store_results(['AAPL'], {'AAPL': quote(190.0)})
+        self.age('AAPL', 90)
+        self.cache.revalidate(['AAPL'], lambda syms: {})
+        fresh, stale, missing = self.cache.lookup(['AAPL'])
+        self.assertEqual(stale, {'AAPL': quote(190.0)})
+
+        self.cache.revalidate(['AAPL'], lambda syms: {'AAPL': quote(191.0)})
+        fresh, stale, missing = self.cache.lookup(['AAPL'])
+        self.assertEqual(fresh, {'AAPL': quote(191.0)})
+
+    def test_shared_tier_between_workers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            class SharedConfig(TestConfig):
+                QUOTE_CACHE_PATH = os.path.join(tmp, 'quotes.db')
+            app = create_app(SharedConfig)
+            worker_a = QuoteCache(app)
+            worker_b = QuoteCache(app)
+
+            worker_a.store_results(['AAPL', 'NOPE'], {'AAPL': quote(190.0)})
+            fresh, stale, missing = worker_b.lookup(['AAPL', 'NOPE', 'MSFT'])
+            self.assertEqual(fresh, {'AAPL': quote(190.0)})
+            self.assertEqual(missing, ['MSFT'])
+            self.assertEqual(worker_b.get_stats()['shared_hits'], 2)
+
+class GetPricesCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.ctx = self.app.test_request_context()
+        self.ctx.push()
+
+    def tearDown(self):
+        self.ctx.pop()
+
+    def test_only_missing_symbols_go_upstream(self):
+        calls = []
+        def fake_fetch(symbols, api_key=None):
+            calls.append(list(symbols))
+            return {s: quote(10.0) for s in symbols if s != 'NOPE'}
+
+        with mock.patch.object(market_data, 'fetch_prices', side_effect=fake_fetch):
+            first = market_data.get_prices(['AAPL', 'MSFT', 'NOPE'])
+            second = market_data.get_prices(['AAPL', 'MSFT', 'NOPE', 'VOO'])
+
+        self.assertEqual(set(first), {'AAPL', 'MSFT'})
+        self.assertEqual(set(second), {'AAPL', 'MSFT', 'VOO'})
+        self.assertEqual(calls, [['AAPL', 'MSFT', 'NOPE'], ['VOO']])
+        self.assertGreater(quote_cache.get_stats()['hit_rate'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import threading
+import time
+import unittest
+from unittest import mock
+from app import create_app
+from app.services import market_data
+from app.services.providers import yahoo as yahoo_provider
+from app.services.rate_limit import TokenBucket, SingleFlight
+from stub_server import StubServer
+from helpers import TestConfig
+
+class TokenBucketTestCase(unittest.TestCase):
+    def test_acquire_and_refill(self):
+        bucket = TokenBucket(capacity=2, rate=20)
+        self.assertTrue(bucket.acquire(2))
+        self.assertFalse(bucket.acquire(1))
+        self.assertTrue(bucket.acquire(1, timeout=0.2))
+
+    def test_oversized_request_is_refused(self):
+        self.assertFalse(TokenBucket(capacity=2, rate=100).acquire(3, timeout=1))
+
+    def test_drain(self):
+        bucket = TokenBucket(capacity=5, rate=0.01)
+        bucket.drain()
+        self.assertFalse(bucket.acquire(1))
+
+class SingleFlightTestCase(unittest.TestCase):
+    def test_overlapping_calls_share_fetches(self):
+        flight = SingleFlight()
+        fetched = []
+        started = threading.Event()
+
+        def slow_fetch(symbols):
+            fetched.append(sorted(symbols))
+            started.set()
+            time.sleep(0.1)
+            return {s: s.lower() for s in symbols}
+
+        results = {}
+        first = threading.Thread(target=lambda: results.update(a=flight.run(['A', 'B'], slow_fetch)))
+        first.start()
+        started.wait()
+        results['b'] = flight.run(['B', 'C'], slow_fetch)
+        first.join()
+
+        self.assertEqual(fetched, [['A', 'B'], ['C']])
+        self.assertEqual(results['a'], {'A': 'a', 'B': 'b'})
+        self.assertEqual(results['b'], {'B': 'b', 'C': 'c'})
+
+    def test_failed_fetch_releases_waiters(self):
+        flight = SingleFlight()
+        with self.assertRaises(RuntimeError):
+            flight.run(['A'], mock.Mock(side_effect=RuntimeError))
+        self.assertEqual(flight.run(['A'], lambda s: {'A': 1}), {'A': 1})
+
+class TwelveDataBatchingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubServer().start()
+        self.stub.route('/quote', lambda q: (200, {
+            s: {'close': '1.0', 'datetime': ''} for s in q['symbol'].split(',')
+        }))
+        class StubConfig(TestConfig):
+            TWELVE_DATA_URL = self.stub.url
+            TWELVE_DATA_CREDITS_PER_MINUTE = 4
+            TWELVE_DATA_BATCH_SIZE = 2
+            TWELVE_DATA_MAX_WAIT = 0
+        self.app = create_app(StubConfig)
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_batches_within_credit_budget(self):
+        symbols = ['A', 'B', 'C', 'D', 'E']
+        with mock.patch.object(yahoo_provider, 'get_prices', return_value={}) as yahoo:
+            results = market_data.fetch_prices(symbols, api_key='free-key')
+        self.assertEqual([q['symbol'] for _, q in self.stub.requests], ['A,B', 'C,D'])
+        self.assertEqual(set(results), {'A', 'B', 'C', 'D'})
+        yahoo.assert_called_once_with(['E'])
+
+    def test_buckets_are_per_key(self):
+        with mock.patch.object(yahoo_provider, 'get_prices', return_value={}):
+            market_data.fetch_prices(['A', 'B', 'C', 'D'], api_key='key-1')
+            market_data.fetch_prices(['A', 'B'], api_key='key-2')
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_quota_error_drains_bucket(self):
+        self.stub.route('/quote', lambda q: (200, {'code': 429, 'status': 'error'}))
+        with mock.patch.object(yahoo_provider, 'get_prices', return_value={}):
+            market_data.fetch_prices(['A', 'B', 'C', 'D'], api_key='key')
+        self.assertEqual(len(self.stub.requests), 1)
+
+if __name__ == '__main__':
+    unittest.main()
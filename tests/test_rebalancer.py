@@ -0,0 +1,194 @@
+import unittest
+import numpy as np
+from app import create_app, db
+from app.models import User, Portfolio, Holding, Quote
+from app.services.rebalancer import rebalance, rebalance_batch, household_rebalance
+from helpers import TestConfig
+
+# Scenario from tests/test_app.py
+UNITS = [50, 14, 52]
+PRICES = [375.65, 450.25, 105.75]
+TARGETS = [0.5, 0.25, 0.25]
+
+class RebalancerTestCase(unittest.TestCase):
+    def test_fractional_and_whole_units(self):
+        fractional, whole, cash_left, target_values = rebalance(UNITS, PRICES, TARGETS, 5000)
+        np.testing.assert_allclose(fractional, [-2.635, 5.758, 32.125], atol=1e-3)
+        np.testing.assert_allclose(target_values, [17792.5, 8896.25, 8896.25])
+        self.assertEqual(whole.tolist(), [-2, 5, 32])
+        self.assertAlmostEqual(cash_left, 116.05, places=2)
+
+    def test_never_overspends(self):
+        rng = np.random.default_rng(7)
+        portfolios = []
+        for _ in range(200):
+            n = rng.integers(1, 12)
+            targets = rng.dirichlet(np.ones(n))
+            portfolios.append((rng.integers(0, 100, n).astype(float), rng.uniform(5, 900, n),
+                               targets, rng.uniform(0, 5000)))
+        for units, prices, targets, cash in portfolios:
+            fractional, whole, cash_left, _ = rebalance(units, prices, targets, cash)
+            self.assertGreaterEqual(cash_left, -1e-6)
+            self.assertTrue((units + whole >= 0).all())
+            self.assertAlmostEqual(cash_left, cash - float(whole @ prices), places=6)
+
+    def test_withdrawal_is_covered(self):
+        rng = np.random.default_rng(11)
+        for _ in range(200):
+            n = rng.integers(1, 12)
+            units, prices = rng.integers(1, 100, n).astype(float), rng.uniform(5, 900, n)
+            cash = -rng.uniform(0, 0.9) * float(units @ prices)
+            fractional, whole, cash_left, _ = rebalance(units, prices, rng.dirichlet(np.ones(n)), cash)
+            self.assertGreaterEqual(cash_left, -1e-6)
+            self.assertTrue((units + whole >= 0).all())
+            self.assertAlmostEqual(cash_left, cash - float(whole @ prices), places=6)
+
+    def test_spends_leftover_on_underweight_holding(self):
+        # Truncation leaves 0.95 of a unit of B unbought, worth one more unit
+        fractional, whole, cash_left, _ = rebalance([0, 0], [10, 100], [0.5, 0.5], 1190)
+        self.assertEqual(whole.tolist(), [59, 6])
+        self.assertAlmostEqual(cash_left, 0)
+
+    def test_leaves_cash_when_next_unit_is_unaffordable(self):
+        fractional, whole, cash_left, _ = rebalance([0, 0], [10, 1000], [0.5, 0.5], 1100)
+        self.assertEqual(whole.tolist(), [55, 0])
+        self.assertAlmostEqual(cash_left, 550)
+
+    def test_large_cash_is_spent_in_one_step(self):
+        fractional, whole, cash_left, _ = rebalance([0, 0], [0.5, 0.5], [1.0, 1.0], 100000.0)
+        self.assertEqual(whole.tolist(), [100000, 100000])
+        self.assertAlmostEqual(cash_left, 0)
+
+    def test_targets_over_full_allocation_never_overspend(self):
+        fractional, whole, cash_left, _ = rebalance([0, 0, 0], [7, 13, 29], [0.6, 0.6, 0.6], 10000)
+        self.assertGreaterEqual(cash_left, -1e-6)
+        self.assertAlmostEqual(cash_left, 10000 - float(whole @ [7, 13, 29]), places=6)
+
+    def test_unpriced_holdings_do_not_trade(self):
+        fractional, whole, cash_left, _ = rebalance([10, 5], [0, 20], [0.5, 0.5], 100)
+        self.assertEqual((fractional[0], whole[0]), (0, 0))
+
+    def test_batch_matches_single(self):
+        portfolios = [
+            (UNITS, PRICES, TARGETS, 5000),
+            ([10], [33.0], [1.0], 100),
+            ([0, 10], [100, 50], [0.5, 0.5], 0),
+        ]
+        for batched, p in zip(rebalance_batch(portfolios), portfolios):
+            single = rebalance(*p)
+            np.testing.assert_allclose(batched[0], single[0])
+            np.testing.assert_array_equal(batched[1], single[1])
+            self.assertAlmostEqual(batched[2], single[2])
+
+class HouseholdRebalancerTestCase(unittest.TestCase):
+    def test_trades_only_the_household_gap(self):
+        # Both accounts hold both symbols; A is overweight across the household
+        units = [[60, 10], [40, 10]]
+        prices = [10.0, 10.0]
+        fractional, whole, cash_left, target_values = household_rebalance(
+            units, prices, [[True, True], [True, True]], [0.5, 0.5], [0, 100])
+        np.testing.assert_allclose(target_values, [650, 650])
+        np.testing.assert_allclose((np.asarray(units) + fractional).sum(axis=0), [65, 65])
+        # Selling 350 of A and buying 450 of B is the least that closes the gap
+        self.assertAlmostEqual(float(np.abs(fractional).sum() * 10), 800)
+        self.assertTrue((cash_left >= -1e-9).all())
+
+    def test_moves_money_between_accounts_through_a_shared_symbol(self):
+        # The TFSA has the cash but may only buy A; the RRSP holds A and may buy B
+        fractional, whole, cash_left, _ = household_rebalance(
+            [[100, 0], [0, 0]], [10.0, 20.0], [[True, True], [True, False]], [0.5, 0.5], [0, 1000])
+        self.assertEqual(whole.tolist(), [[-100, 50], [100, 0]])
+        np.testing.assert_allclose(cash_left, [0, 0])
+
+    def test_respects_cash_and_eligibility(self):
+        rng = np.random.default_rng(3)
+        accounts, symbols = 8, 40
+        eligible = rng.random((accounts, symbols)) < 0.3
+        units = np.where(eligible & (rng.random((accounts, symbols)) < 0.7),
+                         rng.integers(0, 200, (accounts, symbols)), 0).astype(float)
+        units[~eligible & (rng.random((accounts, symbols)) < 0.1)] = 5 # positions that must not trade
+        prices = rng.uniform(5, 500, symbols)
+        cash = rng.uniform(0, 5000, accounts)
+        fractional, whole, cash_left, _ = household_rebalance(
+            units, prices, eligible, rng.dirichlet(np.ones(symbols)), cash)
+        self.assertTrue((fractional[~eligible] == 0).all() and (whole[~eligible] == 0).all())
+        self.assertTrue((units + whole >= 0).all())
+        self.assertTrue((cash_left >= -1e-6).all())
+        np.testing.assert_allclose(cash_left, cash - whole @ prices)
+
+class RebalanceRouteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_result_shows_whole_unit_trades(self):
+        user = User(username='testuser')
+        user.set_password('password')
+        p = Portfolio(name='Test Portfolio', type='TFSA', owner=user)
+        db.session.add_all([user, p])
+        for symbol, units, price in zip(['QQQM', 'BRK.B', 'VOO'], UNITS, PRICES):
+            db.session.add_all([Holding(symbol=symbol, units=units, portfolio=p), Quote(symbol=symbol, price=price)])
+        db.session.commit()
+        self.client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+
+        response = self.client.post(f'/portfolio/rebalance/{p.id}', data={
+            'cash': 5000, 'ratio_QQQM': 50, 'ratio_BRK.B': 25, 'ratio_VOO': 25
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Sell 2', response.data)
+        self.assertIn(b'Buy 32', response.data)
+        self.assertIn(b'$116.05', response.data)
+
+    def test_rejects_targets_over_100_percent(self):
+        user = User(username='testuser')
+        user.set_password('password')
+        p = Portfolio(name='Test Portfolio', type='TFSA', owner=user)
+        db.session.add_all([user, p])
+        for symbol, units, price in zip(['QQQM', 'BRK.B', 'VOO'], UNITS, PRICES):
+            db.session.add_all([Holding(symbol=symbol, units=units, portfolio=p), Quote(symbol=symbol, price=price)])
+        db.session.commit()
+        self.client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+
+        response = self.client.post(f'/portfolio/rebalance/{p.id}', data={
+            'cash': 5000, 'ratio_QQQM': 60, 'ratio_BRK.B': 30, 'ratio_VOO': 30
+        }, follow_redirects=True)
+        self.assertIn(b'add up to 120%', response.data)
+        self.assertEqual(db.session.get(Holding, 1).target_percentage, 0.0)
+
+    def test_household_plan(self):
+        user = User(username='testuser')
+        user.set_password('password')
+        rrsp = Portfolio(name='RRSP', type='RRSP', owner=user)
+        tfsa = Portfolio(name='TFSA', type='TFSA', owner=user)
+        db.session.add_all([user, rrsp, tfsa, Quote(symbol='XEQT.TO', price=10.0), Quote(symbol='ZAG.TO', price=20.0),
+                            Holding(symbol='XEQT.TO', units=100, target_percentage=50, portfolio=rrsp),
+                            Holding(symbol='ZAG.TO', units=0, target_percentage=50, portfolio=rrsp),
+                            Holding(symbol='XEQT.TO', units=0, target_percentage=100, portfolio=tfsa)])
+        db.session.commit()
+        self.client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+
+        form = self.client.get('/portfolio/household')
+        self.assertEqual(form.status_code, 200)
+        self.assertIn(b'name="ratio_ZAG.TO"', form.data)
+
+        response = self.client.post('/portfolio/household', data={
+            f'cash_{rrsp.id}': 0, f'cash_{tfsa.id}': 1000, 'ratio_XEQT.TO': 50, 'ratio_ZAG.TO': 50,
+            f'eligible_{rrsp.id}_XEQT.TO': 'on', f'eligible_{rrsp.id}_ZAG.TO': 'on',
+            f'eligible_{tfsa.id}_XEQT.TO': 'on',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Sell 100', response.data)
+        self.assertIn(b'Buy 50', response.data)
+        self.assertIn(b'Buy 100', response.data)
+        self.assertIn(b'<strong>Whole-Unit Trades:</strong> 3', response.data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from sqlalchemy import create_engine, inspect, text
+from app import create_app, db
+from app.migrations import upgrade
+from app.models import User, Portfolio, Holding, Quote
+from app.services import market_data
+from app.services.quote_cache import quote_cache
+from app.services.refresher import refresher
+from app.services.write_behind import write_buffer
+import helpers
+
+class TestConfig(helpers.TestConfig):
+    PRICE_REFRESH_INTERVAL = 60
+    PRICE_REFRESH_COLD_INTERVAL = 900
+    PRICE_REFRESH_HOT_WINDOW = 1800
+
+def fake_fetch(symbols, api_key=None):
+    return {s: {'price': 100.0, 'timestamp': '2024-01-02 16:00:00'} for s in symbols}
+
+class RefresherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(username='testuser', api_key='key')
+        self.user.set_password('password')
+        self.hot = Portfolio(name='Hot', type='TFSA', owner=self.user, last_viewed=datetime.utcnow())
+        self.cold = Portfolio(name='Cold', type='RRSP', owner=self.user)
+        db.session.add_all([self.user, self.hot, self.cold])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self):
+        self.client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+
+    def test_due_symbols_priority(self):
+        recent = datetime.utcnow() - timedelta(seconds=120)
+        db.session.add_all([
+            Holding(symbol='COLD', units=1, portfolio=self.cold),
+            Holding(symbol='OLDCOLD', units=1, portfolio=self.cold),
+            Holding(symbol='HOT', units=1, portfolio=self.hot),
+            Holding(symbol='NEW', units=1, portfolio=self.cold),
+            Quote(symbol='COLD', price=1.0, updated_at=recent),
+            Quote(symbol='OLDCOLD', price=1.0, updated_at=datetime.utcnow() - timedelta(hours=1)),
+            Quote(symbol='HOT', price=1.0, updated_at=recent),
+        ])
+        db.session.commit()
+
+        due = refresher.due_symbols()
+        self.assertEqual(due, [('NEW', 'key'), ('HOT', 'key'), ('OLDCOLD', 'key')])
+
+    def test_refresh_writes_one_shared_quote(self):
+        db.session.add_all([
+            Holding(symbol='VOO', units=1, portfolio=self.hot),
+            Holding(symbol='VOO', units=2, portfolio=self.cold),
+        ])
+        db.session.commit()
+
+        with mock.patch.object(market_data, 'fetch_prices', side_effect=fake_fetch) as fetch:
+            self.assertEqual(refresher.refresh_once(), 1)
+        fetch.assert_called_once_with(['VOO'], 'key')
+        write_buffer.flush()
+        self.assertEqual(Quote.query.count(), 1)
+        for h in Holding.query.all():
+            self.assertEqual(h.quote.price, 100.0)
+            self.assertIsNotNone(h.quote.updated_at)
+        self.assertEqual(refresher.due_symbols(), [])
+
+    def test_refresh_skips_cached_quotes(self):
+        db.session.add(Holding(symbol='VOO', units=1, portfolio=self.hot))
+        db.session.commit()
+        # A quote fetched 10 minutes ago must not be stored as updated now
+        quote_cache.store_results(['VOO'], {'VOO': {'price': 90.0, 'timestamp': 'old'}})
+        q, fetched_at = quote_cache._lru['VOO']
+        quote_cache._lru['VOO'] = (q, fetched_at - 600)
+
+        with mock.patch.object(market_data, 'fetch_prices', side_effect=fake_fetch) as fetch:
+            self.assertEqual(refresher.refresh_symbols(['VOO']), {'VOO': fake_fetch(['VOO'])['VOO']})
+        fetch.assert_called_once_with(['VOO'], None)
+        fresh, stale, missing = quote_cache.lookup(['VOO'])
+        self.assertEqual(fresh['VOO']['price'], 100.0)
+
+    def test_upsert_updates_existing_quotes(self):
+        Quote.upsert_many({'VOO': {'price': 1.0, 'timestamp': 'a'}})
+        Quote.upsert_many({'VOO': {'price': 2.0, 'timestamp': 'b'}, 'QQQ': {'price': 3.0, 'timestamp': 'c'}})
+        db.session.commit()
+        self.assertEqual({q.symbol: q.price for q in Quote.query.all()}, {'VOO': 2.0, 'QQQ': 3.0})
+
+    def test_view_does_not_fetch_prices(self):
+        db.session.add(Holding(symbol='VOO', units=2, portfolio=self.hot))
+        db.session.add(Quote(symbol='VOO', price=50.0, updated_at=datetime.utcnow() - timedelta(minutes=3)))
+        db.session.commit()
+        self.login()
+
+        with mock.patch.object(market_data, 'fetch_prices', side_effect=AssertionError('network')):
+            response = self.client.get(f'/portfolio/{self.hot.id}')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'$100.00', response.data)
+            self.assertIn(b'updated 3 min ago', response.data)
+
+            response = self.client.get(f'/portfolio/rebalance/{self.hot.id}')
+            self.assertEqual(response.status_code, 200)
+
+    def test_refresh_route(self):
+        db.session.add(Holding(symbol='VOO', units=2, portfolio=self.hot))
+        db.session.commit()
+        self.login()
+
+        with mock.patch.object(market_data, 'fetch_prices', side_effect=fake_fetch):
+            self.client.post(f'/portfolio/{self.hot.id}/refresh')
+        # Written by the buffer's own session; the test shares the request's session
+        db.session.expire_all()
+        self.assertEqual(Holding.query.first().quote.price, 100.0)
+
+class MigrationTestCase(unittest.TestCase):
+    def test_upgrade_moves_holding_prices_to_quotes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'old.db')
+            engine = create_engine(f'sqlite:///{path}')
+            with engine.begin() as conn:
+                conn.execute(text('CREATE TABLE portfolio (id INTEGER PRIMARY KEY, name VARCHAR(64) NOT NULL, '
+                                  'type VARCHAR(64), user_id INTEGER NOT NULL)'))
+                conn.execute(text('CREATE TABLE holding (id INTEGER PRIMARY KEY, symbol VARCHAR(10) NOT NULL, '
+                                  'units FLOAT NOT NULL, target_percentage FLOAT, last_price FLOAT, '
+                                  'last_price_timestamp VARCHAR(64), portfolio_id INTEGER NOT NULL)'))
+                conn.execute(text("INSERT INTO holding (symbol, units, last_price, last_price_timestamp, portfolio_id) "
+                                  "VALUES ('VOO', 1, 400.0, 'old', 1), ('VOO', 2, 410.0, 'new', 2), "
+                                  "('QQQ', 3, 300.0, 'q', 1), ('NONE', 1, NULL, NULL, 1)"))
+            engine.dispose()
+
+            class OldConfig(TestConfig):
+                SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+            app = create_app(OldConfig)
+            with app.app_context():
+                upgrade()
+                upgrade() # idempotent
+                columns = {c['name'] for c in inspect(db.engine).get_columns('portfolio')}
+                self.assertIn('last_viewed', columns)
+                quotes = {q.symbol: (q.price, q.timestamp) for q in Quote.query.all()}
+                self.assertEqual(quotes, {'VOO': (410.0, 'new'), 'QQQ': (300.0, 'q')})
+                self.assertEqual(Holding.query.filter_by(symbol='VOO').first().quote.price, 410.0)
+                db.session.remove()
+                db.engine.dispose()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+from datetime import datetime, timedelta
+from flask import template_rendered
+from flask_login import login_user
+from app import create_app, db
+from app.models import User, Portfolio, Holding, Quote
+from app.services.render_cache import render_cache, RenderCache, RENDER_CACHE_LOOKUPS
+from helpers import TestConfig
+
+class RenderCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        user = User(username='testuser')
+        user.set_password('password')
+        self.portfolio = Portfolio(name='TFSA', type='TFSA', owner=user)
+        self.holding = Holding(symbol='VOO', units=2, portfolio=self.portfolio)
+        db.session.add_all([user, self.portfolio, self.holding,
+                            Quote(symbol='VOO', price=100.0, timestamp='t', updated_at=datetime.utcnow())])
+        db.session.commit()
+        self.client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+
+        self.rendered = []
+        template_rendered.connect(self.record, self.app)
+
+    def tearDown(self):
+        template_rendered.disconnect(self.record, self.app)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def record(self, sender, template, context, **extra):
+        self.rendered.append(template.name)
+
+    def view(self):
+        self.rendered.clear()
+        response = self.client.get(f'/portfolio/{self.portfolio.id}')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_unchanged_view_is_not_rendered_again(self):
+        first = self.view()
+        self.assertIn('portfolio/_holdings.html', self.rendered)
+        hits = RENDER_CACHE_LOOKUPS.value(name='portfolio.view.holdings', result='hit')
+        self.assertEqual(self.view(), first)
+        self.assertEqual(self.rendered, ['portfolio/view.html'])
+        self.assertEqual(RENDER_CACHE_LOOKUPS.value(name='portfolio.view.holdings', result='hit'), hits + 1)
+
+    def test_new_price_or_holdings_render_again(self):
+        self.view()
+        quote = db.session.get(Quote, 'VOO')
+        quote.price, quote.updated_at = 110.0, datetime.utcnow() + timedelta(seconds=1)
+        db.session.commit()
+        self.assertIn(b'$110.00', self.view())
+        # The analytics fragment does not depend on today's prices
+        self.assertNotIn('portfolio/_analytics.html', self.rendered)
+
+        self.client.post(f'/portfolio/edit_stock/{self.holding.id}', data={'units': 3})
+        self.assertIn(b'$330.00', self.view())
+        self.assertIn('portfolio/_analytics.html', self.rendered)
+
+    def test_flashes_are_never_cached(self):
+        self.client.get('/portfolio/')
+        self.client.post(f'/portfolio/edit_stock/{self.holding.id}', data={'units': 3})
+        response = self.client.get('/portfolio/')
+        self.assertIn(b'Updated VOO units.', response.data)
+        self.assertNotIn(b'Updated VOO units.', self.client.get('/portfolio/').data)
+
+    def test_entries_are_per_user(self):
+        other = User(username='other')
+        db.session.add(other)
+        db.session.commit()
+        pages = []
+        for user in (db.session.get(User, self.portfolio.user_id), other):
+            with self.app.test_request_context('/portfolio/'):
+                login_user(user)
+                pages.append(render_cache.render('page', ('same key',), lambda: f'for {user.username}'))
+        self.assertEqual(pages, ['for testuser', 'for other'])
+
+    def test_lru_is_bounded_by_bytes(self):
+        cache = RenderCache()
+        cache.max_bytes = 25
+        with self.app.test_request_context('/'):
+            for name in ('a', 'b', 'c'):
+                cache.render(name, (), lambda: name * 10)
+            self.assertEqual((len(cache), cache.size), (2, 20))
+            # 'a' was evicted first
+            self.assertEqual(cache.render('a', (), lambda: 'rebuilt'), 'rebuilt')
+
+if __name__ == '__main__':
+    unittest.main()
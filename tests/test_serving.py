@@ -0,0 +1,124 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.migrations import upgrade
+from app.models import User, Portfolio, Holding, Quote
+from app.serving import preforked, server_options, before_fork, start_worker, warm_up, stop_worker
+from app.services.price_stream import price_hub
+from app.services.quote_cache import quote_cache
+from app.services.refresher import refresher, PriceRefresher
+from app.services.write_behind import write_buffer
+from config import Config
+
+class TestConfig(Config):
+    # Not TESTING: background threads are what is being tested
+    PRICE_REFRESH_MODE = 'off'
+    QUOTE_CACHE_BACKGROUND_REFRESH = False
+    DB_POOL_SIZE = 2
+    SERVER_THREADS = 3
+    SERVER_PIDFILE = 'server.pid'
+
+class ServingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        class FileConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(self.tmp.name, 'test.db')}"
+            QUOTE_CACHE_PATH = os.path.join(self.tmp.name, 'quote_cache.db')
+            PRICE_REFRESH_LOCK = os.path.join(self.tmp.name, 'refresher.lock')
+        self.app = create_app(preforked(FileConfig))
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        upgrade()
+
+        user = User(username='testuser')
+        user.set_password('password')
+        portfolio = Portfolio(name='TFSA', owner=user)
+        db.session.add_all([user, portfolio] + [Holding(symbol=s, units=1, portfolio=portfolio)
+                                                for s in ('VOO', 'VFV.TO', 'XEQT.TO')])
+        now = datetime.utcnow()
+        db.session.add_all([Quote(symbol='VFV.TO', price=50.0, timestamp='t', updated_at=now),
+                            Quote(symbol='XEQT.TO', price=30.0, timestamp='t', updated_at=now - timedelta(days=1))])
+        db.session.commit()
+
+    def tearDown(self):
+        stop_worker(self.app)
+        db.session.remove()
+        db.engine.dispose()
+        self.app_context.pop()
+        self.tmp.cleanup()
+
+    def test_options_come_from_config(self):
+        options = server_options(self.app)
+        self.assertTrue(options['preload_app'])
+        self.assertEqual((options['worker_class'], options['threads']), ('gthread', 3))
+        self.assertEqual(options['pidfile'], os.path.join(self.app.instance_path, 'server.pid'))
+
+    def test_streams_leave_a_thread_for_pages(self):
+        self.assertEqual(self.app.config['PRICE_STREAM_MAX_CLIENTS'], 2)
+        client = self.app.test_client()
+        client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+        with mock.patch.object(price_hub, 'start'):
+            streams = [price_hub.subscribe(['VOO']) for _ in range(2)]
+            self.assertEqual(client.get('/portfolio/1/stream').status_code, 503)
+            price_hub.unsubscribe(streams[0])
+            response = client.get('/portfolio/1/stream', buffered=False)
+            self.assertEqual(response.status_code, 200)
+            response.close()
+
+    def test_one_worker_refreshes(self):
+        self.assertEqual(Config.PRICE_REFRESH_LOCK, 'refresher.lock')
+        other_worker = PriceRefresher(self.app)
+        self.assertTrue(refresher.holds_lock())
+        self.assertFalse(other_worker.holds_lock())
+        # Taken over once the first worker stops
+        refresher.stop()
+        self.assertTrue(other_worker.holds_lock())
+        other_worker.release_lock()
+
+    def test_threads_start_when_needed(self):
+        class ThreadConfig(Config):
+            SQLALCHEMY_DATABASE_URI = self.app.config['SQLALCHEMY_DATABASE_URI']
+            QUOTE_CACHE_PATH = None
+            PRICE_REFRESH_LOCK = self.app.config['PRICE_REFRESH_LOCK']
+        with mock.patch.object(refresher, 'refresh_once', return_value=0), \
+                mock.patch.object(refresher, 'update_history', return_value={}):
+            app = create_app(ThreadConfig)
+            # Not for CLI commands or shells, which serve no requests
+            self.assertIsNone(refresher._thread)
+            self.assertIsNone(write_buffer._thread)
+            app.test_client().get('/auth/login')
+            self.assertTrue(refresher._thread.is_alive())
+            write_buffer.put_quotes({'VOO': {'price': 400.0, 'timestamp': 't'}})
+            self.assertTrue(write_buffer._thread.is_alive())
+
+    def test_threads_wait_for_the_worker(self):
+        self.assertIsNone(write_buffer._thread)
+        start_worker(self.app)
+        self.assertTrue(write_buffer._thread.is_alive())
+
+        write_buffer.put_quotes({'VOO': {'price': 400.0, 'timestamp': 't'}})
+        stop_worker(self.app)
+        # Written on the way out
+        self.assertIsNone(write_buffer._thread)
+        self.assertEqual(len(write_buffer), 0)
+        db.session.expire_all()
+        self.assertEqual(db.session.get(Quote, 'VOO').price, 400.0)
+
+    def test_warm_up_opens_connections_and_primes_quotes(self):
+        quote_cache.store.set_many({'VOO': ({'price': 400.0, 'timestamp': 't'}, time.time())})
+        before_fork(self.app)
+        self.assertEqual(db.engine.pool.checkedin(), 0)
+
+        # Connections up to the pool size; stored prices too old for the cache are left out
+        self.assertEqual(warm_up(self.app), {'connections': 2, 'quotes': 2})
+        self.assertEqual(db.engine.pool.checkedin(), 2)
+        fresh, stale, missing = quote_cache.lookup(['VOO', 'VFV.TO', 'XEQT.TO'])
+        self.assertEqual((fresh['VOO']['price'], fresh['VFV.TO']['price']), (400.0, 50.0))
+        self.assertEqual(missing, ['XEQT.TO'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from app import create_app, db
+from app.models import User
+from app.services import market_data
+from app.services.symbols import symbol_index
+import helpers
+
+class TestConfig(helpers.TestConfig):
+    SYMBOL_UNIVERSE_RELOAD_INTERVAL = 0
+
+UNIVERSE = """symbol,name
+AAPL,Apple Inc
+AMZN,Amazon.com Inc
+AA,Alcoa Corp
+VFV.TO,Vanguard S&P 500 Index ETF
+msft,Microsoft Corp
+"""
+
+class SymbolIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'symbols.csv')
+        with open(self.path, 'w') as f:
+            f.write(UNIVERSE)
+        class IndexConfig(TestConfig):
+            SYMBOL_UNIVERSE_PATH = self.path
+        self.app = create_app(IndexConfig)
+        self.app_context = self.app.test_request_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+        self.tmp.cleanup()
+
+    def test_contains(self):
+        self.assertEqual(len(symbol_index), 5)
+        self.assertTrue(symbol_index.contains('AAPL'))
+        self.assertTrue(symbol_index.contains('msft'))
+        self.assertTrue(symbol_index.contains('VFV.TO'))
+        self.assertFalse(symbol_index.contains('AAP'))
+        self.assertFalse(symbol_index.contains('AAPLX'))
+
+    def test_prefix_search(self):
+        self.assertEqual([m['symbol'] for m in symbol_index.search('a')], ['AA', 'AAPL', 'AMZN'])
+        self.assertEqual(symbol_index.search('AAP'), [{'symbol': 'AAPL', 'name': 'Apple Inc'}])
+        self.assertEqual(len(symbol_index.search('A', limit=2)), 2)
+        self.assertEqual(symbol_index.search('ZZ'), [])
+
+    def test_reloads_when_file_changes(self):
+        self.assertFalse(symbol_index.contains('SHOP.TO'))
+        symbol_index.write([('SHOP.TO', 'Shopify Inc')])
+        self.assertTrue(symbol_index.contains('SHOP.TO'))
+        self.assertFalse(symbol_index.contains('AAPL'))
+
+    def test_lookup_speed(self):
+        symbol_index.write([(f'S{i:06d}', '') for i in range(100000)])
+        self.assertEqual(len(symbol_index), 100000)
+        symbol_index.reload_interval = 300
+        started = time.perf_counter()
+        for i in range(1000):
+            symbol_index.contains(f'S{i * 97:06d}')
+        per_lookup = (time.perf_counter() - started) / 1000
+        self.assertLess(per_lookup, 0.001)
+
+    def test_check_symbol_uses_index_then_cache(self):
+        with mock.patch.object(market_data, 'verify_symbol', return_value=False) as verify:
+            self.assertTrue(market_data.check_symbol('AAPL'))
+            verify.assert_not_called()
+
+            self.assertFalse(market_data.check_symbol('NOPE'))
+            self.assertFalse(market_data.check_symbol('NOPE'))
+            verify.assert_called_once()
+
+    def test_unverifiable_symbols_are_allowed_but_not_cached(self):
+        with mock.patch.object(market_data, 'verify_symbol', return_value=None) as verify:
+            self.assertTrue(market_data.check_symbol('MAYBE'))
+            self.assertTrue(market_data.check_symbol('MAYBE'))
+        self.assertEqual(verify.call_count, 2)
+
+    def test_remembered_checks_are_bounded(self):
+        symbol_index.max_checks = 2
+        for symbol in ('A1', 'B1', 'C1'):
+            symbol_index.remember_check(symbol, False)
+            if symbol == 'B1':
+                symbol_index.cached_check('A1') # A1 is now used more recently than B1
+        self.assertIs(symbol_index.cached_check('A1'), False)
+        self.assertIsNone(symbol_index.cached_check('B1'))
+        self.assertIs(symbol_index.cached_check('C1'), False)
+
+    def test_autocomplete_endpoint(self):
+        db.create_all()
+        user = User(username='testuser')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        client = self.app.test_client()
+        client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+        response = client.get('/portfolio/symbols?q=am')
+        self.assertEqual(response.get_json(), [{'symbol': 'AMZN', 'name': 'Amazon.com Inc'}])
+        db.session.remove()
+        db.drop_all()
+
+if __name__ == '__main__':
+    unittest.main()
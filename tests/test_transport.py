@@ -0,0 +1,101 @@
+import time
+import unittest
+from unittest import mock
+import requests
+from app import create_app
+from app.services import market_data
+from app.services.providers import yahoo as yahoo_provider
+from app.services.transport import ProviderClient, CircuitBreaker, CircuitOpenError
+from stub_server import StubServer
+from helpers import TestConfig
+
+class TransportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubServer().start()
+        self.client = ProviderClient('stub', self.stub.url, connect_timeout=1, read_timeout=0.3,
+                                     retries=2, backoff=0.01,
+                                     breaker=CircuitBreaker('stub', failure_threshold=2, reset_timeout=0.2))
+
+    def tearDown(self):
+        self.client.close()
+        self.stub.stop()
+
+    def test_retries_transient_failures(self):
+        statuses = [503, 429, 200]
+        self.stub.route('/quote', lambda q: (statuses.pop(0), {'close': '1.0'}))
+        self.assertEqual(self.client.get_json('/quote', {'symbol': 'AAPL'}), {'close': '1.0'})
+        self.assertEqual(len(self.stub.requests), 3)
+        self.assertEqual(self.client.breaker.state, 'closed')
+
+    def test_does_not_retry_client_errors(self):
+        self.stub.route('/quote', lambda q: (400, {'code': 400}))
+        self.assertEqual(self.client.get('/quote').status_code, 400)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_read_timeout(self):
+        self.stub.route('/quote', lambda q: (200, {}))
+        self.stub.delay = 0.5
+        started = time.monotonic()
+        with self.assertRaises(requests.Timeout):
+            self.client.get('/quote')
+        # three attempts, each cut off by the read timeout
+        self.assertLess(time.monotonic() - started, 1.5)
+
+    def test_circuit_breaker_opens_and_recovers(self):
+        self.stub.route('/quote', lambda q: (500, {}))
+        for _ in range(2):
+            with self.assertRaises(requests.HTTPError):
+                self.client.get('/quote')
+        self.assertEqual(self.client.breaker.state, 'open')
+
+        calls = len(self.stub.requests)
+        with self.assertRaises(CircuitOpenError):
+            self.client.get('/quote')
+        self.assertEqual(len(self.stub.requests), calls)
+
+        time.sleep(0.25)
+        self.stub.route('/quote', lambda q: (200, {}))
+        self.client.get('/quote')
+        self.assertEqual(self.client.breaker.state, 'closed')
+
+    def test_reuses_connections(self):
+        self.stub.route('/quote', lambda q: (200, {}))
+        for _ in range(3):
+            self.client.get('/quote')
+        adapter = self.client.session.get_adapter(self.stub.url)
+        self.assertEqual(len(adapter.poolmanager.pools), 1)
+
+class TwelveDataFallbackTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubServer().start()
+        class StubConfig(TestConfig):
+            TWELVE_DATA_URL = self.stub.url
+            MARKET_DATA_READ_TIMEOUT = 0.3
+            MARKET_DATA_RETRIES = 0
+            CIRCUIT_BREAKER_THRESHOLD = 1
+            CIRCUIT_BREAKER_RESET = 60
+        self.app = create_app(StubConfig)
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_quotes_from_stub(self):
+        self.stub.route('/quote', lambda q: (200, {
+            s: {'close': '10.5', 'datetime': '2024-01-02'} for s in q['symbol'].split(',')
+        }))
+        with mock.patch.object(yahoo_provider, 'get_prices', return_value={}) as yahoo:
+            results = market_data.fetch_prices(['AAPL', 'MSFT'], api_key='key')
+        self.assertEqual(results['AAPL'], {'price': 10.5, 'timestamp': '2024-01-02'})
+        yahoo.assert_not_called()
+
+    def test_open_circuit_goes_straight_to_fallback(self):
+        self.stub.route('/quote', lambda q: (502, {}))
+        fallback = {'AAPL': {'price': 1.0, 'timestamp': ''}}
+        with mock.patch.object(yahoo_provider, 'get_prices', return_value=fallback):
+            self.assertEqual(market_data.fetch_prices(['AAPL'], api_key='key'), fallback)
+            calls = len(self.stub.requests)
+            self.assertEqual(market_data.fetch_prices(['AAPL'], api_key='key'), fallback)
+        self.assertEqual(len(self.stub.requests), calls)
+
+if __name__ == '__main__':
+    unittest.main()
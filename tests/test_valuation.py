@@ -0,0 +1,100 @@
+import unittest
+from contextlib import contextmanager
+from flask import g
+from sqlalchemy import event
+from app import create_app, db
+from app.models import User, Portfolio, Holding, Quote
+from app.services.valuation import portfolio_summaries, value_holdings
+from helpers import TestConfig
+
+@contextmanager
+def count_queries():
+    """Collects the SQL statements run inside the block."""
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+class ValuationQueryTestCase(unittest.TestCase):
+    PORTFOLIOS = 20
+    HOLDINGS = 10
+
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(username='testuser')
+        self.user.set_password('password')
+        db.session.add(self.user)
+        for i in range(self.HOLDINGS):
+            db.session.add(Quote(symbol=f'S{i}', price=10.0 * (i + 1)))
+        for p in range(self.PORTFOLIOS):
+            portfolio = Portfolio(name=f'P{p}', type='TFSA', owner=self.user)
+            for i in range(self.HOLDINGS):
+                db.session.add(Holding(symbol=f'S{i}', units=p + 1, portfolio=portfolio))
+        db.session.add(Portfolio(name='Empty', type='RRSP', owner=self.user))
+        db.session.commit()
+        self.user_id = self.user.id
+        self.portfolio_id = Portfolio.query.first().id
+        # Start every test with an empty identity map, as a new request would
+        db.session.expunge_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def login(self):
+        self.client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+
+    def get(self, url):
+        # The test client shares this app context's session and g; clear them
+        # so the request loads everything itself
+        db.session.expunge_all()
+        g.pop('_login_user', None)
+        with count_queries() as statements:
+            response = self.client.get(url)
+        return response, statements
+
+    def test_summaries_in_one_statement(self):
+        with count_queries() as statements:
+            summaries = portfolio_summaries(self.user_id)
+            names = [s['portfolio'].name for s in summaries]
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(len(summaries), self.PORTFOLIOS + 1)
+        self.assertEqual(summaries[0]['total_value'], 550.0) # 1 unit each of 10..100
+        self.assertEqual(summaries[-1]['holdings_count'], 0)
+        self.assertEqual(summaries[-1]['total_value'], 0)
+        self.assertEqual(names[-1], 'Empty')
+
+    def test_value_holdings_in_one_statement(self):
+        with count_queries() as statements:
+            holdings, rows, total = value_holdings(self.portfolio_id)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(total, 550.0)
+
+    def test_index_query_count(self):
+        self.login()
+        response, statements = self.get('/portfolio/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'$550.00', response.data)
+        # load_user + one aggregate valuation query
+        self.assertEqual(len(statements), 2, statements)
+
+    def test_view_query_count(self):
+        self.login()
+        self.client.get(f'/portfolio/{self.portfolio_id}') # first view records last_viewed
+        response, statements = self.get(f'/portfolio/{self.portfolio_id}')
+        self.assertEqual(response.status_code, 200)
+        # load_user, portfolio, holdings joined to quotes (the owner check hits the identity map)
+        self.assertEqual(len(statements), 3, statements)
+
+if __name__ == '__main__':
+    unittest.main()
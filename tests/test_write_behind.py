@@ -0,0 +1,101 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from sqlalchemy import event
+from app import create_app, db
+from app.models import User, Portfolio, Holding, Quote
+from app.services import market_data
+from app.services.refresher import refresher
+from app.services.write_behind import write_buffer
+import helpers
+
+class TestConfig(helpers.TestConfig):
+    WRITE_BEHIND_MAX_PENDING = 3
+
+def quote(price, timestamp='t'):
+    return {'price': price, 'timestamp': timestamp}
+
+class WriteBehindTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        user = User(username='testuser', api_key='key')
+        user.set_password('password')
+        self.portfolio = Portfolio(name='TFSA', owner=user)
+        db.session.add_all([user, self.portfolio, Holding(symbol='VOO', units=2, portfolio=self.portfolio),
+                            Quote(symbol='VOO', price=10.0, timestamp='t', updated_at=datetime(2024, 1, 2))])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_view_is_read_only(self):
+        self.client.post('/auth/login', data={'username': 'testuser', 'password': 'password'})
+        writes = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if not statement.lstrip().upper().startswith('SELECT'):
+                writes.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.assertEqual(self.client.get(f'/portfolio/{self.portfolio.id}').status_code, 200)
+            self.assertEqual(self.client.get(f'/api/portfolios/{self.portfolio.id}/valuation').status_code, 200)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(writes, [])
+
+        self.assertEqual(write_buffer.flush(), 1)
+        db.session.expire_all()
+        self.assertIsNotNone(db.session.get(Portfolio, self.portfolio.id).last_viewed)
+
+    def test_unchanged_quotes_are_dropped(self):
+        self.assertEqual(write_buffer.put_quotes({'VOO': quote(10.0), 'QQQ': quote(5.0)}), 2)
+        self.assertEqual(write_buffer.put_quotes({'QQQ': quote(5.0)}), 0)
+        write_buffer.flush()
+        self.assertEqual(write_buffer.put_quotes({'QQQ': quote(5.0)}), 0)
+        self.assertEqual(write_buffer.put_quotes({'QQQ': quote(6.0)}), 1)
+        write_buffer.flush()
+
+        db.session.expire_all()
+        # VOO was already stored with that price, so the upsert left it alone
+        self.assertEqual(db.session.get(Quote, 'VOO').updated_at, datetime(2024, 1, 2))
+        self.assertEqual(db.session.get(Quote, 'QQQ').price, 6.0)
+
+    def test_full_buffer_flushes(self):
+        write_buffer.put_quotes({'A': quote(1.0), 'B': quote(2.0)})
+        self.assertEqual(len(write_buffer), 2)
+        write_buffer.touch(self.portfolio.id)
+        self.assertEqual(len(write_buffer), 0)
+        self.assertEqual(Quote.query.count(), 3)
+
+    def test_failed_flush_keeps_entries(self):
+        write_buffer.put_quotes({'A': quote(1.0)})
+        with mock.patch.object(Quote, 'upsert_many', side_effect=RuntimeError('locked')), \
+             self.assertLogs('app.services.write_behind', level='WARNING'):
+            self.assertEqual(write_buffer.flush(), 0)
+        self.assertEqual(len(write_buffer), 1)
+        write_buffer.close() # as at shutdown
+        self.assertEqual(db.session.get(Quote, 'A').price, 1.0)
+
+    def test_refresher_skips_checked_unchanged_symbols(self):
+        yesterday = datetime.utcnow() - timedelta(days=1)
+        db.session.get(Quote, 'VOO').updated_at = yesterday
+        db.session.commit()
+        self.assertEqual(refresher.due_symbols(), [('VOO', 'key')])
+        with mock.patch.object(market_data, 'fetch_prices', return_value={'VOO': quote(10.0)}):
+            refresher.refresh_once()
+        write_buffer.flush()
+        db.session.expire_all()
+        # The stored quote did not change, but the refresher knows it just checked it
+        self.assertEqual(db.session.get(Quote, 'VOO').updated_at, yesterday)
+        self.assertEqual(refresher.due_symbols(), [])
+
+if __name__ == '__main__':
+    unittest.main()